@@ -13,6 +13,7 @@ CREATE EXTENSION IF NOT EXISTS pgrouting;
 CREATE TABLE IF NOT EXISTS red_vial (
   id BIGSERIAL PRIMARY KEY,
   osm_id BIGINT,
+  segmento INTEGER,
   nombre TEXT,
   tipo_via TEXT,
   geom geometry(LineString, 4326) NOT NULL,
@@ -21,6 +22,7 @@ CREATE TABLE IF NOT EXISTS red_vial (
   length_m DOUBLE PRECISION,
   costo DOUBLE PRECISION,
   reverse_costo DOUBLE PRECISION,
+  geom_utm geometry(LineString, 32719) GENERATED ALWAYS AS (ST_Transform(geom, 32719)) STORED,
   CONSTRAINT enforce_dims_red_vial CHECK (ST_NDims(geom) = 2),
   CONSTRAINT enforce_srid_red_vial CHECK (ST_SRID(geom) = 4326)
 );
@@ -29,9 +31,14 @@ CREATE INDEX IF NOT EXISTS red_vial_geom_idx ON red_vial USING GIST(geom);
 CREATE INDEX IF NOT EXISTS red_vial_source_idx ON red_vial(source);
 CREATE INDEX IF NOT EXISTS red_vial_target_idx ON red_vial(target);
 CREATE INDEX IF NOT EXISTS red_vial_osm_id_idx ON red_vial(osm_id);
+CREATE INDEX IF NOT EXISTS red_vial_osm_segmento_idx ON red_vial(osm_id, segmento);
+CREATE INDEX IF NOT EXISTS red_vial_geom_utm_idx ON red_vial USING GIST(geom_utm);
 
 COMMENT ON TABLE red_vial IS 'Red vial extraída de OpenStreetMap para routing';
-COMMENT ON COLUMN red_vial.length_m IS 'Longitud del segmento en metros';
+COMMENT ON COLUMN red_vial.length_m IS 'Longitud geodésica del segmento en metros (calculada en el ETL, llega con la carga)';
+COMMENT ON COLUMN red_vial.geom_utm IS 'geom en UTM 19S (EPSG:32719), generada; para ST_DWithin/ST_Buffer en metros sin reproyectar';
+COMMENT ON COLUMN red_vial.tipo_via IS 'highway de OSM; conector = arista agregada por el QA de topología (fix_topology) entre componentes';
+COMMENT ON COLUMN red_vial.segmento IS 'Orden del tramo dentro de su vía OSM (vías nodadas); (osm_id, segmento) es la clave del refresco incremental';
 
 -- ============================================================
 -- 2. OFICINAS (Metadata)
@@ -48,12 +55,15 @@ CREATE TABLE IF NOT EXISTS oficinas (
   geom geometry(Point, 4326),
   horario_apertura TIME,
   horario_cierre TIME,
+  horario_ventanas JSONB,
   dias_atencion TEXT[],
   telefono TEXT,
   email TEXT,
   url TEXT,
   es_turno BOOLEAN DEFAULT false,
   activo BOOLEAN DEFAULT true,
+  vertex_id BIGINT,
+  vertex_dist_m DOUBLE PRECISION,
   created_at TIMESTAMP DEFAULT NOW(),
   updated_at TIMESTAMP DEFAULT NOW()
 );
@@ -61,9 +71,13 @@ CREATE TABLE IF NOT EXISTS oficinas (
 CREATE INDEX IF NOT EXISTS oficinas_geom_idx ON oficinas USING GIST(geom);
 CREATE INDEX IF NOT EXISTS oficinas_tipo_idx ON oficinas(tipo);
 CREATE INDEX IF NOT EXISTS oficinas_activo_idx ON oficinas(activo);
+CREATE INDEX IF NOT EXISTS oficinas_vertex_id_idx ON oficinas(vertex_id);
+CREATE UNIQUE INDEX IF NOT EXISTS oficinas_clave_idx ON oficinas(tipo, nombre, lat, lon);
 
 COMMENT ON TABLE oficinas IS 'Oficinas públicas (notarías, SII, ChileAtiende)';
 COMMENT ON COLUMN oficinas.tipo IS 'notaria | sii | chileatiende | registro_civil | conservador';
+COMMENT ON COLUMN oficinas.horario_ventanas IS 'Ventanas de atención en minutos del día: {semana, sabado, domingo, peak} (ruteo_temporal)';
+COMMENT ON COLUMN oficinas.vertex_id IS 'Vértice más cercano de red_vial_vertices_pgr (componente principal)';
 
 -- Trigger para sincronizar geometría desde lat/lon
 CREATE OR REPLACE FUNCTION oficinas_sync_geom()
@@ -116,6 +130,8 @@ CREATE TABLE IF NOT EXISTS amenazas (
   activo BOOLEAN DEFAULT true,
   fuente TEXT,
   datos_raw JSONB,
+  vertex_id BIGINT,
+  vertex_dist_m DOUBLE PRECISION,
   created_at TIMESTAMP DEFAULT NOW()
 );
 
@@ -123,6 +139,7 @@ CREATE INDEX IF NOT EXISTS amenazas_geom_idx ON amenazas USING GIST(geom);
 CREATE INDEX IF NOT EXISTS amenazas_tipo_idx ON amenazas(tipo);
 CREATE INDEX IF NOT EXISTS amenazas_activo_idx ON amenazas(activo);
 CREATE INDEX IF NOT EXISTS amenazas_fecha_inicio_idx ON amenazas(fecha_inicio);
+CREATE INDEX IF NOT EXISTS amenazas_vertex_id_idx ON amenazas(vertex_id);
 
 COMMENT ON TABLE amenazas IS 'Eventos que afectan routing (alertas, cortes, etc)';
 COMMENT ON COLUMN amenazas.severidad IS '1=bajo, 2=medio, 3=alto, 4=muy_alto, 5=critico';
@@ -143,6 +160,43 @@ CREATE TRIGGER amenazas_geom_trigger
 BEFORE INSERT OR UPDATE ON amenazas
 FOR EACH ROW EXECUTE FUNCTION amenazas_sync_geom();
 
+-- Penalización de aristas por amenazas (mantenida por etl/penalizacion_amenazas.py)
+CREATE TABLE IF NOT EXISTS red_vial_penalizacion (
+  edge_id BIGINT PRIMARY KEY REFERENCES red_vial(id) ON DELETE CASCADE,
+  multiplicador DOUBLE PRECISION NOT NULL DEFAULT 1,
+  bloqueado BOOLEAN NOT NULL DEFAULT false,
+  amenaza_ids INTEGER[] NOT NULL,
+  actualizado TIMESTAMP DEFAULT NOW()
+);
+
+-- Foto de las amenazas ya aplicadas: permite recalcular sólo lo que cambió
+CREATE TABLE IF NOT EXISTS amenazas_aplicadas (
+  amenaza_id INTEGER PRIMARY KEY,
+  geom geometry(Point, 4326) NOT NULL,
+  radio_afectacion_m DOUBLE PRECISION NOT NULL,
+  severidad INTEGER NOT NULL
+);
+
+-- Índice GiST sobre geography para ST_DWithin en metros (red_vial usa geom_utm)
+CREATE INDEX IF NOT EXISTS amenazas_geog_idx ON amenazas USING GIST((geom::geography));
+
+COMMENT ON TABLE red_vial_penalizacion IS 'Multiplicador de costo / bloqueo por arista dentro del radio de amenazas activas';
+COMMENT ON COLUMN red_vial_penalizacion.bloqueado IS 'true si alguna amenaza crítica (severidad 5) la alcanza';
+
+-- Perfil temporal de penalización por arista (etl/ruteo_temporal.py): intervalos sin solape
+-- según fecha_inicio/fecha_fin de las amenazas vigentes y programadas
+CREATE TABLE IF NOT EXISTS red_vial_penalizacion_temporal (
+  edge_id BIGINT REFERENCES red_vial(id) ON DELETE CASCADE,
+  desde TIMESTAMP NOT NULL,
+  hasta TIMESTAMP,
+  multiplicador DOUBLE PRECISION NOT NULL DEFAULT 1,
+  bloqueado BOOLEAN NOT NULL DEFAULT false,
+  amenaza_ids INTEGER[] NOT NULL,
+  PRIMARY KEY (edge_id, desde)
+);
+
+COMMENT ON COLUMN red_vial_penalizacion_temporal.hasta IS 'NULL = la amenaza no tiene término conocido';
+
 -- ============================================================
 -- 5. TRAMITES (Catálogo)
 -- ============================================================
@@ -200,12 +254,133 @@ CREATE TABLE IF NOT EXISTS rutas_calculadas (
   considera_amenazas BOOLEAN DEFAULT false,
   amenazas_evitadas INTEGER[],
   fecha_calculo TIMESTAMP DEFAULT NOW(),
-  parametros JSONB
+  parametros JSONB,
+  -- Clave de caché de tramos (etl/cache_rutas.py); NULL en rutas de historial
+  origen_vertex BIGINT,
+  destino_vertex BIGINT,
+  perfil TEXT,
+  version_topologia INTEGER,
+  version_amenazas INTEGER,
+  edge_ids BIGINT[]
 );
 
 CREATE INDEX IF NOT EXISTS rutas_geom_idx ON rutas_calculadas USING GIST(geom);
 CREATE INDEX IF NOT EXISTS rutas_tramite_idx ON rutas_calculadas(tramite_id);
 CREATE INDEX IF NOT EXISTS rutas_fecha_idx ON rutas_calculadas(fecha_calculo);
+CREATE UNIQUE INDEX IF NOT EXISTS rutas_cache_clave_idx
+  ON rutas_calculadas (origen_vertex, destino_vertex, perfil, version_topologia, version_amenazas)
+  WHERE origen_vertex IS NOT NULL;
+
+-- k alternativas por tramo (Yen / pgr_KSP), misma clave que la caché + rango
+CREATE TABLE IF NOT EXISTS rutas_alternativas (
+  origen_vertex BIGINT NOT NULL,
+  destino_vertex BIGINT NOT NULL,
+  perfil TEXT NOT NULL,
+  version_topologia INTEGER NOT NULL,
+  version_amenazas INTEGER NOT NULL,
+  rango INTEGER NOT NULL,
+  edge_ids BIGINT[] NOT NULL,
+  costo DOUBLE PRECISION,
+  distancia_m DOUBLE PRECISION,
+  toca_amenazas BOOLEAN DEFAULT false,
+  geom geometry(LineString, 4326),
+  calculado TIMESTAMP DEFAULT NOW(),
+  PRIMARY KEY (origen_vertex, destino_vertex, perfil, version_topologia, version_amenazas, rango)
+);
+
+CREATE INDEX IF NOT EXISTS rutas_alternativas_geom_idx ON rutas_alternativas USING GIST(geom);
+
+-- Versiones de topología y de amenazas activas (invalidan la caché de rutas)
+CREATE TABLE IF NOT EXISTS versiones_red (
+  clave TEXT PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 1,
+  actualizado TIMESTAMP DEFAULT NOW()
+);
+INSERT INTO versiones_red (clave) VALUES ('topologia'), ('amenazas') ON CONFLICT DO NOTHING;
+
+-- Isócronas de caminata por oficina (etl/isocronas.py)
+CREATE TABLE IF NOT EXISTS isocronas (
+  oficina_id INTEGER REFERENCES oficinas(id) ON DELETE CASCADE,
+  minutos INTEGER NOT NULL,
+  geom geometry(MultiPolygon, 4326),
+  vertex_id BIGINT,
+  firma_amenazas TEXT,
+  version_topologia INTEGER,
+  n_vertices INTEGER,
+  calculado TIMESTAMP DEFAULT NOW(),
+  PRIMARY KEY (oficina_id, minutos)
+);
+
+CREATE INDEX IF NOT EXISTS isocronas_geom_idx ON isocronas USING GIST(geom);
+
+COMMENT ON TABLE isocronas IS 'Áreas alcanzables caminando 5/10/15/30 min desde cada oficina activa';
+COMMENT ON COLUMN isocronas.firma_amenazas IS 'md5 de las amenazas al alcance al calcular; si cambia se recalcula';
+
+-- Distancia de red entre pares de oficinas activas (etl/distancias_oficinas.py)
+CREATE TABLE IF NOT EXISTS distancias_oficinas (
+  origen_id INTEGER REFERENCES oficinas(id) ON DELETE CASCADE,
+  destino_id INTEGER REFERENCES oficinas(id) ON DELETE CASCADE,
+  origen_vertex BIGINT,
+  destino_vertex BIGINT,
+  distancia_m DOUBLE PRECISION,
+  tiempo_caminata_min DOUBLE PRECISION,
+  version_topologia INTEGER,
+  calculado TIMESTAMP DEFAULT NOW(),
+  PRIMARY KEY (origen_id, destino_id)
+);
+
+CREATE INDEX IF NOT EXISTS distancias_oficinas_vertices_idx ON distancias_oficinas(origen_vertex, destino_vertex);
+
+COMMENT ON TABLE distancias_oficinas IS 'Distancia de red base y minutos caminando entre cada par de oficinas activas';
+COMMENT ON COLUMN distancias_oficinas.distancia_m IS 'NULL si no hay camino en la red';
+
+-- Criticidad de aristas por demanda oficina→oficina (etl/criticidad_aristas.py)
+CREATE TABLE IF NOT EXISTS criticidad_aristas (
+  edge_id INTEGER PRIMARY KEY REFERENCES red_vial(id) ON DELETE CASCADE,
+  pares DOUBLE PRECISION NOT NULL,
+  criticidad DOUBLE PRECISION NOT NULL,
+  exacta BOOLEAN,
+  version_topologia INTEGER,
+  calculado TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS criticidad_aristas_criticidad_idx ON criticidad_aristas(criticidad DESC);
+
+COMMENT ON TABLE criticidad_aristas IS 'Betweenness de aristas restringida a pares de oficinas activas';
+COMMENT ON COLUMN criticidad_aristas.pares IS 'Pares oficina→oficina cuyo camino mínimo usa la arista (estimado si exacta = false)';
+COMMENT ON COLUMN criticidad_aristas.criticidad IS 'pares / máximo de la red (0-1)';
+
+-- Simulación Monte Carlo de fallas por amenazas (etl/simulacion_fallas.py)
+CREATE TABLE IF NOT EXISTS simulaciones_fallas (
+  id SERIAL PRIMARY KEY,
+  escenarios INTEGER NOT NULL,
+  semilla INTEGER,
+  amenazas INTEGER,
+  aristas_expuestas INTEGER,
+  aristas_caidas_media DOUBLE PRECISION,
+  version_topologia INTEGER,
+  parametros JSONB,
+  segundos DOUBLE PRECISION,
+  ejecutado TIMESTAMP DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS simulacion_fallas_comunas (
+  simulacion_id INTEGER REFERENCES simulaciones_fallas(id) ON DELETE CASCADE,
+  comuna TEXT NOT NULL,
+  oficinas INTEGER,
+  pares INTEGER,
+  alcanzabilidad_media DOUBLE PRECISION,
+  alcanzabilidad_p05 DOUBLE PRECISION,
+  inflacion_media DOUBLE PRECISION,
+  inflacion_p95 DOUBLE PRECISION,
+  prob_desconexion DOUBLE PRECISION,
+  PRIMARY KEY (simulacion_id, comuna)
+);
+
+COMMENT ON TABLE simulacion_fallas_comunas IS 'Resiliencia por comuna de origen: pares de oficinas alcanzables e inflación del tiempo de viaje bajo fallas aleatorias';
+COMMENT ON COLUMN simulacion_fallas_comunas.inflacion_media IS 'Distancia con fallas / distancia intacta, promedio sobre pares alcanzables y escenarios';
+COMMENT ON COLUMN simulacion_fallas_comunas.inflacion_p95 IS 'Percentil 95 de la inflación por viaje, sobre pares alcanzables de todos los escenarios';
+COMMENT ON COLUMN simulacion_fallas_comunas.prob_desconexion IS 'Fracción de escenarios con al menos un par de oficinas desconectado';
 
 COMMENT ON TABLE rutas_calculadas IS 'Historial de rutas para análisis';
 
@@ -235,6 +410,13 @@ WHERE activo = true
   AND fecha_inicio <= NOW()
   AND (fecha_fin IS NULL OR fecha_fin >= NOW());
 
+-- Vista: Resiliencia por comuna (última simulación de fallas)
+CREATE OR REPLACE VIEW v_resiliencia_comunas AS
+SELECT c.*, s.escenarios, s.ejecutado
+FROM simulacion_fallas_comunas c
+JOIN simulaciones_fallas s ON s.id = c.simulacion_id
+WHERE s.id = (SELECT MAX(id) FROM simulaciones_fallas);
+
 -- ============================================================
 -- 8. FUNCIONES AUXILIARES
 -- ============================================================
@@ -275,6 +457,34 @@ BEGIN
 END;
 $$ LANGUAGE plpgsql;
 
+-- Función: Línea de una ruta en el sentido de viaje. Las aristas se guardan
+-- con source al inicio de su geometría; las recorridas de target a source se
+-- invierten para que la línea sea continua desde p_origen.
+CREATE OR REPLACE FUNCTION linea_ruta(p_edge_ids BIGINT[], p_origen BIGINT)
+RETURNS geometry AS $$
+DECLARE
+  v_actual BIGINT := p_origen;
+  v_partes geometry[] := '{}';
+  r RECORD;
+BEGIN
+  FOR r IN
+    SELECT rv.source, rv.target, rv.geom
+    FROM unnest(p_edge_ids) WITH ORDINALITY AS e(id, ord)
+    JOIN red_vial rv ON rv.id = e.id
+    ORDER BY e.ord
+  LOOP
+    IF r.source = v_actual THEN
+      v_partes := v_partes || r.geom;
+      v_actual := r.target;
+    ELSE
+      v_partes := v_partes || ST_Reverse(r.geom);
+      v_actual := r.source;
+    END IF;
+  END LOOP;
+  RETURN ST_MakeLine(v_partes);
+END;
+$$ LANGUAGE plpgsql STABLE;
+
 -- ============================================================
 -- FIN DEL SCHEMA
 -- ============================================================
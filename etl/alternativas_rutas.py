@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Precálculo de k rutas alternativas (Yen) para pares frecuentes de oficinas.
+Pares frecuentes: para cada paso consecutivo de los trámites (tipo A → tipo B),
+cada oficina de tipo A con sus VECINAS oficinas de tipo B más cercanas.
+Las alternativas quedan en rutas_alternativas (cache_rutas) para que la
+generación de rutas y el servicio nunca esperen a un cálculo de KSP.
+Los pares se reparten en un pool de procesos que comparte el grafo por fork.
+Sólo con amenazas (RUTEO_AMENAZAS=1): sin ellas etl_ruta_dijkstra nunca usa
+alternativas (ver elegir_alternativa), así que no hay nada que precalcular.
+"""
+import multiprocessing as mp
+import os
+
+import psycopg2
+
+from cache_rutas import PERFIL_AMENAZAS, CacheRutas
+from etl_ruta_dijkstra import CONSIDERA_AMENAZAS, K_ALTERNATIVAS, limite_alternativas
+from grafo_ruteo import cargar_grafo
+from loader_infraestructura import asegurar_componentes
+from penalizacion_amenazas import SQL_ARISTAS_PENALIZADAS, aristas_penalizadas
+
+VECINAS = int(os.getenv("ALTERNATIVAS_VECINAS", "3"))
+PROCESOS = int(os.getenv("ALTERNATIVAS_PROCESOS", str(os.cpu_count() or 1)))
+
+# Grafo compartido con los workers (fork)
+_GRAFO = None
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def pares_frecuentes(cur, vecinas=VECINAS):
+    """
+    Pares (vertex origen, vertex destino, distancia directa en metros) entre oficinas de pasos
+    consecutivos de algún trámite. Si varias oficinas caen en el mismo par de vértices, la mayor distancia.
+    """
+    cur.execute("""
+        WITH pasos AS (
+            SELECT p->>'oficina_tipo' AS tipo, (p->>'orden')::int AS orden, t.id AS tramite
+            FROM tramites t, jsonb_array_elements(t.pasos) p
+        ), transiciones AS (
+            SELECT DISTINCT a.tipo AS tipo_a, b.tipo AS tipo_b
+            FROM pasos a JOIN pasos b ON b.tramite = a.tramite AND b.orden = a.orden + 1
+        )
+        SELECT oa.vertex_id, ob.vertex_id, MAX(ST_Distance(oa.geom::geography, ob.geom::geography))
+        FROM transiciones tr
+        JOIN oficinas oa ON oa.tipo = tr.tipo_a AND oa.activo AND oa.vertex_id IS NOT NULL
+        CROSS JOIN LATERAL (
+            SELECT o.vertex_id, o.geom FROM oficinas o
+            WHERE o.tipo = tr.tipo_b AND o.activo AND o.vertex_id IS NOT NULL AND o.vertex_id <> oa.vertex_id
+            ORDER BY o.geom <-> oa.geom LIMIT %s
+        ) ob
+        GROUP BY oa.vertex_id, ob.vertex_id;
+    """, (vecinas,))
+    return [(int(a), int(b), float(d)) for a, b, d in cur.fetchall()]
+
+
+def _alternativas(par):
+    """Worker: k caminos del par (origen, destino, distancia directa) → (par, [(costo, distancia, edge_ids)])."""
+    caminos = _GRAFO.k_caminos(par[0], par[1], K_ALTERNATIVAS, limite=limite_alternativas(par[2]))
+    return par, [(c, sum(f["distancia_m"] for f in filas), [f["edge"] for f in filas]) for c, filas in caminos]
+
+
+def main(out_dir="/app/out", amenazas=CONSIDERA_AMENAZAS, procesos=PROCESOS):
+    global _GRAFO
+    print(f"🔀 ALTERNATIVAS: {K_ALTERNATIVAS} rutas por par frecuente de oficinas (Yen)")
+    if K_ALTERNATIVAS < 2:
+        print("   RUTEO_K_ALTERNATIVAS < 2: nada que precalcular")
+        return 0
+    if not amenazas:
+        print("   Sin amenazas (RUTEO_AMENAZAS=0) las alternativas no se usan: nada que precalcular")
+        return 0
+    conn = get_conn()
+    asegurar_componentes(conn)
+    cache = CacheRutas(conn, PERFIL_AMENAZAS)
+    cur = conn.cursor()
+    pares = pares_frecuentes(cur)
+    pendientes = [p for p in pares if cache.alternativas(p[0], p[1]) is None]
+    print(f"   Pares frecuentes: {len(pares)} ({len(pares) - len(pendientes)} ya en caché)")
+    if not pendientes:
+        cur.close()
+        conn.close()
+        return 0
+
+    _GRAFO = cargar_grafo(conn, sql_aristas=SQL_ARISTAS_PENALIZADAS, con_coordenadas=False)
+    guardados = 0
+    with mp.get_context("fork").Pool(max(1, procesos)) as pool:
+        for (o, d, _), caminos in pool.imap_unordered(_alternativas, pendientes, chunksize=8):
+            if not caminos:
+                continue
+            penalizadas = aristas_penalizadas(cur, {e for _, _, edges in caminos for e in edges})
+            alts = [{"rango": r, "costo": float(c), "distancia_m": float(dist), "toca_amenazas": any(e in penalizadas for e in edges),
+                     "filas": [{"edge": e} for e in edges]} for r, (c, dist, edges) in enumerate(caminos, start=1)]
+            # Sólo a la BD: las filas sin geometría no sirven para el LRU de este proceso
+            cache.guardar_alternativas(o, d, alts, en_lru=False)
+            guardados += 1
+    _GRAFO = None
+    cur.close()
+    conn.close()
+    print(f"✓ Alternativas guardadas para {guardados} pares")
+    return guardados
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark: pgr_dijkstra vs Dijkstra en memoria vs Contraction Hierarchies
+sobre los mismos pares origen/destino (vértices de la componente principal).
+Verifica además que los tres entreguen el mismo costo.
+
+Uso: python benchmark_ch.py [pares]   (por defecto 100, o BENCH_PARES)
+"""
+import os
+import random
+import statistics
+import sys
+import time
+
+from contraccion_jerarquica import ARCHIVO_CH, ConsultaCH, construir_ch, get_conn, guardar_ch
+from grafo_ruteo import cargar_grafo
+from loader_infraestructura import asegurar_componentes
+
+SQL_PGR = """
+    SELECT COALESCE(SUM(cost), 'Infinity'::float8) FROM pgr_dijkstra(
+        'SELECT id, source, target, costo as cost, reverse_costo as reverse_cost FROM red_vial WHERE source IS NOT NULL AND target IS NOT NULL AND costo > 0',
+        %s::bigint, %s::bigint, directed := false)
+"""
+
+
+def resumen(nombre, tiempos_ms):
+    tiempos = sorted(tiempos_ms)
+    p95 = tiempos[min(len(tiempos) - 1, int(0.95 * len(tiempos)))]
+    print(f"   {nombre:<22} media {statistics.mean(tiempos):9.3f} ms | p50 {statistics.median(tiempos):9.3f} ms | p95 {p95:9.3f} ms")
+    return statistics.mean(tiempos)
+
+
+def main(pares=100, out_dir=os.environ.get("OUT_DIR", "/app/out"), semilla=42):
+    print("⏱️  BENCHMARK pgr_dijkstra vs memoria vs CH")
+    conn = get_conn()
+    cur = conn.cursor()
+    asegurar_componentes(conn)
+    grafo = cargar_grafo(conn, con_coordenadas=False)
+
+    ruta_ch = os.path.join(out_dir, ARCHIVO_CH)
+    try:
+        ch = ConsultaCH.cargar(ruta_ch, grafo)
+    except Exception as e:
+        print(f"   ({e}) → construyendo CH")
+        guardar_ch(construir_ch(grafo), ruta_ch)
+        ch = ConsultaCH.cargar(ruta_ch, grafo)
+
+    cur.execute("SELECT id FROM red_vial_vertices_pgr WHERE en_componente_principal ORDER BY id;")
+    vertices = [r[0] for r in cur.fetchall()]
+    rnd = random.Random(semilla)
+    od = [(rnd.choice(vertices), rnd.choice(vertices)) for _ in range(pares)]
+    print(f"   {len(od)} pares O/D, red con {grafo.n_vertices:,} vértices")
+
+    t_pgr, t_mem, t_ch = [], [], []
+    exp_mem, exp_ch = [], []
+    diferencias = 0
+    for s, t in od:
+        t0 = time.perf_counter()
+        cur.execute(SQL_PGR, (s, t))
+        c_pgr = float(cur.fetchone()[0]) if s != t else 0.0
+        t_pgr.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        i, j = grafo.indice(s), grafo.indice(t)
+        dist, _, expandidos = grafo.buscar([(i, 0.0)], destinos={j})
+        c_mem = dist[j]
+        t_mem.append((time.perf_counter() - t0) * 1000)
+        exp_mem.append(expandidos)
+
+        t0 = time.perf_counter()
+        filas, expandidos = ch.consulta(s, t)
+        c_ch = sum(f["cost"] for f in filas)
+        t_ch.append((time.perf_counter() - t0) * 1000)
+        exp_ch.append(expandidos)
+
+        if not (abs(c_pgr - c_mem) < 1e-6 * max(1.0, c_pgr) and abs(c_mem - c_ch) < 1e-6 * max(1.0, c_mem)):
+            if not (c_pgr == c_mem == float("inf") and not filas):
+                diferencias += 1
+
+    print("\n📊 Tiempo por consulta (incluye desempaquetar atajos en CH):")
+    m_pgr = resumen("pgr_dijkstra (BD)", t_pgr)
+    m_mem = resumen("Dijkstra en memoria", t_mem)
+    m_ch = resumen("CH", t_ch)
+    print(f"\n   Vértices expandidos: memoria {statistics.mean(exp_mem):,.0f} | CH {statistics.mean(exp_ch):,.0f}")
+    print(f"   Aceleración CH: {m_pgr / m_ch:,.0f}x vs pgr_dijkstra, {m_mem / m_ch:,.1f}x vs memoria")
+    print(f"   Pares con costo distinto: {diferencias}")
+    cur.close()
+    conn.close()
+    return diferencias == 0
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv("BENCH_PARES", "100"))
+    sys.exit(0 if main(n) else 1)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark de etl_infra_osm.transform_to_nodes_edges sobre un payload Overpass
+sintético (cuadrícula de calles con nodos compartidos en los cruces, como `out geom`).
+
+Compara contra la versión anterior (búsqueda lineal de nodos por arista,
+O(E·N)) en un payload chico, verifica que ids de nodos y aristas y sus
+source/target sean idénticos, y mide la versión actual en un payload
+metropolitano. Informa también la diferencia entre la longitud haversine y
+la aproximación plana anterior (grados × 111 km).
+
+Uso: python benchmark_infra_osm.py [calles_por_lado] [nodos_entre_cruces]
+"""
+import sys
+import time
+
+import numpy as np
+
+from etl_infra_osm import transform_to_nodes_edges
+
+# Centro de Santiago; ~110 m entre calles
+LAT0, LON0, PASO = -33.50, -70.75, 0.001
+
+
+def payload_sintetico(calles, nodos_entre_cruces=3):
+    """Cuadrícula calles × calles: vías N-S y E-O con nodos intermedios entre cruces."""
+    pasos = [PASO * i / (nodos_entre_cruces + 1) for i in range((calles - 1) * (nodos_entre_cruces + 1) + 1)]
+    elementos, way_id = [], 1
+    for k in range(calles):
+        fijo = PASO * k
+        for vertical in (False, True):
+            geometria = [{"lat": LAT0 + (p if vertical else fijo), "lon": LON0 + (fijo if vertical else p)} for p in pasos]
+            elementos.append({"type": "way", "id": way_id, "geometry": geometria,
+                              "tags": {"name": f"Calle {way_id}", "highway": "residential"}})
+            way_id += 1
+    return {"elements": elementos}
+
+
+def transform_original(osm_data):
+    """Versión anterior de transform_to_nodes_edges (referencia de ids y de tiempo)."""
+    nodes_dict = {}
+    edges = []
+    node_counter = 0
+    edge_counter = 0
+    for element in osm_data.get('elements', []):
+        if element.get('type') != 'way' or 'geometry' not in element:
+            continue
+        geometry = element['geometry']
+        tags = element.get('tags', {})
+        way_nodes = []
+        for node in geometry:
+            node_key = f"{node['lon']:.6f},{node['lat']:.6f}"
+            if node_key not in nodes_dict:
+                nodes_dict[node_key] = {"id": f"N{node_counter}", "lat": node['lat'], "lon": node['lon'], "tipo": "via"}
+                node_counter += 1
+            way_nodes.append(nodes_dict[node_key]['id'])
+        for i in range(len(way_nodes) - 1):
+            source = way_nodes[i]
+            target = way_nodes[i + 1]
+            source_coords = next(n for n in nodes_dict.values() if n['id'] == source)
+            target_coords = next(n for n in nodes_dict.values() if n['id'] == target)
+            lat_diff = target_coords['lat'] - source_coords['lat']
+            lon_diff = target_coords['lon'] - source_coords['lon']
+            dist_aprox = ((lat_diff ** 2 + lon_diff ** 2) ** 0.5) * 111000
+            edges.append({"id": f"E{edge_counter}", "source": source, "target": target, "costo": round(dist_aprox, 2),
+                          "nombre": tags.get('name', 'Sin nombre'), "tipo_via": tags.get('highway', 'unknown'),
+                          "osm_way_id": element.get('id')})
+            edge_counter += 1
+    return {"nodos": list(nodes_dict.values()), "aristas": edges}
+
+
+def _medir(funcion, datos):
+    t0 = time.perf_counter()
+    resultado = funcion(datos)
+    return resultado, time.perf_counter() - t0
+
+
+def main(calles=400, nodos_entre_cruces=3):
+    print("⏱️  BENCHMARK transform_to_nodes_edges (payload Overpass sintético)")
+
+    # 1) Equivalencia y speedup contra la versión anterior en un payload chico
+    chico = payload_sintetico(40, nodos_entre_cruces)
+    antes, t_antes = _medir(transform_original, chico)
+    ahora, t_ahora = _medir(transform_to_nodes_edges, chico)
+    clave = ("id", "source", "target", "nombre", "tipo_via", "osm_way_id")
+    iguales = (antes["nodos"] == ahora["nodos"]
+               and [tuple(a[c] for c in clave) for a in antes["aristas"]] == [tuple(a[c] for c in clave) for a in ahora["aristas"]])
+    plano = np.array([a["costo"] for a in antes["aristas"]])
+    geodesico = np.array([a["costo"] for a in ahora["aristas"]])
+    print(f"   Chico: {len(ahora['nodos']):,} nodos, {len(ahora['aristas']):,} aristas")
+    print(f"   • anterior {t_antes:.2f}s | actual {t_ahora:.3f}s | {t_antes / t_ahora:.0f}x | ids idénticos: {'sí' if iguales else 'NO'}")
+    print(f"   • longitud total plana {plano.sum() / 1000:.1f} km vs haversine {geodesico.sum() / 1000:.1f} km"
+          f" ({(plano.sum() / geodesico.sum() - 1) * 100:+.1f}%)")
+
+    # 2) Escala metropolitana sólo con la versión actual (la anterior es cuadrática)
+    grande = payload_sintetico(calles, nodos_entre_cruces)
+    ahora, t_ahora = _medir(transform_to_nodes_edges, grande)
+    print(f"   Grande: {len(grande['elements']):,} vías, {len(ahora['nodos']):,} nodos, {len(ahora['aristas']):,} aristas"
+          f" → {t_ahora:.2f}s")
+    return iguales
+
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:3]))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Escalamiento del ruteo por lotes: corre los workers de ruteo_lote (_rutear,
+fork + gc.freeze, tareas de ORIGENES_POR_TAREA orígenes) sobre la red
+sintética de benchmark_servicio con 1..N procesos y reporta rutas/s y la
+eficiencia respecto de un proceso. Sin BD: mide sólo la planificación (la
+escritura en rutas_calculadas la hace el proceso principal y no escala con
+los workers).
+
+Uso: python benchmark_lote.py [origenes] [procesos, ej. 1,2,4,8]
+"""
+import gc
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import ruteo_lote
+from benchmark_servicio import PASOS_COMPRAVENTA, oficinas_sinteticas, red_sintetica
+from etl_infra_osm import SANTIAGO_CENTRO_BBOX
+
+
+def _correr(tareas, procesos):
+    """(rutas, fallidas, segundos) planificando todas las tareas con un pool de procesos."""
+    gc.freeze()
+    t0 = time.perf_counter()
+    rutas = fallidas = 0
+    with mp.get_context("fork").Pool(procesos) as pool:
+        for resultados, n_fallidos in pool.imap_unordered(ruteo_lote._rutear, tareas):
+            rutas += len(resultados)
+            fallidas += n_fallidos
+    duracion = time.perf_counter() - t0
+    gc.unfreeze()
+    return rutas, fallidas, duracion
+
+
+def main(total=2000, procesos=(1, 2, 4, 8), out_dir=os.environ.get("OUT_DIR", "/app/out")):
+    print(f"⏱️  BENCHMARK ruteo_lote (sintético): {total:,} orígenes con procesos {list(procesos)}")
+    t0 = time.perf_counter()
+    grafo, snapper = red_sintetica()
+    ruteo_lote._GRAFO = grafo
+    ruteo_lote._OFICINAS = oficinas_sinteticas(snapper)
+    ruteo_lote._TRAMITES = {1: ("Compraventa de Inmueble", PASOS_COMPRAVENTA)}
+    print(f"   Red sintética: {grafo.n_vertices:,} vértices, {grafo.n_aristas:,} aristas ({time.perf_counter() - t0:.1f}s)")
+
+    # Orígenes uniformes sobre la misma caja que la red (los de BBOX_SINTETICOS caen fuera)
+    sur, oeste, norte, este = SANTIAGO_CENTRO_BBOX
+    origenes = [(i, sur + (norte - sur) * ((i * 0.618034) % 1), oeste + (este - oeste) * ((i * 0.414214) % 1))
+                for i in range(1, total + 1)]
+    vertices, _ = snapper.snap([o[1] for o in origenes], [o[2] for o in origenes])
+    ajustados = [(oid, lat, lon, int(v)) for (oid, lat, lon), v in zip(origenes, vertices)]
+    tareas = [ajustados[i:i + ruteo_lote.ORIGENES_POR_TAREA] for i in range(0, len(ajustados), ruteo_lote.ORIGENES_POR_TAREA)]
+
+    info = {"origenes": total, "cpus": os.cpu_count(), "vertices": grafo.n_vertices, "aristas": grafo.n_aristas,
+            "origenes_por_tarea": ruteo_lote.ORIGENES_POR_TAREA, "corridas": []}
+    base = None
+    for p in procesos:
+        rutas, fallidas, duracion = _correr(tareas, p)
+        tasa = rutas / duracion
+        base = base or tasa
+        r = {"procesos": p, "rutas": rutas, "fallidas": fallidas, "segundos": round(duracion, 2),
+             "rutas_s": round(tasa, 1), "aceleracion": round(tasa / base, 2), "eficiencia": round(tasa / base / p, 2)}
+        info["corridas"].append(r)
+        print(f"   procesos={p:<3} {tasa:8.1f} rutas/s | ×{r['aceleracion']:.2f} | eficiencia {r['eficiencia']:.0%}")
+    ruteo_lote._GRAFO = ruteo_lote._TRAMITES = ruteo_lote._OFICINAS = None
+
+    os.makedirs(out_dir, exist_ok=True)
+    out_file = os.path.join(out_dir, "benchmark_lote.json")
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    print(f"✅ {out_file}")
+    return info
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 2000,
+         tuple(int(p) for p in args[1].split(",")) if len(args) > 1 else (1, 2, 4, 8))
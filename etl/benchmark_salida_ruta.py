@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Benchmark de formatos de salida de la ruta (ver salida_ruta.py): genera la ruta
+de compraventa una vez y compara, para "aristas" (antes), "tramos" y "polyline",
+cantidad de features, tamaño del archivo y tiempo de parseo (json.loads +
+decodificación de polylines, mediana de 20 repeticiones).
+
+Uso: python benchmark_salida_ruta.py
+"""
+from psycopg2.extras import RealDictCursor
+
+from etl_ruta_dijkstra import (ALGORITMO_RUTEO, CONSIDERA_AMENAZAS, MODO_RUTEO, generar_ruta_compraventa,
+                               get_connection)
+from grafo_ruteo import SQL_ARISTAS, cargar_grafo
+from loader_infraestructura import asegurar_componentes
+from penalizacion_amenazas import SQL_ARISTAS_PENALIZADAS
+from salida_ruta import FORMATOS, compactar_ruta, medir, serializar
+from snapping import SnapperVertices
+
+
+def main(amenazas=CONSIDERA_AMENAZAS):
+    print("⏱️  BENCHMARK formatos de ruta_dijkstra.geojson")
+    conn = get_connection()
+    asegurar_componentes(conn)
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    grafo = cargar_grafo(conn, sql_aristas=SQL_ARISTAS_PENALIZADAS if amenazas else SQL_ARISTAS)
+    features, _, _, _ = generar_ruta_compraventa(cur, grafo, SnapperVertices.desde_bd(conn), MODO_RUTEO, ALGORITMO_RUTEO, amenazas)
+
+    print(f"\n   {'formato':<10} {'features':>9} {'KB':>10} {'parseo ms':>10}")
+    resultados = {}
+    for formato in FORMATOS:
+        salida = compactar_ruta(conn, features, formato)
+        bytes_, ms = medir(serializar({"type": "FeatureCollection", "features": salida}, formato))
+        resultados[formato] = (bytes_, ms)
+        print(f"   {formato:<10} {len(salida):>9} {bytes_ / 1024:>10.1f} {ms:>10.2f}")
+    base_bytes, base_ms = resultados["aristas"]
+    for formato in FORMATOS[1:]:
+        bytes_, ms = resultados[formato]
+        print(f"   {formato}: {base_bytes / bytes_:.1f}x más chico, parseo {base_ms / ms:.1f}x más rápido que aristas")
+    cur.close()
+    conn.close()
+    return resultados
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Benchmark del servicio de rutas: levanta servicio_rutas en un proceso aparte
+(mismo front asyncio, pool de hilos, snapping, planificador y memo de planes)
+y le lanza carga_rutas con distintas concurrencias. Reporta throughput y
+latencias p50/p99 por concurrencia y los hits del memo de planes.
+
+Modos:
+    bd         estado leído de PostgreSQL como en producción (PG* del entorno)
+    sintetico  sin BD: cuadrícula de calles cada BENCH_PASO grados sobre la caja
+               de extracción de etl_infra_osm, oficinas al azar por tipo y el
+               catálogo de Compraventa de Inmueble; la geometría de las aristas
+               sale de las coordenadas de sus vértices en vez de la consulta
+               por id a red_vial (lo único que queda fuera de la medición)
+
+Uso: python benchmark_servicio.py [bd|sintetico] [requests] [concurrencias, ej. 1,8,20,50]
+"""
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import numpy as np
+
+from carga_rutas import correr, pedir, percentil
+from etl_infra_osm import SANTIAGO_CENTRO_BBOX
+from grafo_ruteo import GrafoRuteo, haversine_np
+from servicio_rutas import ServicioRutas
+from snapping import SnapperVertices
+
+PASO = float(os.getenv("BENCH_PASO", "0.0005"))   # ~50 m entre vértices
+OFICINAS_POR_TIPO = {"notaria": 30, "conservador": 5, "sii": 10}
+PASOS_COMPRAVENTA = [{"orden": 1, "oficina_tipo": "notaria", "tiempo_min": 60.0},
+                     {"orden": 2, "oficina_tipo": "conservador", "tiempo_min": 90.0},
+                     {"orden": 3, "oficina_tipo": "sii", "tiempo_min": 45.0}]
+
+
+def red_sintetica(paso=PASO, bbox=SANTIAGO_CENTRO_BBOX):
+    """Cuadrícula no dirigida sobre bbox (sur, oeste, norte, este): (grafo con coordenadas, snapper)."""
+    sur, oeste, norte, este = bbox
+    lats = np.arange(sur, norte + paso / 2, paso)
+    lons = np.arange(oeste, este + paso / 2, paso)
+    filas, cols = len(lats), len(lons)
+    ids = np.arange(1, filas * cols + 1).reshape(filas, cols)
+    src = np.concatenate([ids[:, :-1].ravel(), ids[:-1, :].ravel()])
+    tgt = np.concatenate([ids[:, 1:].ravel(), ids[1:, :].ravel()])
+    lat_v = np.repeat(lats, cols)
+    lon_v = np.tile(lons, filas)
+    largo = haversine_np(lat_v[src - 1], lon_v[src - 1], lat_v[tgt - 1], lon_v[tgt - 1])
+    grafo = GrafoRuteo(np.arange(1, len(src) + 1), src, tgt, largo, largo, largo)
+    grafo.lat[:] = lat_v[grafo.vertex_id - 1]
+    grafo.lon[:] = lon_v[grafo.vertex_id - 1]
+    return grafo, SnapperVertices(ids.ravel(), lat_v, lon_v)
+
+
+def oficinas_sinteticas(snapper, semilla=42, bbox=SANTIAGO_CENTRO_BBOX):
+    rnd = np.random.default_rng(semilla)
+    sur, oeste, norte, este = bbox
+    por_tipo, oid = {}, 1
+    for tipo, n in OFICINAS_POR_TIPO.items():
+        lat, lon = rnd.uniform(sur, norte, n), rnd.uniform(oeste, este, n)
+        vids, _ = snapper.snap(lat, lon)
+        por_tipo[tipo] = [{"id": oid + k, "nombre": f"{tipo} {k + 1}", "tipo": tipo, "direccion": None,
+                           "lat": float(lat[k]), "lon": float(lon[k]), "vertex_id": int(vids[k]), "horario": None}
+                          for k in range(n)]
+        oid += n
+    return por_tipo
+
+
+class ServicioSintetico(ServicioRutas):
+    """ServicioRutas sin pool de conexiones: estado en memoria y geometría desde las coordenadas del grafo."""
+
+    def __init__(self, grafo, snapper, oficinas, hilos):
+        self.amenazas = False
+        self.pool = None
+        self._iniciar_estado(hilos)
+        self.grafo, self.snapper, self.oficinas = grafo, snapper, oficinas
+        self.tramites = {"Compraventa de Inmueble": PASOS_COMPRAVENTA}
+        self.versiones = (0, 0)
+
+    def armar_geojson(self, plan, pasos, lat, lon, tramite):
+        g = self.grafo
+        features = [{"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]}, "properties": {"tipo": "origen"}}]
+        for k, (filas, oficina) in enumerate(zip(plan["tramos"], plan["oficinas"]), start=1):
+            for f in filas:
+                e = g.indice_arista(f["edge"])
+                a, b = g.edge_source[e], g.edge_target[e]
+                features.append({"type": "Feature", "properties": {"tipo": "ruta_plan", "segmento": k, "secuencia": f["seq"],
+                                                                   "distancia_m": round(f["distancia_m"], 1)},
+                                 "geometry": {"type": "LineString", "coordinates": [[g.lon[a], g.lat[a]], [g.lon[b], g.lat[b]]]}})
+            features.append({"type": "Feature", "geometry": {"type": "Point", "coordinates": [oficina["lon"], oficina["lat"]]},
+                             "properties": {"tipo": "parada", "numero": k, "nombre": oficina["nombre"]}})
+        return {"type": "FeatureCollection", "features": features,
+                "metadata": {"tipo": "plan_tramite", "tramite": tramite, "origen": {"lat": lat, "lon": lon},
+                             "distancia_total_km": round(plan["distancia_m"] / 1000, 2), "nodos_expandidos": plan["expandidos"]}}
+
+
+def _servir(servicio, listo):
+    """Proceso hijo: servidor en un puerto libre; avisa el puerto por la cola."""
+    async def arrancar():
+        if servicio is None:
+            s = ServicioRutas()
+            await asyncio.get_running_loop().run_in_executor(s.ejecutor, s.cargar)
+        else:
+            s = servicio
+        servidor = await asyncio.start_server(s.atender, "127.0.0.1", 0)
+        listo.put(servidor.sockets[0].getsockname()[1])
+        async with servidor:
+            await servidor.serve_forever()
+    asyncio.run(arrancar())
+
+
+async def _stats(puerto):
+    reader, writer = await asyncio.open_connection("127.0.0.1", puerto)
+    try:
+        _, cuerpo = await pedir(reader, writer, "127.0.0.1", "/stats")
+    finally:
+        writer.close()
+    return json.loads(cuerpo)
+
+
+def main(modo="sintetico", total=500, concurrencias=(1, 8, 20, 50), out_dir=os.environ.get("OUT_DIR", "/app/out")):
+    print(f"⏱️  BENCHMARK servicio_rutas ({modo}): {total} requests por concurrencia {list(concurrencias)}")
+    info = {"modo": modo, "requests": total, "cpus": os.cpu_count()}
+    servicio = None
+    if modo == "sintetico":
+        t0 = time.perf_counter()
+        grafo, snapper = red_sintetica()
+        servicio = ServicioSintetico(grafo, snapper, oficinas_sinteticas(snapper), hilos=int(os.getenv("SERVICIO_POOL_MAX", "8")))
+        info.update(vertices=grafo.n_vertices, aristas=grafo.n_aristas, paso_grados=PASO,
+                    oficinas={t: len(v) for t, v in servicio.oficinas.items()})
+        print(f"   Red sintética: {grafo.n_vertices:,} vértices, {grafo.n_aristas:,} aristas ({time.perf_counter() - t0:.1f}s)")
+
+    ctx = mp.get_context("fork")
+    listo = ctx.Queue()
+    hijo = ctx.Process(target=_servir, args=(servicio, listo), daemon=True)
+    hijo.start()
+    puerto = listo.get(timeout=600)
+    corridas = []
+    try:
+        for semilla, c in enumerate(concurrencias):
+            antes = asyncio.run(_stats(puerto))
+            latencias, estados, duracion = asyncio.run(correr(f"http://127.0.0.1:{puerto}", total, c, semilla=semilla))
+            despues = asyncio.run(_stats(puerto))
+            r = {"concurrencia": c, "throughput_rps": len(latencias) / duracion,
+                 "p50_ms": percentil(latencias, 50), "p99_ms": percentil(latencias, 99),
+                 "hits_plan": despues["hits_plan"] - antes["hits_plan"], "estados": estados}
+            corridas.append(r)
+            print(f"   c={c:<3} {r['throughput_rps']:7.1f} req/s | p50 {r['p50_ms']:8.1f} ms | p99 {r['p99_ms']:8.1f} ms"
+                  f" | hits memo {r['hits_plan']}/{total} | estados {json.dumps(estados)}")
+    finally:
+        hijo.terminate()
+        hijo.join()
+
+    info["corridas"] = corridas
+    os.makedirs(out_dir, exist_ok=True)
+    out_file = os.path.join(out_dir, "benchmark_servicio.json")
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    print(f"✅ {out_file}")
+    return info
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args[0] if args else "sintetico",
+         int(args[1]) if len(args) > 1 else 500,
+         tuple(int(c) for c in args[2].split(",")) if len(args) > 2 else (1, 8, 20, 50))
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Caché de rutas por par de vértices.
+Clave: (vértice origen, vértice destino, perfil de costo, versión de topología,
+versión de amenazas). Se guarda en rutas_calculadas (persistente, compartido
+entre ejecuciones) y se refleja en un LRU en proceso.
+
+También guarda las k alternativas por tramo (rutas_alternativas, misma clave
+más el rango) que usa etl_ruta_dijkstra en vez de la línea recta.
+
+Invalidación:
+- Reconstrucción de topología (ids de vértices/aristas cambian): se incrementa
+  la versión 'topologia' y se borran las rutas cacheadas.
+- Refresco incremental de la red (ids estables, sólo si cambió geometría o
+  tramos): también se incrementa la versión 'topologia' (distancias,
+  isócronas y el servicio la miran), pero sólo se borran las rutas que usan
+  aristas tocadas o que una arista nueva o modificada podría acortar según
+  una cota inferior de su costo; el resto se re-etiqueta con la versión nueva
+  (invalidar_aristas).
+- Cambio de penalización (amenazas nuevas, expiradas o con otra severidad):
+  si ninguna arista cambió de costo no pasa nada; si alguna se abarató, se
+  incrementa la versión 'amenazas' y caen todas las rutas penalizadas (un
+  camino que antes no convenía puede ganarle a cualquiera); si sólo se
+  encarecieron, caen las rutas que usan esas aristas y el resto se re-etiqueta
+  con la versión nueva (siguen siendo óptimas).
+
+El LRU y los contadores son del proceso y se protegen con un cerrojo: el
+servicio de rutas los usa desde su pool de hilos.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from psycopg2.extras import execute_values
+
+# Perfil de costo: costo crudo o penalizado por amenazas (red_vial_penalizacion)
+PERFIL_BASE = "base"
+PERFIL_AMENAZAS = "amenazas"
+CAPACIDAD_LRU = int(os.getenv("CACHE_RUTAS_LRU", "4096"))
+
+# Contadores del proceso (ver estadisticas()); se modifican con _contar
+CONTADORES = {"hits_lru": 0, "hits_bd": 0, "misses": 0, "guardadas": 0}
+_cerrojo_contadores = threading.Lock()
+
+
+def _contar(nombre):
+    with _cerrojo_contadores:
+        CONTADORES[nombre] += 1
+
+
+class LRU:
+    """LRU mínimo sobre OrderedDict, seguro entre hilos."""
+
+    def __init__(self, capacidad=CAPACIDAD_LRU):
+        self.capacidad = capacidad
+        self._datos = OrderedDict()
+        self._cerrojo = threading.Lock()
+
+    def get(self, clave):
+        with self._cerrojo:
+            if clave not in self._datos:
+                return None
+            self._datos.move_to_end(clave)
+            return self._datos[clave]
+
+    def put(self, clave, valor):
+        with self._cerrojo:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.capacidad:
+                self._datos.popitem(last=False)
+
+    def clear(self):
+        with self._cerrojo:
+            self._datos.clear()
+
+    def __len__(self):
+        with self._cerrojo:
+            return len(self._datos)
+
+
+# LRU compartido por todas las instancias de CacheRutas del proceso
+_lru = LRU()
+
+# Geometría de una ruta en el sentido de viaje (ver 00_schema_completo.sql)
+SQL_LINEA_RUTA = """
+    CREATE OR REPLACE FUNCTION linea_ruta(p_edge_ids BIGINT[], p_origen BIGINT)
+    RETURNS geometry AS $$
+    DECLARE
+      v_actual BIGINT := p_origen;
+      v_partes geometry[] := '{}';
+      r RECORD;
+    BEGIN
+      FOR r IN
+        SELECT rv.source, rv.target, rv.geom
+        FROM unnest(p_edge_ids) WITH ORDINALITY AS e(id, ord)
+        JOIN red_vial rv ON rv.id = e.id
+        ORDER BY e.ord
+      LOOP
+        IF r.source = v_actual THEN
+          v_partes := v_partes || r.geom;
+          v_actual := r.target;
+        ELSE
+          v_partes := v_partes || ST_Reverse(r.geom);
+          v_actual := r.source;
+        END IF;
+      END LOOP;
+      RETURN ST_MakeLine(v_partes);
+    END;
+    $$ LANGUAGE plpgsql STABLE;
+"""
+
+
+def ensure_cache(cur):
+    """Columnas de clave en rutas_calculadas, tabla de versiones y linea_ruta (ver 00_schema_completo.sql)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS versiones_red (
+          clave TEXT PRIMARY KEY,
+          version INTEGER NOT NULL DEFAULT 1,
+          actualizado TIMESTAMP DEFAULT NOW()
+        );
+        INSERT INTO versiones_red (clave) VALUES ('topologia'), ('amenazas') ON CONFLICT DO NOTHING;
+        ALTER TABLE rutas_calculadas
+          ADD COLUMN IF NOT EXISTS origen_vertex BIGINT,
+          ADD COLUMN IF NOT EXISTS destino_vertex BIGINT,
+          ADD COLUMN IF NOT EXISTS perfil TEXT,
+          ADD COLUMN IF NOT EXISTS version_topologia INTEGER,
+          ADD COLUMN IF NOT EXISTS version_amenazas INTEGER,
+          ADD COLUMN IF NOT EXISTS edge_ids BIGINT[];
+        CREATE UNIQUE INDEX IF NOT EXISTS rutas_cache_clave_idx
+          ON rutas_calculadas (origen_vertex, destino_vertex, perfil, version_topologia, version_amenazas)
+          WHERE origen_vertex IS NOT NULL;
+        CREATE TABLE IF NOT EXISTS rutas_alternativas (
+          origen_vertex BIGINT NOT NULL,
+          destino_vertex BIGINT NOT NULL,
+          perfil TEXT NOT NULL,
+          version_topologia INTEGER NOT NULL,
+          version_amenazas INTEGER NOT NULL,
+          rango INTEGER NOT NULL,
+          edge_ids BIGINT[] NOT NULL,
+          costo DOUBLE PRECISION,
+          distancia_m DOUBLE PRECISION,
+          toca_amenazas BOOLEAN DEFAULT false,
+          geom geometry(LineString, 4326),
+          calculado TIMESTAMP DEFAULT NOW(),
+          PRIMARY KEY (origen_vertex, destino_vertex, perfil, version_topologia, version_amenazas, rango)
+        );
+        CREATE INDEX IF NOT EXISTS rutas_alternativas_geom_idx ON rutas_alternativas USING GIST(geom);
+    """)
+    # Sólo si falta: CREATE OR REPLACE en paralelo desde varios procesos choca en el catálogo
+    cur.execute("SELECT to_regprocedure('linea_ruta(bigint[], bigint)') IS NULL;")
+    if cur.fetchone()[0]:
+        cur.execute(SQL_LINEA_RUTA)
+
+
+def versiones(cur):
+    """(versión topología, versión amenazas)."""
+    ensure_cache(cur)
+    cur.execute("SELECT clave, version FROM versiones_red WHERE clave IN ('topologia', 'amenazas');")
+    v = dict(cur.fetchall())
+    return v["topologia"], v["amenazas"]
+
+
+def _incrementar(cur, clave):
+    cur.execute("""
+        UPDATE versiones_red SET version = version + 1, actualizado = NOW()
+        WHERE clave = %s RETURNING version;
+    """, (clave,))
+    return cur.fetchone()[0]
+
+
+def invalidar_topologia(cur):
+    """Nueva topología: versión nueva y fuera todas las rutas cacheadas (sus vértices ya no existen)."""
+    ensure_cache(cur)
+    version = _incrementar(cur, "topologia")
+    cur.execute("DELETE FROM rutas_calculadas WHERE origen_vertex IS NOT NULL;")
+    cur.execute("TRUNCATE rutas_alternativas;")
+    _lru.clear()
+    return version
+
+
+def invalidar_aristas(cur, aristas, vertices, nuevas):
+    """
+    Refresco incremental de la red (red_incremental): la red cambió, así que se
+    incrementa la versión de topología para que quienes la miran recalculen
+    (distancias_oficinas, isocronas, servicio_rutas). Como los ids se conservan,
+    del caché sólo se borran:
+    - las rutas que usan una arista de `aristas` (borradas o modificadas) o
+      parten o llegan a un vértice borrado;
+    - las rutas que alguna arista de `nuevas` (insertadas o modificadas, ya
+      re-nodadas) podría acortar: un camino que la usa cuesta al menos la
+      distancia geodésica del origen a un extremo, más su largo, más la del
+      otro extremo al destino, y el costo de cualquier perfil es >= al largo.
+      Si esa cota no baja del costo cacheado, la ruta sigue siendo óptima.
+    Las alternativas no guardan la cota con que se buscaron, así que si hay
+    aristas nuevas caen todas. El resto se re-etiqueta con la versión nueva.
+    Retorna (versión nueva, rutas borradas).
+    """
+    ensure_cache(cur)
+    cur.execute("SELECT version FROM versiones_red WHERE clave = 'topologia';")
+    anterior = cur.fetchone()[0]
+    nueva = _incrementar(cur, "topologia")
+    toca = """
+        r.edge_ids && %(aristas)s::BIGINT[]
+        OR r.origen_vertex = ANY(%(vertices)s) OR r.destino_vertex = ANY(%(vertices)s)
+    """
+    params = {"aristas": list(aristas), "vertices": list(vertices), "nuevas": list(nuevas), "version": anterior}
+    cur.execute(f"DELETE FROM rutas_calculadas r WHERE r.origen_vertex IS NOT NULL AND ({toca});", params)
+    borradas = cur.rowcount
+    if nuevas:
+        cur.execute("""
+            CREATE TEMP TABLE _atajos ON COMMIT DROP AS
+            SELECT rv.id, vs.the_geom::geography AS a, vt.the_geom::geography AS b, rv.length_m AS largo
+            FROM red_vial rv
+            JOIN red_vial_vertices_pgr vs ON vs.id = rv.source
+            JOIN red_vial_vertices_pgr vt ON vt.id = rv.target
+            WHERE rv.id = ANY(%(nuevas)s);
+            DELETE FROM rutas_calculadas r
+            USING red_vial_vertices_pgr vo, red_vial_vertices_pgr vd
+            WHERE r.origen_vertex IS NOT NULL AND r.version_topologia = %(version)s
+              AND vo.id = r.origen_vertex AND vd.id = r.destino_vertex
+              AND EXISTS (
+                SELECT 1 FROM _atajos c
+                WHERE c.largo + LEAST(ST_Distance(vo.the_geom::geography, c.a) + ST_Distance(c.b, vd.the_geom::geography),
+                                      ST_Distance(vo.the_geom::geography, c.b) + ST_Distance(c.a, vd.the_geom::geography))
+                      < COALESCE(r.costo_total, r.distancia_m)
+              );
+        """, params)
+        borradas += cur.rowcount
+        cur.execute("DELETE FROM rutas_alternativas;")
+        borradas += cur.rowcount
+    else:
+        # Alternativas: si cualquiera del par queda tocada, el ranking completo deja de valer
+        cur.execute(f"""
+            DELETE FROM rutas_alternativas a
+            USING (SELECT DISTINCT r.origen_vertex, r.destino_vertex, r.perfil
+                   FROM rutas_alternativas r WHERE {toca}) x
+            WHERE a.origen_vertex = x.origen_vertex AND a.destino_vertex = x.destino_vertex AND a.perfil = x.perfil;
+        """, params)
+        borradas += cur.rowcount
+    cur.execute("""
+        UPDATE rutas_calculadas SET version_topologia = %s WHERE origen_vertex IS NOT NULL AND version_topologia = %s;
+        UPDATE rutas_alternativas SET version_topologia = %s WHERE version_topologia = %s;
+    """, (nueva, anterior, nueva, anterior))
+    _lru.clear()
+    return nueva, borradas
+
+
+def invalidar_por_amenazas(cur, tabla_cambiadas="_penalizacion_cambiada"):
+    """
+    Llamada por penalizacion_amenazas con la tabla temporal de aristas cuya
+    penalización cambió (id, baja = el costo bajó: multiplicador menor o
+    desbloqueo). Sin cambios no toca nada. Si alguna bajó, un camino que antes
+    no convenía puede ganarle a cualquier ruta cacheada: se borran todas las
+    penalizadas. Si sólo subieron, se borran las que usan alguna de esas
+    aristas (las demás siguen siendo óptimas) y se re-etiquetan con la versión
+    nueva. Retorna (versión nueva o None si no hubo cambios, rutas borradas).
+    """
+    ensure_cache(cur)
+    cur.execute(f"SELECT COUNT(*), COALESCE(bool_or(baja), false) FROM {tabla_cambiadas};")
+    cambiadas, baja = cur.fetchone()
+    if cambiadas == 0:
+        return None, 0
+    cur.execute("SELECT version FROM versiones_red WHERE clave = 'amenazas';")
+    anterior = cur.fetchone()[0]
+    nueva = _incrementar(cur, "amenazas")
+    if baja:
+        cur.execute("""
+            DELETE FROM rutas_calculadas WHERE origen_vertex IS NOT NULL AND perfil = %s AND version_amenazas = %s;
+        """, (PERFIL_AMENAZAS, anterior))
+        borradas = cur.rowcount
+        cur.execute("DELETE FROM rutas_alternativas WHERE perfil = %s AND version_amenazas = %s;",
+                    (PERFIL_AMENAZAS, anterior))
+        return nueva, borradas + cur.rowcount
+
+    cur.execute(f"""
+        DELETE FROM rutas_calculadas r
+        WHERE r.origen_vertex IS NOT NULL AND r.perfil = %s AND r.version_amenazas = %s
+          AND r.edge_ids && (SELECT array_agg(id) FROM {tabla_cambiadas})::BIGINT[];
+    """, (PERFIL_AMENAZAS, anterior))
+    borradas = cur.rowcount
+    cur.execute("""
+        UPDATE rutas_calculadas SET version_amenazas = %s
+        WHERE origen_vertex IS NOT NULL AND perfil = %s AND version_amenazas = %s;
+    """, (nueva, PERFIL_AMENAZAS, anterior))
+    # Alternativas: si cualquiera del par usa una arista encarecida, el ranking completo deja de valer
+    cur.execute(f"""
+        DELETE FROM rutas_alternativas r
+        USING (SELECT DISTINCT a.origen_vertex, a.destino_vertex
+               FROM rutas_alternativas a
+               WHERE a.perfil = %s AND a.version_amenazas = %s
+                 AND a.edge_ids && (SELECT array_agg(id) FROM {tabla_cambiadas})::BIGINT[]) x
+        WHERE r.origen_vertex = x.origen_vertex AND r.destino_vertex = x.destino_vertex
+          AND r.perfil = %s AND r.version_amenazas = %s;
+    """, (PERFIL_AMENAZAS, anterior, PERFIL_AMENAZAS, anterior))
+    borradas += cur.rowcount
+    cur.execute("""
+        UPDATE rutas_alternativas SET version_amenazas = %s WHERE perfil = %s AND version_amenazas = %s;
+    """, (nueva, PERFIL_AMENAZAS, anterior))
+    return nueva, borradas
+
+
+def estadisticas():
+    """Contadores hit/miss del proceso y tasa de acierto."""
+    with _cerrojo_contadores:
+        c = dict(CONTADORES)
+    consultas = c["hits_lru"] + c["hits_bd"] + c["misses"]
+    hits = c["hits_lru"] + c["hits_bd"]
+    return dict(c, consultas=consultas, tasa_acierto=round(hits / consultas, 3) if consultas else None,
+                en_lru=len(_lru))
+
+
+class CacheRutas:
+    """
+    Caché de tramos para un perfil de costo. Las versiones se leen al crearla:
+    una instancia por ejecución / request.
+    Las filas devueltas tienen el formato de etl_ruta_dijkstra
+    (seq, geometry, distancia_m, calle, tipo_via, edge).
+    """
+
+    def __init__(self, conn, perfil=PERFIL_BASE):
+        self.conn = conn
+        self.perfil = perfil
+        cur = conn.cursor()
+        self.version_topologia, version_amenazas = versiones(cur)
+        conn.commit()
+        cur.close()
+        # Las rutas con costo crudo no dependen de las amenazas
+        self.version_amenazas = version_amenazas if perfil == PERFIL_AMENAZAS else 0
+
+    def clave(self, origen_id, destino_id):
+        return (int(origen_id), int(destino_id), self.perfil, self.version_topologia, self.version_amenazas)
+
+    def obtener(self, origen_id, destino_id):
+        """Filas del tramo o None si no está en caché ([] = sin ruta útil, sólo en el LRU)."""
+        clave = self.clave(origen_id, destino_id)
+        filas = _lru.get(clave)
+        if filas is not None:
+            _contar("hits_lru")
+            return filas
+
+        cur = self.conn.cursor()
+        cur.execute("""
+            SELECT e.ord AS seq, ST_AsGeoJSON(rv.geom)::json AS geometry, COALESCE(rv.length_m, 0) AS distancia_m,
+                   COALESCE(rv.nombre, 'Calle sin nombre') AS calle, rv.tipo_via, rv.id AS edge
+            FROM rutas_calculadas r
+            CROSS JOIN LATERAL unnest(r.edge_ids) WITH ORDINALITY AS e(id, ord)
+            JOIN red_vial rv ON rv.id = e.id
+            WHERE r.origen_vertex = %s AND r.destino_vertex = %s AND r.perfil = %s
+              AND r.version_topologia = %s AND r.version_amenazas = %s
+            ORDER BY e.ord;
+        """, clave)
+        columnas = [c[0] for c in cur.description]
+        filas = [dict(zip(columnas, f)) for f in cur.fetchall()]
+        cur.close()
+        if not filas:
+            _contar("misses")
+            return None
+        _contar("hits_bd")
+        _lru.put(clave, filas)
+        return filas
+
+    def guardar(self, origen_id, destino_id, filas, algoritmo=None, costo=None):
+        """Guarda el tramo en el LRU y, si tiene aristas, en rutas_calculadas."""
+        clave = self.clave(origen_id, destino_id)
+        _lru.put(clave, filas)
+        edge_ids = [int(f["edge"]) for f in filas if f.get("edge") is not None]
+        if not edge_ids:
+            return
+        distancia = sum(float(f["distancia_m"] or 0) for f in filas)
+        cur = self.conn.cursor()
+        cur.execute("""
+            INSERT INTO rutas_calculadas (origen_vertex, destino_vertex, perfil, version_topologia, version_amenazas,
+                                          edge_ids, algoritmo, geom, distancia_m, tiempo_estimado_min, costo_total,
+                                          considera_amenazas)
+            SELECT %s, %s, %s, %s, %s, %s::bigint[], %s, linea_ruta(%s::bigint[], %s), %s, %s, %s, %s
+            ON CONFLICT (origen_vertex, destino_vertex, perfil, version_topologia, version_amenazas)
+              WHERE origen_vertex IS NOT NULL DO NOTHING;
+        """, clave + (edge_ids, algoritmo, edge_ids, clave[0], distancia, round(distancia / 83.33),
+                      distancia if costo is None else float(costo), self.perfil == PERFIL_AMENAZAS))
+        self.conn.commit()
+        cur.close()
+        _contar("guardadas")
+
+    def alternativas(self, origen_id, destino_id):
+        """
+        Alternativas cacheadas del tramo ordenadas por rango, o None.
+        Cada una: {rango, costo, distancia_m, toca_amenazas, filas}.
+        """
+        clave = ("alternativas",) + self.clave(origen_id, destino_id)
+        alts = _lru.get(clave)
+        if alts is not None:
+            _contar("hits_lru")
+            return alts
+
+        cur = self.conn.cursor()
+        cur.execute("""
+            SELECT a.rango, a.costo, a.distancia_m, a.toca_amenazas,
+                   e.ord, ST_AsGeoJSON(rv.geom)::json, COALESCE(rv.length_m, 0),
+                   COALESCE(rv.nombre, 'Calle sin nombre'), rv.tipo_via, rv.id
+            FROM rutas_alternativas a
+            CROSS JOIN LATERAL unnest(a.edge_ids) WITH ORDINALITY AS e(id, ord)
+            JOIN red_vial rv ON rv.id = e.id
+            WHERE a.origen_vertex = %s AND a.destino_vertex = %s AND a.perfil = %s
+              AND a.version_topologia = %s AND a.version_amenazas = %s
+            ORDER BY a.rango, e.ord;
+        """, self.clave(origen_id, destino_id))
+        por_rango = {}
+        for rango, costo, distancia, toca, seq, geom, largo, calle, tipo_via, edge in cur.fetchall():
+            alt = por_rango.setdefault(rango, {"rango": rango, "costo": costo, "distancia_m": distancia,
+                                               "toca_amenazas": toca, "filas": []})
+            alt["filas"].append({"seq": seq, "geometry": geom, "distancia_m": largo, "calle": calle,
+                                 "tipo_via": tipo_via, "edge": edge})
+        cur.close()
+        if not por_rango:
+            _contar("misses")
+            return None
+        _contar("hits_bd")
+        alts = [por_rango[r] for r in sorted(por_rango)]
+        _lru.put(clave, alts)
+        return alts
+
+    def guardar_alternativas(self, origen_id, destino_id, alternativas, en_lru=True):
+        """Guarda [{rango, costo, distancia_m, toca_amenazas, filas}] (filas con 'edge')."""
+        if en_lru:
+            _lru.put(("alternativas",) + self.clave(origen_id, destino_id), alternativas)
+        valores = [self.clave(origen_id, destino_id) + (a["rango"], [int(f["edge"]) for f in a["filas"]],
+                                                          a["costo"], a["distancia_m"], a["toca_amenazas"])
+                   for a in alternativas if a["filas"]]
+        if not valores:
+            return
+        cur = self.conn.cursor()
+        execute_values(cur, """
+            INSERT INTO rutas_alternativas (origen_vertex, destino_vertex, perfil, version_topologia, version_amenazas,
+                                            rango, edge_ids, costo, distancia_m, toca_amenazas, geom)
+            SELECT v.o, v.d, v.perfil, v.vt, v.va, v.rango, v.edge_ids, v.costo, v.distancia, v.toca,
+                   linea_ruta(v.edge_ids, v.o)
+            FROM (VALUES %s) AS v(o, d, perfil, vt, va, rango, edge_ids, costo, distancia, toca)
+            ON CONFLICT DO NOTHING;
+        """, valores, template="(%s, %s, %s, %s, %s, %s, %s::bigint[], %s, %s, %s)")
+        self.conn.commit()
+        cur.close()
+        _contar("guardadas")
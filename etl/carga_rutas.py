@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Generador de carga para servicio_rutas.py.
+Lanza N clientes concurrentes (conexiones keep-alive, asyncio) que piden
+/route con orígenes aleatorios dentro de Santiago Centro y reporta
+throughput y latencias p50/p90/p99.
+
+Uso: python carga_rutas.py [url_base] [requests] [concurrencia]
+     (por defecto http://localhost:8090, 500 requests, 20 clientes)
+"""
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from urllib.parse import quote, urlsplit
+
+# Trámites cuyos tipos de oficina están cargados (los demás responden 422)
+TRAMITES = ["Compraventa de Inmueble"]
+# Santiago Centro (lat_min, lat_max, lon_min, lon_max)
+BBOX = (-33.4550, -33.4300, -70.6700, -70.6400)
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p / 100 * len(ordenados)))]
+
+
+async def pedir(reader, writer, host, ruta):
+    """GET con keep-alive; retorna (estado, bytes del cuerpo). ConnectionError si el servidor cerró."""
+    writer.write(f"GET {ruta} HTTP/1.1\r\nHost: {host}\r\nConnection: keep-alive\r\n\r\n".encode("latin-1"))
+    await writer.drain()
+    linea = (await reader.readline()).split()
+    if len(linea) < 2 or not linea[1].isdigit():
+        raise ConnectionError(f"línea de estado inválida o conexión cerrada: {b' '.join(linea)!r}")
+    estado = int(linea[1])
+    largo = 0
+    while True:
+        h = await reader.readline()
+        if h in (b"\r\n", b"\n", b""):
+            break
+        k, _, v = h.decode("latin-1").partition(":")
+        if k.strip().lower() == "content-length":
+            largo = int(v)
+    cuerpo = await reader.readexactly(largo)
+    return estado, cuerpo
+
+
+async def cliente(host, puerto, prefijo, cola, latencias, estados, rnd):
+    reader, writer = await asyncio.open_connection(host, puerto)
+    try:
+        while True:
+            try:
+                cola.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            lat = rnd.uniform(BBOX[0], BBOX[1])
+            lon = rnd.uniform(BBOX[2], BBOX[3])
+            ruta = f"{prefijo}/route?tramite={quote(rnd.choice(TRAMITES))}&lat={lat:.6f}&lon={lon:.6f}"
+            t0 = time.perf_counter()
+            try:
+                estado, _ = await pedir(reader, writer, host, ruta)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # Falla de transporte (estado 0): se cuenta y se sigue con una conexión nueva
+                estado = 0
+                writer.close()
+                reader, writer = await asyncio.open_connection(host, puerto)
+            latencias.append((time.perf_counter() - t0) * 1000)
+            estados[estado] = estados.get(estado, 0) + 1
+    finally:
+        writer.close()
+
+
+async def correr(url_base, total, concurrencia, semilla=42):
+    url = urlsplit(url_base)
+    host, puerto = url.hostname, url.port or 80
+    prefijo = url.path.rstrip("/")
+    cola = asyncio.Queue()
+    for i in range(total):
+        cola.put_nowait(i)
+    latencias, estados = [], {}
+    rnd = random.Random(semilla)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(cliente(host, puerto, prefijo, cola, latencias, estados, rnd) for _ in range(concurrencia)))
+    return latencias, estados, time.perf_counter() - t0
+
+
+def main(url_base="http://localhost:8090", total=500, concurrencia=20):
+    print(f"🔥 CARGA {url_base}/route: {total} requests, {concurrencia} clientes concurrentes")
+    latencias, estados, duracion = asyncio.run(correr(url_base, total, concurrencia))
+    print(f"   Respuestas por estado: {json.dumps(estados)}" + (f" (0 = conexión cortada: {estados[0]})" if 0 in estados else ""))
+    print(f"   Throughput: {len(latencias) / duracion:,.1f} req/s ({duracion:.1f}s)")
+    print(f"   Latencia media {statistics.mean(latencias):.1f} ms | p50 {percentil(latencias, 50):.1f} ms"
+          f" | p90 {percentil(latencias, 90):.1f} ms | p99 {percentil(latencias, 99):.1f} ms")
+    return {"p50_ms": percentil(latencias, 50), "p99_ms": percentil(latencias, 99), "estados": estados}
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(args[0] if args else "http://localhost:8090",
+         int(args[1]) if len(args) > 1 else 500,
+         int(args[2]) if len(args) > 2 else 20)
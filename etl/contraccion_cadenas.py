@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Contracción de cadenas de grado 2.
+Las vías de OSM dejan largas cadenas de vértices con exactamente dos vecinos
+que no aportan decisiones de ruteo pero sí agrandan cada búsqueda. RedContraida
+colapsa cada cadena en una super-arista (costo = suma de sus aristas) y busca
+sobre ese grafo reducido; las rutas se expanden de vuelta a ids de red_vial,
+así que la geometría de ruta_dijkstra.geojson no cambia.
+
+Los vértices interiores de una cadena siguen siendo origen/destino válidos:
+la búsqueda parte (o termina) en los dos extremos de su cadena con el costo
+parcial correspondiente. Los costos coinciden con los de GrafoRuteo.
+
+Trabaja sobre el grafo no dirigido de GrafoRuteo (misma semántica que
+pgr_dijkstra con directed := false). Se usa con RUTEO_CONTRACCION=1 en
+etl_ruta_dijkstra; main() informa la reducción y la aceleración sobre la red actual.
+"""
+import json
+import os
+import random
+import statistics
+import time
+
+import numpy as np
+import psycopg2
+
+from grafo_ruteo import INF, GrafoRuteo, cargar_grafo
+
+ARCHIVO_REPORTE = "contraccion_cadenas.json"
+PARES_BENCHMARK = int(os.getenv("CADENAS_PARES", "50"))
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+class RedContraida:
+    """
+    GrafoRuteo con las cadenas de grado 2 colapsadas.
+
+    Por cadena k (índices densos del grafo base):
+        nodos[k] = [u, x1, ..., w], aristas[k] = [e0, ..., e_m-1], acumulado[k] = costo desde u
+    cadena[v] / posicion[v] ubican cada vértice interior; `red` es el GrafoRuteo de
+    super-aristas (edge_id = número de cadena) sobre los vértices conservados.
+    Expone ruta / matriz_costos / ruta_desde_pred / k_caminos con las filas de GrafoRuteo.
+    """
+
+    def __init__(self, grafo):
+        if grafo.dirigido:
+            raise ValueError("La contracción de cadenas se hace sobre el grafo no dirigido")
+        t0 = time.perf_counter()
+        self.base = grafo
+        n = grafo.n_vertices
+        ptr, dst, ari, peso = grafo._ptr, grafo._dst, grafo._ari, grafo._peso
+        self._peso_arista = [0.0] * grafo.n_aristas
+        for a, e in enumerate(ari):
+            self._peso_arista[e] = peso[a]
+
+        # Se conservan los vértices con grado (arcos) distinto de 2 y los que tienen un lazo
+        conserva = np.diff(grafo.indptr) != 2
+        conserva[grafo.arco_origen[grafo.arco_origen == grafo.arco_destino]] = True
+        conserva = conserva.tolist()
+        usada = [False] * grafo.n_aristas
+        self.cadena = [-1] * n
+        self.posicion = [0] * n
+        self.nodos, self.aristas, self.acumulado = [], [], []
+
+        def recorrer(u, a):
+            nodos, aristas, acumulado = [u], [], [0.0]
+            while True:
+                e = ari[a]
+                usada[e] = True
+                v = dst[a]
+                nodos.append(v)
+                aristas.append(e)
+                acumulado.append(acumulado[-1] + peso[a])
+                if conserva[v]:
+                    break
+                # Vértice interior: sale por el arco de la otra arista
+                a = ptr[v] + 1 if ari[ptr[v]] == e else ptr[v]
+            k = len(self.nodos)
+            for i in range(1, len(nodos) - 1):
+                self.cadena[nodos[i]] = k
+                self.posicion[nodos[i]] = i
+            self.nodos.append(nodos)
+            self.aristas.append(aristas)
+            self.acumulado.append(acumulado)
+
+        for u in range(n):
+            if conserva[u]:
+                for a in range(ptr[u], ptr[u + 1]):
+                    if not usada[ari[a]]:
+                        recorrer(u, a)
+        # Anillos aislados (sólo vértices de grado 2): se conserva uno y se recorre desde él
+        for u in range(n):
+            if not conserva[u] and self.cadena[u] == -1:
+                conserva[u] = True
+                recorrer(u, ptr[u])
+        self.conserva = conserva
+
+        # Grafo de super-aristas (las cadenas que vuelven a su inicio quedan como lazos: así sus
+        # vértices interiores siguen conectados al extremo)
+        extremos = np.array([(nodos[0], nodos[-1]) for nodos in self.nodos], dtype=np.int64).reshape(-1, 2)
+        costos = [acumulado[-1] for acumulado in self.acumulado]
+        longitudes = [float(grafo.longitud[aristas].sum()) for aristas in self.aristas]
+        self.red = GrafoRuteo(np.arange(len(self.nodos)), grafo.vertex_id[extremos[:, 0]], grafo.vertex_id[extremos[:, 1]],
+                              costos, costos, longitudes)
+        self.segundos_construccion = time.perf_counter() - t0
+
+    # ------------------------------------------------------------------
+    # Utilidades
+    # ------------------------------------------------------------------
+    @property
+    def n_vertices(self):
+        return self.red.n_vertices
+
+    @property
+    def n_aristas(self):
+        return self.red.n_aristas
+
+    def indice(self, vertex_id):
+        return self.base.indice(vertex_id)
+
+    def _extremos(self, i):
+        """[(índice en red, costo entre i y ese vértice, lado)] por donde i entra a la red contraída."""
+        if self.conserva[i]:
+            c = self.red.indice(self.base.vertex_id[i])
+            return [] if c is None else [(c, 0.0, None)]
+        k, p = self.cadena[i], self.posicion[i]
+        nodos, acumulado = self.nodos[k], self.acumulado[k]
+        salida = []
+        for lado, costo in ((0, acumulado[p]), (len(nodos) - 1, acumulado[-1] - acumulado[p])):
+            c = self.red.indice(self.base.vertex_id[nodos[lado]])
+            if c is not None:
+                salida.append((c, costo, lado))
+        return salida
+
+    def _tramo(self, k, desde, hasta):
+        """[(vértice base, arista base)] recorriendo la cadena k de la posición desde a hasta."""
+        nodos, aristas = self.nodos[k], self.aristas[k]
+        if desde <= hasta:
+            return [(nodos[i], aristas[i]) for i in range(desde, hasta)]
+        return [(nodos[i], aristas[i - 1]) for i in range(desde, hasta, -1)]
+
+    def _misma_cadena(self, s, t):
+        """Costo directo entre dos interiores de la misma cadena (inf si no lo son)."""
+        if self.conserva[s] or self.conserva[t] or self.cadena[s] != self.cadena[t]:
+            return INF
+        acumulado = self.acumulado[self.cadena[s]]
+        return abs(acumulado[self.posicion[s]] - acumulado[self.posicion[t]])
+
+    def _filas(self, pasos):
+        """Filas estilo pgr_dijkstra (como GrafoRuteo.filas_ruta) desde [(vértice base, arista base)]."""
+        filas, acumulado = [], 0.0
+        for seq, (nodo, e) in enumerate(pasos, start=1):
+            costo = self._peso_arista[e]
+            filas.append({
+                "seq": seq,
+                "node": int(self.base.vertex_id[nodo]),
+                "edge": int(self.base.edge_id[e]),
+                "cost": costo,
+                "agg_cost": acumulado,
+                "distancia_m": float(self.base.longitud[e]),
+            })
+            acumulado += costo
+        return filas
+
+    # ------------------------------------------------------------------
+    # Búsqueda
+    # ------------------------------------------------------------------
+    def _buscar(self, s, destinos):
+        """Dijkstra en la red contraída desde el vértice base s hasta asentar los extremos de destinos."""
+        fuentes = self._extremos(s)
+        objetivos = {c for t in destinos for c, _, _ in self._extremos(t)}
+        dist, pred, expandidos = self.red.buscar([(c, costo) for c, costo, _ in fuentes], destinos=objetivos)
+        return {"s": s, "fuentes": fuentes, "dist": dist, "pred": pred}, expandidos
+
+    def _costo(self, busqueda, t):
+        """(costo, extremo de llegada) hasta el vértice base t; extremo None = por la misma cadena."""
+        s, dist = busqueda["s"], busqueda["dist"]
+        if s == t:
+            return 0.0, None
+        mejor, llegada = self._misma_cadena(s, t), None
+        for c, costo, lado in self._extremos(t):
+            if dist[c] + costo < mejor:
+                mejor, llegada = dist[c] + costo, (c, lado)
+        return mejor, llegada
+
+    def _expandir(self, busqueda, t):
+        """Pasos [(vértice base, arista base)] de la ruta s → t."""
+        s = busqueda["s"]
+        costo, llegada = self._costo(busqueda, t)
+        if costo == INF or s == t:
+            return []
+        if llegada is None:
+            return self._tramo(self.cadena[s], self.posicion[s], self.posicion[t])
+        c, lado_t = llegada
+        arcos = self.red.reconstruir(busqueda["pred"], c)
+        inicio = int(self.red.arco_origen[arcos[0]]) if arcos else c
+        pasos = []
+        # s → extremo de su cadena por el que salió (el de menor costo si ambos son el mismo vértice)
+        salidas = [(costo, lado) for x, costo, lado in busqueda["fuentes"] if x == inicio]
+        lado_s = min(salidas)[1]
+        if lado_s is not None:
+            pasos += self._tramo(self.cadena[s], self.posicion[s], lado_s)
+        # Super-aristas en el sentido recorrido
+        for a in arcos:
+            k = int(self.red.edge_id[self.red._ari[a]])
+            u = self.base.indice(self.red.vertex_id[self.red.arco_origen[a]])
+            m = len(self.nodos[k]) - 1
+            pasos += self._tramo(k, 0, m) if u == self.nodos[k][0] else self._tramo(k, m, 0)
+        # Extremo de la cadena de t → t
+        if lado_t is not None:
+            pasos += self._tramo(self.cadena[t], lado_t, self.posicion[t])
+        return pasos
+
+    def ruta(self, origen_id, destino_id, algoritmo="dijkstra", pesos=None):
+        """
+        Como GrafoRuteo.ruta: (filas, expandidos) con filas en aristas de red_vial.
+        A* y pesos alternativos se resuelven en el grafo base.
+        """
+        if algoritmo != "dijkstra" or pesos is not None:
+            return self.base.ruta(origen_id, destino_id, algoritmo, pesos)
+        s, t = self.base.indice(origen_id), self.base.indice(destino_id)
+        if s is None or t is None or s == t:
+            return [], 0
+        busqueda, expandidos = self._buscar(s, [t])
+        return self._filas(self._expandir(busqueda, t)), expandidos
+
+    def costo_ruta(self, origen_id, destino_id):
+        s, t = self.base.indice(origen_id), self.base.indice(destino_id)
+        if s is None or t is None:
+            return INF
+        busqueda, _ = self._buscar(s, [t])
+        return self._costo(busqueda, t)[0]
+
+    def matriz_costos(self, vertex_ids, pesos=None):
+        """Como GrafoRuteo.matriz_costos; preds[k] sirve para ruta_desde_pred."""
+        if pesos is not None:
+            return self.base.matriz_costos(vertex_ids, pesos)
+        idx = [self.base.indice(v) for v in vertex_ids]
+        destinos = [t for t in idx if t is not None]
+        matriz = np.full((len(idx), len(idx)), np.inf)
+        preds = [None] * len(idx)
+        expandidos = 0
+        for k, s in enumerate(idx):
+            if s is None:
+                continue
+            busqueda, n = self._buscar(s, destinos)
+            matriz[k] = [self._costo(busqueda, t)[0] if t is not None else np.inf for t in idx]
+            preds[k] = busqueda
+            expandidos += n
+        return matriz, preds, expandidos
+
+    def ruta_desde_pred(self, pred, destino_id, pesos=None):
+        """Filas hacia destino_id a partir de una búsqueda de matriz_costos."""
+        t = self.base.indice(destino_id)
+        if pred is None or t is None:
+            return []
+        return self._filas(self._expandir(pred, t))
+
+    def k_caminos(self, *args, **kwargs):
+        """Alternativas de Yen sobre el grafo base (los desvíos pueden salir por vértices interiores)."""
+        return self.base.k_caminos(*args, **kwargs)
+
+
+def contraer(grafo):
+    """Atajo: contrae el grafo e informa la reducción."""
+    red = RedContraida(grafo)
+    print(f"   ✓ Cadenas de grado 2 contraídas en {red.segundos_construccion:.2f}s: "
+          f"{red.n_vertices:,} vértices ({1 - red.n_vertices / max(grafo.n_vertices, 1):.0%} menos), "
+          f"{red.n_aristas:,} aristas ({1 - red.n_aristas / max(grafo.n_aristas, 1):.0%} menos)")
+    return red
+
+
+def comparar(grafo, red, pares, semilla=42):
+    """
+    Tiempo por consulta (Dijkstra punto a punto, con expansión a aristas de red_vial)
+    en el grafo base y en el contraído sobre los mismos pares; cuenta pares con costo distinto.
+    """
+    rnd = random.Random(semilla)
+    od = [(int(rnd.choice(grafo.vertex_id)), int(rnd.choice(grafo.vertex_id))) for _ in range(pares)]
+    t_base, t_red, exp_base, exp_red, diferencias = [], [], [], [], 0
+    for s, t in od:
+        t0 = time.perf_counter()
+        filas_b, e_b = grafo.ruta(s, t)
+        t_base.append((time.perf_counter() - t0) * 1000)
+        t0 = time.perf_counter()
+        filas_r, e_r = red.ruta(s, t)
+        t_red.append((time.perf_counter() - t0) * 1000)
+        exp_base.append(e_b)
+        exp_red.append(e_r)
+        c_b, c_r = sum(f["cost"] for f in filas_b), sum(f["cost"] for f in filas_r)
+        if abs(c_b - c_r) > 1e-6 * max(1.0, c_b) or bool(filas_b) != bool(filas_r):
+            diferencias += 1
+    return {
+        "pares": pares,
+        "ms_base": round(statistics.mean(t_base), 3),
+        "ms_contraida": round(statistics.mean(t_red), 3),
+        "aceleracion": round(statistics.mean(t_base) / max(statistics.mean(t_red), 1e-9), 2),
+        "expandidos_base": round(statistics.mean(exp_base)),
+        "expandidos_contraida": round(statistics.mean(exp_red)),
+        "pares_con_costo_distinto": diferencias,
+    }
+
+
+def main(out_dir="/app/out", pares=PARES_BENCHMARK):
+    """Contrae la red actual e informa reducción y aceleración (out_dir/contraccion_cadenas.json)."""
+    print("🔗 CONTRACCIÓN DE CADENAS DE GRADO 2 - Red vial")
+    conn = get_conn()
+    grafo = cargar_grafo(conn, con_coordenadas=False)
+    conn.close()
+    if grafo.n_aristas == 0:
+        print("⚠️  Red vial vacía, no se contrae")
+        return None
+    red = contraer(grafo)
+    reporte = {
+        "vertices_base": grafo.n_vertices, "aristas_base": grafo.n_aristas,
+        "vertices_contraida": red.n_vertices, "aristas_contraida": red.n_aristas,
+        "cadenas": len(red.nodos), "segundos_construccion": round(red.segundos_construccion, 3),
+    }
+    if pares > 0:
+        reporte.update(comparar(grafo, red, pares))
+        print(f"   ✓ {pares} pares O/D: {reporte['ms_base']:.2f} ms → {reporte['ms_contraida']:.2f} ms por consulta "
+              f"({reporte['aceleracion']:.1f}x), expandidos {reporte['expandidos_base']:,} → {reporte['expandidos_contraida']:,}, "
+              f"pares con costo distinto: {reporte['pares_con_costo_distinto']}")
+    os.makedirs(out_dir, exist_ok=True)
+    ruta = os.path.join(out_dir, ARCHIVO_REPORTE)
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(reporte, f, ensure_ascii=False, indent=2)
+    print(f"✔ Reporte: {ruta}")
+    return reporte
+
+
+if __name__ == "__main__":
+    main(os.environ.get("OUT_DIR", "/app/out"))
@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Contraction Hierarchies (CH) sobre la red vial.
+Paso offline que se ejecuta después de crear la topología: ordena los vértices,
+los contrae agregando atajos y guarda jerarquía + atajos en un artefacto binario
+(.npz). Las consultas son búsquedas bidireccionales sólo "hacia arriba" y los
+atajos se desempaquetan de vuelta a ids de aristas de red_vial.
+
+Trabaja sobre el grafo no dirigido de GrafoRuteo (misma semántica que
+pgr_dijkstra con directed := false).
+"""
+import hashlib
+import heapq
+import os
+import time
+
+import numpy as np
+import psycopg2
+
+from grafo_ruteo import INF, cargar_grafo
+
+ARCHIVO_CH = "red_vial_ch.npz"
+
+# Búsqueda de testigos acotada: más nodos = menos atajos, construcción más lenta
+MAX_ASENTADOS_TESTIGO = 60
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def firma_grafo(grafo):
+    """Huella de la red (ids de aristas, extremos y costos) para detectar artefactos obsoletos."""
+    h = hashlib.sha1()
+    for arr in (grafo.edge_id, grafo.vertex_id[grafo.edge_source], grafo.vertex_id[grafo.edge_target],
+                grafo.costo, grafo.reverse_costo):
+        h.update(np.ascontiguousarray(arr).tobytes())
+    return h.hexdigest()
+
+
+# ----------------------------------------------------------------------
+# Construcción
+# ----------------------------------------------------------------------
+def _testigos(adj, origen, excluido, objetivos, limite):
+    """Dijkstra acotado desde origen sin pasar por 'excluido'; retorna distancias a objetivos."""
+    dist = {origen: 0.0}
+    heap = [(0.0, origen)]
+    pendientes = set(objetivos)
+    asentados = 0
+    while heap and pendientes and asentados < MAX_ASENTADOS_TESTIGO:
+        d, u = heapq.heappop(heap)
+        if d > dist.get(u, INF):
+            continue
+        if d > limite:
+            break
+        asentados += 1
+        pendientes.discard(u)
+        for v, (w, _) in adj[u].items():
+            if v == excluido:
+                continue
+            nd = d + w
+            if nd < dist.get(v, INF):
+                dist[v] = nd
+                heapq.heappush(heap, (nd, v))
+    return dist
+
+
+def _atajos_necesarios(adj, v):
+    """Pares (u, w, peso) que necesitan atajo si se contrae v."""
+    vecinos = list(adj[v].items())
+    atajos = []
+    for i, (u, (w_uv, _)) in enumerate(vecinos):
+        resto = vecinos[i + 1:]
+        if not resto:
+            continue
+        limite = w_uv + max(w_vw for _, (w_vw, _) in resto)
+        dist = _testigos(adj, u, v, [w for w, _ in resto], limite)
+        for w, (w_vw, _) in resto:
+            necesario = w_uv + w_vw
+            if dist.get(w, INF) > necesario:
+                atajos.append((u, w, necesario))
+    return atajos
+
+
+def construir_ch(grafo, verbose=True):
+    """
+    Contrae todos los vértices del grafo y retorna el diccionario de arreglos
+    que se guarda en el artefacto.
+    """
+    if grafo.dirigido:
+        raise ValueError("La CH se construye sobre el grafo no dirigido")
+    t0 = time.time()
+    n = grafo.n_vertices
+
+    # Aristas CH: base (apuntan a una arista de red_vial) o atajos (dos hijos + vértice medio)
+    ch_origen, ch_destino, ch_medio, ch_hijo1, ch_hijo2, ch_arista, ch_peso = [], [], [], [], [], [], []
+
+    def nueva(u, w, peso, medio=-1, h1=-1, h2=-1, arista=-1):
+        ch_origen.append(u); ch_destino.append(w); ch_medio.append(medio)
+        ch_hijo1.append(h1); ch_hijo2.append(h2); ch_arista.append(arista); ch_peso.append(peso)
+        return len(ch_peso) - 1
+
+    # Adyacencia no dirigida con la arista más barata por par de vértices
+    mejor = {}
+    for u in range(n):
+        for a in range(grafo._ptr[u], grafo._ptr[u + 1]):
+            v = grafo._dst[a]
+            if v == u:
+                continue
+            par = (min(u, v), max(u, v))
+            if par not in mejor or grafo._peso[a] < mejor[par][0]:
+                mejor[par] = (grafo._peso[a], grafo._ari[a])
+    adj = [dict() for _ in range(n)]
+    for (u, v), (w, e) in mejor.items():
+        ident = nueva(u, v, w, arista=e)
+        adj[u][v] = (w, ident)
+        adj[v][u] = (w, ident)
+
+    # Orden inicial por diferencia de aristas
+    contraidos_vecinos = [0] * n
+    def prioridad(v):
+        return len(_atajos_necesarios(adj, v)) - len(adj[v]) + 2 * contraidos_vecinos[v]
+
+    heap = [(prioridad(v), v) for v in range(n)]
+    heapq.heapify(heap)
+    rango = np.full(n, -1, dtype=np.int64)
+    siguiente = 0
+    while heap:
+        p, v = heapq.heappop(heap)
+        if rango[v] >= 0:
+            continue
+        # Actualización perezosa: si la prioridad empeoró, se reencola
+        nueva_p = prioridad(v)
+        if heap and nueva_p > heap[0][0]:
+            heapq.heappush(heap, (nueva_p, v))
+            continue
+
+        for u, w, peso in _atajos_necesarios(adj, v):
+            actual = adj[u].get(w)
+            if actual is not None and actual[0] <= peso:
+                continue
+            ident = nueva(u, w, peso, medio=v, h1=adj[u][v][1], h2=adj[v][w][1])
+            adj[u][w] = (peso, ident)
+            adj[w][u] = (peso, ident)
+
+        rango[v] = siguiente
+        siguiente += 1
+        for u in list(adj[v]):
+            del adj[u][v]
+            contraidos_vecinos[u] += 1
+        adj[v] = {}
+
+        if verbose and siguiente % 20000 == 0:
+            print(f"   ... {siguiente:,}/{n:,} vértices contraídos")
+
+    # Grafo "hacia arriba": cada arista CH se cuelga del extremo de menor rango
+    ch_origen = np.asarray(ch_origen, dtype=np.int64)
+    ch_destino = np.asarray(ch_destino, dtype=np.int64)
+    bajo = np.where(rango[ch_origen] < rango[ch_destino], ch_origen, ch_destino)
+    alto = np.where(rango[ch_origen] < rango[ch_destino], ch_destino, ch_origen)
+    orden = np.argsort(bajo, kind="stable")
+    up_indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(bajo, minlength=n), out=up_indptr[1:])
+
+    n_atajos = int(np.sum(np.asarray(ch_medio) >= 0))
+    if verbose:
+        print(f"   ✓ CH construida en {time.time() - t0:.1f}s: {n_atajos:,} atajos, {len(ch_peso):,} aristas CH")
+
+    return {
+        "firma": np.array(firma_grafo(grafo)),
+        "vertex_id": grafo.vertex_id,
+        "edge_id": grafo.edge_id,
+        "edge_longitud": grafo.longitud,
+        "rango": rango,
+        "up_indptr": up_indptr,
+        "up_dst": alto[orden],
+        "up_arista_ch": orden.astype(np.int64),
+        "ch_origen": ch_origen,
+        "ch_destino": ch_destino,
+        "ch_medio": np.asarray(ch_medio, dtype=np.int64),
+        "ch_hijo1": np.asarray(ch_hijo1, dtype=np.int64),
+        "ch_hijo2": np.asarray(ch_hijo2, dtype=np.int64),
+        "ch_arista": np.asarray(ch_arista, dtype=np.int64),
+        "ch_peso": np.asarray(ch_peso, dtype=np.float64),
+    }
+
+
+def guardar_ch(datos, ruta):
+    np.savez_compressed(ruta, **datos)
+
+
+# ----------------------------------------------------------------------
+# Consultas
+# ----------------------------------------------------------------------
+class ConsultaCH:
+    """Consultas punto a punto sobre un artefacto CH."""
+
+    def __init__(self, datos):
+        self.firma = str(datos["firma"])
+        self.vertex_id = datos["vertex_id"]
+        self.edge_id = datos["edge_id"]
+        self.edge_longitud = datos["edge_longitud"]
+        self._indice = {int(v): i for i, v in enumerate(self.vertex_id)}
+        self._ptr = datos["up_indptr"].tolist()
+        self._dst = datos["up_dst"].tolist()
+        up_arista = datos["up_arista_ch"]
+        self._ari = up_arista.tolist()
+        self._peso = datos["ch_peso"][up_arista].tolist()
+        self._origen = datos["ch_origen"].tolist()
+        self._destino = datos["ch_destino"].tolist()
+        self._medio = datos["ch_medio"].tolist()
+        self._hijo1 = datos["ch_hijo1"].tolist()
+        self._hijo2 = datos["ch_hijo2"].tolist()
+        self._arista = datos["ch_arista"].tolist()
+        self._ch_peso = datos["ch_peso"].tolist()
+
+    @classmethod
+    def cargar(cls, ruta, grafo=None):
+        """Carga el artefacto; si se entrega el grafo actual, verifica que no esté obsoleto."""
+        with np.load(ruta) as datos:
+            consulta = cls({k: datos[k] for k in datos.files})
+        if grafo is not None and consulta.firma != firma_grafo(grafo):
+            raise Exception(f"Artefacto CH obsoleto ({ruta}): la red vial cambió, reconstruir con contraccion_jerarquica")
+        return consulta
+
+    def _buscar(self, s, t):
+        """Búsqueda bidireccional hacia arriba. Retorna (costo, encuentro, pred_f, pred_b, expandidos)."""
+        ptr, dst, peso, ari = self._ptr, self._dst, self._peso, self._ari
+        dist = ({s: 0.0}, {t: 0.0})
+        pred = ({s: -1}, {t: -1})
+        heaps = ([(0.0, s)], [(0.0, t)])
+        asentado = (set(), set())
+        mejor, encuentro, expandidos = INF, -1, 0
+        while heaps[0] or heaps[1]:
+            # Dirección con menor clave; se corta cuando ninguna puede mejorar
+            lado = 0 if heaps[0] and (not heaps[1] or heaps[0][0][0] <= heaps[1][0][0]) else 1
+            d, u = heapq.heappop(heaps[lado])
+            if d >= mejor:
+                heaps[lado].clear()
+                continue
+            if u in asentado[lado]:
+                continue
+            asentado[lado].add(u)
+            expandidos += 1
+            otro = dist[1 - lado].get(u)
+            if otro is not None and d + otro < mejor:
+                mejor, encuentro = d + otro, u
+            for a in range(ptr[u], ptr[u + 1]):
+                v = dst[a]
+                nd = d + peso[a]
+                if nd < dist[lado].get(v, INF):
+                    dist[lado][v] = nd
+                    pred[lado][v] = ari[a]
+                    heapq.heappush(heaps[lado], (nd, v))
+        return mejor, encuentro, pred[0], pred[1], expandidos
+
+    def _desempaquetar(self, arista_ch, desde):
+        """Aristas CH base (id, vértice de salida) que componen una arista CH recorrida desde 'desde'."""
+        salida = []
+        pila = [(arista_ch, desde)]
+        while pila:
+            e, x = pila.pop()
+            if self._medio[e] < 0:
+                salida.append((e, x))
+                continue
+            m = self._medio[e]
+            if x == self._origen[e]:
+                # origen -> medio -> destino (se apila al revés)
+                pila.append((self._hijo2[e], m))
+                pila.append((self._hijo1[e], x))
+            else:
+                pila.append((self._hijo1[e], m))
+                pila.append((self._hijo2[e], x))
+        return salida
+
+    def _otro_extremo(self, e, x):
+        return self._destino[e] if self._origen[e] == x else self._origen[e]
+
+    def consulta(self, origen_id, destino_id):
+        """
+        Ruta más corta entre dos vértices. Retorna (filas, expandidos) con filas
+        estilo pgr_dijkstra (seq, node, edge, cost, agg_cost, distancia_m).
+        """
+        s, t = self._indice.get(int(origen_id)), self._indice.get(int(destino_id))
+        if s is None or t is None or s == t:
+            return [], 0
+        costo, m, pred_f, pred_b, expandidos = self._buscar(s, t)
+        if costo == INF:
+            return [], expandidos
+
+        # Tramo s -> m (se reconstruye desde m hacia atrás)
+        subida = []
+        x = m
+        while pred_f[x] != -1:
+            e = pred_f[x]
+            previo = self._otro_extremo(e, x)
+            subida.append((e, previo))
+            x = previo
+        subida.reverse()
+        # Tramo m -> t
+        bajada = []
+        x = m
+        while pred_b[x] != -1:
+            e = pred_b[x]
+            bajada.append((e, x))
+            x = self._otro_extremo(e, x)
+
+        filas, acumulado, seq = [], 0.0, 1
+        for e, desde in subida + bajada:
+            for base, nodo in self._desempaquetar(e, desde):
+                arista, c = self._arista[base], self._ch_peso[base]
+                filas.append({
+                    "seq": seq,
+                    "node": int(self.vertex_id[nodo]),
+                    "edge": int(self.edge_id[arista]),
+                    "cost": c,
+                    "agg_cost": acumulado,
+                    "distancia_m": float(self.edge_longitud[arista]),
+                })
+                acumulado += c
+                seq += 1
+        return filas, expandidos
+
+    def costo(self, origen_id, destino_id):
+        """Sólo el costo (sin desempaquetar atajos)."""
+        s, t = self._indice.get(int(origen_id)), self._indice.get(int(destino_id))
+        if s is None or t is None:
+            return INF
+        if s == t:
+            return 0.0
+        return self._buscar(s, t)[0]
+
+
+def main(out_dir="/app/out"):
+    """Paso offline: construye la CH de la red actual y la guarda en out_dir."""
+    print("🏗️  CONTRACTION HIERARCHIES - Preprocesamiento de la red vial")
+    conn = get_conn()
+    grafo = cargar_grafo(conn, con_coordenadas=False)
+    conn.close()
+    if grafo.n_aristas == 0:
+        print("⚠️  Red vial vacía, no se construye CH")
+        return None
+    datos = construir_ch(grafo)
+    os.makedirs(out_dir, exist_ok=True)
+    ruta = os.path.join(out_dir, ARCHIVO_CH)
+    guardar_ch(datos, ruta)
+    print(f"✔ Artefacto CH guardado: {ruta} ({os.path.getsize(ruta):,} bytes)")
+    return ruta
+
+
+if __name__ == "__main__":
+    main(os.environ.get("OUT_DIR", "/app/out"))
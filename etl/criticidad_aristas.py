@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Criticidad de aristas: betweenness de aristas restringida a la demanda
+oficina→oficina (cada par ordenado de oficinas activas pesa 1).
+
+Por cada vértice de oficina de origen se arma un árbol de caminos mínimos
+(Dijkstra que se detiene al asentar todas las oficinas) y se acumula, desde las
+hojas hacia la raíz, cuántos pares pasan por cada arista; sólo se recorre la
+unión de los caminos hacia oficinas, no toda la red. Ante empates de costo
+cuenta un camino, el mismo que entregaría el ruteo.
+
+- Exacta si hay hasta MUESTRA vértices de origen; si hay más, se muestrean
+  MUESTRA orígenes y se escala por n/MUESTRA (estimador de Brandes-Pich).
+- Los orígenes se reparten en un pool de procesos que comparte el grafo por fork.
+- Resultado en la tabla criticidad_aristas (criticidad = pares / máximo) y en
+  criticidad_aristas.geojson como capa del mapa.
+"""
+import json
+import multiprocessing as mp
+import os
+import random
+import shutil
+import time
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from cache_rutas import versiones
+from grafo_ruteo import INF, SQL_ARISTAS, cargar_grafo
+from loader_infraestructura import asegurar_componentes
+
+MUESTRA = int(os.getenv("CRITICIDAD_MUESTRA", "200"))
+PROCESOS = int(os.getenv("CRITICIDAD_PROCESOS", str(os.cpu_count() or 1)))
+# Aristas con criticidad menor no se exportan al mapa (la tabla las guarda todas)
+UMBRAL_EXPORTAR = 0.01
+
+# Estado compartido con los workers (se asigna antes del fork)
+_GRAFO = None
+_ARCO_ORIGEN = None
+_ARCO_ARISTA = None
+_PESO_DESTINO = None  # {índice de vértice: cantidad de oficinas en él}
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def ensure_tabla(cur):
+    """Tabla criticidad_aristas (ver 00_schema_completo.sql)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS criticidad_aristas (
+          edge_id INTEGER PRIMARY KEY REFERENCES red_vial(id) ON DELETE CASCADE,
+          pares DOUBLE PRECISION NOT NULL,
+          criticidad DOUBLE PRECISION NOT NULL,
+          exacta BOOLEAN,
+          version_topologia INTEGER,
+          calculado TIMESTAMP DEFAULT NOW()
+        );
+        CREATE INDEX IF NOT EXISTS criticidad_aristas_criticidad_idx ON criticidad_aristas(criticidad DESC);
+    """)
+
+
+def _dependencias(s):
+    """
+    Worker: pares oficina→oficina desde el vértice s que usan cada arista.
+    Retorna (índices de arista, pares) como arreglos NumPy.
+    """
+    destinos = _PESO_DESTINO
+    dist, pred, _ = _GRAFO.buscar([(s, 0.0)], destinos=set(destinos))
+    origen, ari = _ARCO_ORIGEN, _ARCO_ARISTA
+    # Unión de los caminos s→oficina (sub-árbol del árbol de caminos mínimos)
+    flujo = {}
+    for t, w in destinos.items():
+        if t == s or dist[t] == INF:
+            continue
+        flujo[t] = flujo.get(t, 0.0) + w
+        v = origen[pred[t]]
+        while v != s and v not in flujo:
+            flujo[v] = 0.0
+            v = origen[pred[v]]
+    # De las hojas a la raíz: lo que pasa por v también pasa por el arco que llega a v
+    aristas, pares = [], []
+    for v in sorted(flujo, key=dist.__getitem__, reverse=True):
+        a = pred[v]
+        aristas.append(ari[a])
+        pares.append(flujo[v])
+        u = origen[a]
+        if u != s:
+            flujo[u] += flujo[v]
+    return np.asarray(aristas, dtype=np.int64), np.asarray(pares, dtype=np.float64)
+
+
+def calcular_criticidad(grafo, vertices_oficinas, muestra=MUESTRA, procesos=PROCESOS, semilla=42):
+    """
+    Betweenness de aristas por demanda oficina→oficina.
+    vertices_oficinas: ids de vértice (uno por oficina; se repiten si comparten vértice).
+    Retorna (pares por arista como arreglo de n_aristas, exacta).
+    """
+    global _GRAFO, _ARCO_ORIGEN, _ARCO_ARISTA, _PESO_DESTINO
+    peso = {}
+    for vid in vertices_oficinas:
+        i = grafo.indice(vid)
+        if i is not None:
+            peso[i] = peso.get(i, 0) + 1
+    origenes = sorted(peso)
+    exacta = muestra <= 0 or len(origenes) <= muestra
+    if not exacta:
+        origenes = random.Random(semilla).sample(origenes, muestra)
+    escala = 1.0 if exacta else len(peso) / len(origenes)
+
+    _GRAFO, _ARCO_ORIGEN, _ARCO_ARISTA, _PESO_DESTINO = grafo, grafo.arco_origen.tolist(), grafo.arco_arista.tolist(), peso
+    total = np.zeros(grafo.n_aristas)
+    try:
+        with mp.get_context("fork").Pool(max(1, procesos)) as pool:
+            # Cada origen representa a todas las oficinas de su vértice
+            for s, (aristas, pares) in zip(origenes, pool.imap(_dependencias, origenes, chunksize=2)):
+                np.add.at(total, aristas, pares * peso[s])
+    finally:
+        _GRAFO = _ARCO_ORIGEN = _ARCO_ARISTA = _PESO_DESTINO = None
+    return total * escala, exacta
+
+
+def guardar(cur, grafo, pares, exacta, version_topologia):
+    maximo = pares.max() if len(pares) else 0.0
+    usadas = np.flatnonzero(pares > 0)
+    cur.execute("TRUNCATE criticidad_aristas;")
+    execute_values(cur, """
+        INSERT INTO criticidad_aristas (edge_id, pares, criticidad, exacta, version_topologia) VALUES %s;
+    """, [(int(grafo.edge_id[e]), float(pares[e]), float(pares[e] / maximo), exacta, version_topologia) for e in usadas],
+        page_size=1000)
+    return len(usadas)
+
+
+def exportar_geojson(cur, out_file, umbral=UMBRAL_EXPORTAR):
+    cur.execute("""
+        SELECT ST_AsGeoJSON(rv.geom, 6), rv.id, rv.nombre, rv.tipo_via, c.pares, c.criticidad
+        FROM criticidad_aristas c JOIN red_vial rv ON rv.id = c.edge_id
+        WHERE c.criticidad >= %s
+        ORDER BY c.criticidad;
+    """, (umbral,))
+    features = [{"type": "Feature", "geometry": json.loads(g), "properties": {
+        "tipo": "criticidad", "edge_id": eid, "calle": nombre, "tipo_via": tipo_via,
+        "pares": round(pares, 1), "criticidad": round(crit, 4)}}
+        for g, eid, nombre, tipo_via, pares, crit in cur.fetchall()]
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump({"type": "FeatureCollection", "features": features,
+                   "metadata": {"tipo": "criticidad_aristas", "demanda": "pares de oficinas activas", "umbral": umbral}},
+                  f, ensure_ascii=False, separators=(",", ":"))
+    return len(features)
+
+
+def main(out_dir="/app/out", muestra=MUESTRA, procesos=PROCESOS):
+    print("🕸️  CRITICIDAD DE ARISTAS (betweenness por demanda oficina→oficina)")
+    os.makedirs(out_dir, exist_ok=True)
+    out_file = os.path.join(out_dir, "criticidad_aristas.geojson")
+    conn = get_conn()
+    cur = conn.cursor()
+    ensure_tabla(cur)
+    asegurar_componentes(conn)
+    version_topologia, _ = versiones(cur)
+    cur.execute("""
+        SELECT v.id FROM oficinas o
+        CROSS JOIN LATERAL (
+            SELECT id FROM red_vial_vertices_pgr WHERE en_componente_principal
+            ORDER BY the_geom <-> o.geom LIMIT 1
+        ) v
+        WHERE o.activo AND o.geom IS NOT NULL;
+    """)
+    vertices = [r[0] for r in cur.fetchall()]
+    conn.commit()
+    if len(vertices) < 2:
+        print("   Menos de 2 oficinas activas: nada que medir")
+        cur.close()
+        conn.close()
+        return 0
+
+    grafo = cargar_grafo(conn, sql_aristas=SQL_ARISTAS, con_coordenadas=False)
+    t0 = time.perf_counter()
+    pares, exacta = calcular_criticidad(grafo, vertices, muestra, procesos)
+    print(f"✓ {len(vertices)} oficinas, {'exacta' if exacta else f'muestra de {muestra} orígenes'}, "
+          f"{procesos} procesos: {time.perf_counter() - t0:.1f}s")
+    n = guardar(cur, grafo, pares, exacta, version_topologia)
+    conn.commit()
+    cur.execute("""
+        SELECT rv.nombre, c.criticidad FROM criticidad_aristas c JOIN red_vial rv ON rv.id = c.edge_id
+        ORDER BY c.criticidad DESC LIMIT 5;
+    """)
+    for nombre, crit in cur.fetchall():
+        print(f"   • {nombre or 'Calle sin nombre'}: {crit:.2f}")
+    exportadas = exportar_geojson(cur, out_file)
+    cur.close()
+    conn.close()
+    print(f"✅ {n} aristas con demanda; {out_file} ({exportadas} aristas con criticidad ≥ {UMBRAL_EXPORTAR})")
+    web_data_dir = os.environ.get("WEB_DATA_DIR")
+    if web_data_dir and os.path.isdir(web_data_dir):
+        shutil.copy2(out_file, os.path.join(web_data_dir, "criticidad_aristas.geojson"))
+    return n
+
+
+if __name__ == "__main__":
+    main()
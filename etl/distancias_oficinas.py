@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Distancia de red y tiempo de caminata entre cada par de oficinas activas.
+Los trámites siempre van de oficina en oficina, así que estos números se
+calculan una vez (un solo pgr_dijkstraCost muchos-a-muchos sobre la red base,
+sin amenazas) y se leen de la tabla distancias_oficinas en vez de volver a rutear.
+
+- run_etl la deja al día (paso 2.5) después de cargar oficinas y asignar vértices.
+  Con otra versión de topología se recalcula completa; si sólo cambian oficinas
+  (alta, baja, desactivación o nuevo vértice más cercano) se recalculan
+  únicamente los pares que tocan esas oficinas. loader_metadata conserva los ids
+  de las oficinas que siguen, así que una recarga sin cambios no recalcula nada.
+- etl_ruta_dijkstra la usa para decidir tramos entre oficinas sin armar la
+  matriz, y el mapa la muestra en el popup de cada oficina
+  (distancias_oficinas.json, por coordenadas).
+"""
+import json
+import os
+import shutil
+
+import psycopg2
+
+from cache_rutas import ensure_cache, versiones
+
+VELOCIDAD_M_MIN = 83.33
+# Oficinas más cercanas por tipo que se exportan para el popup del mapa
+VECINAS_POPUP = 3
+# Red base no dirigida (como la matriz de etl_ruta_dijkstra): d(a, b) = d(b, a)
+SQL_ARISTAS_BASE = "SELECT id, source, target, costo as cost, reverse_costo as reverse_cost FROM red_vial WHERE source IS NOT NULL AND target IS NOT NULL AND costo > 0"
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def ensure_tabla(cur):
+    """Tabla distancias_oficinas (ver 00_schema_completo.sql)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS distancias_oficinas (
+          origen_id INTEGER REFERENCES oficinas(id) ON DELETE CASCADE,
+          destino_id INTEGER REFERENCES oficinas(id) ON DELETE CASCADE,
+          origen_vertex BIGINT,
+          destino_vertex BIGINT,
+          distancia_m DOUBLE PRECISION,
+          tiempo_caminata_min DOUBLE PRECISION,
+          version_topologia INTEGER,
+          calculado TIMESTAMP DEFAULT NOW(),
+          PRIMARY KEY (origen_id, destino_id)
+        );
+        CREATE INDEX IF NOT EXISTS distancias_oficinas_vertices_idx ON distancias_oficinas(origen_vertex, destino_vertex);
+    """)
+
+
+def actualizar_distancias(conn):
+    """
+    Deja distancias_oficinas al día con las oficinas activas y la topología actual.
+    Retorna dict con oficinas, oficinas recalculadas y pares escritos.
+    """
+    cur = conn.cursor()
+    ensure_cache(cur)
+    ensure_tabla(cur)
+    version_topologia, _ = versiones(cur)
+
+    # Vértice más cercano de cada oficina activa en la topología vigente
+    # (oficinas.vertex_id puede ser de la topología anterior si aún no corre snapping.py)
+    cur.execute("""
+        CREATE TEMP TABLE _oficinas_red ON COMMIT DROP AS
+        SELECT o.id, v.id AS vertex_id
+        FROM oficinas o
+        CROSS JOIN LATERAL (
+            SELECT id FROM red_vial_vertices_pgr
+            WHERE en_componente_principal
+            ORDER BY the_geom <-> o.geom LIMIT 1
+        ) v
+        WHERE o.activo AND o.geom IS NOT NULL;
+    """)
+    cur.execute("SELECT COUNT(*) FROM _oficinas_red;")
+    n_oficinas = cur.fetchone()[0]
+
+    # Fuera: pares de otra topología, de oficinas inactivas/borradas o cuyo vértice cambió
+    cur.execute("""
+        DELETE FROM distancias_oficinas d
+        WHERE d.version_topologia IS DISTINCT FROM %s
+           OR NOT EXISTS (SELECT 1 FROM _oficinas_red a WHERE a.id = d.origen_id AND a.vertex_id = d.origen_vertex)
+           OR NOT EXISTS (SELECT 1 FROM _oficinas_red b WHERE b.id = d.destino_id AND b.vertex_id = d.destino_vertex);
+    """, (version_topologia,))
+    # Pendientes: oficinas sin ninguna fila como origen (nuevas o recién invalidadas)
+    cur.execute("""
+        SELECT a.id, a.vertex_id FROM _oficinas_red a
+        WHERE NOT EXISTS (SELECT 1 FROM distancias_oficinas d WHERE d.origen_id = a.id);
+    """)
+    pendientes = cur.fetchall()
+    if n_oficinas < 2 or not pendientes:
+        conn.commit()
+        cur.close()
+        return {"oficinas": n_oficinas, "recalculadas": 0, "pares": 0}
+
+    # Un solo muchos-a-muchos: oficinas pendientes × todas (red no dirigida, se escriben ambos sentidos)
+    cur.execute("""
+        CREATE TEMP TABLE _costos_oficinas ON COMMIT DROP AS
+        SELECT start_vid, end_vid, agg_cost
+        FROM pgr_dijkstraCost(%s, %s::bigint[], (SELECT array_agg(DISTINCT vertex_id) FROM _oficinas_red), directed := false);
+    """, (SQL_ARISTAS_BASE, sorted({v for _, v in pendientes})))
+    # costo = longitud en metros (loader_infraestructura), así que agg_cost ya es distancia;
+    # sin fila en la matriz = sin camino (distancia NULL)
+    ids = [p[0] for p in pendientes]
+    cur.execute("""
+        INSERT INTO distancias_oficinas (origen_id, destino_id, origen_vertex, destino_vertex,
+                                         distancia_m, tiempo_caminata_min, version_topologia)
+        SELECT a.id, b.id, a.vertex_id, b.vertex_id, m.distancia, m.distancia / %s, %s
+        FROM _oficinas_red a
+        JOIN _oficinas_red b ON b.id <> a.id
+        LEFT JOIN (
+            SELECT start_vid AS va, end_vid AS vb, agg_cost FROM _costos_oficinas
+            UNION
+            SELECT end_vid, start_vid, agg_cost FROM _costos_oficinas
+        ) c ON c.va = a.vertex_id AND c.vb = b.vertex_id
+        CROSS JOIN LATERAL (
+            SELECT CASE WHEN a.vertex_id = b.vertex_id THEN 0 ELSE c.agg_cost END AS distancia
+        ) m
+        WHERE a.id = ANY(%s) OR b.id = ANY(%s)
+        ON CONFLICT (origen_id, destino_id) DO NOTHING;
+    """, (VELOCIDAD_M_MIN, version_topologia, ids, ids))
+    pares = cur.rowcount
+    conn.commit()
+    cur.close()
+    return {"oficinas": n_oficinas, "recalculadas": len(pendientes), "pares": pares}
+
+
+def distancias_vertices(conn, pares):
+    """
+    {(vértice a, vértice b): distancia_m} de los pares pedidos que están en la tabla
+    con la topología vigente (inf si no hay camino). Pares ausentes: no son de oficinas.
+    """
+    pares = {(int(a), int(b)) for a, b in pares}
+    if not pares:
+        return {}
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('distancias_oficinas') IS NOT NULL AND to_regclass('versiones_red') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        cur.close()
+        return {}
+    cur.execute("""
+        SELECT DISTINCT ON (d.origen_vertex, d.destino_vertex) d.origen_vertex, d.destino_vertex, d.distancia_m
+        FROM distancias_oficinas d
+        JOIN unnest(%s::bigint[], %s::bigint[]) AS p(a, b) ON d.origen_vertex = p.a AND d.destino_vertex = p.b
+        WHERE d.version_topologia = (SELECT version FROM versiones_red WHERE clave = 'topologia');
+    """, ([a for a, _ in pares], [b for _, b in pares]))
+    resultado = {(a, b): float("inf") if m is None else m for a, b, m in cur.fetchall()}
+    cur.close()
+    return resultado
+
+
+def exportar_json(cur, out_file, vecinas=VECINAS_POPUP):
+    """
+    Para el popup del mapa: por oficina (clave "lat,lon" con 6 decimales, como en las
+    capas de oficinas) sus `vecinas` oficinas más cercanas por red de cada tipo.
+    """
+    cur.execute("""
+        SELECT a.lat, a.lon, b.nombre, b.tipo, d.distancia_m, d.tiempo_caminata_min
+        FROM (
+            SELECT d.*, row_number() OVER (PARTITION BY d.origen_id, b.tipo ORDER BY d.distancia_m) AS rango
+            FROM distancias_oficinas d JOIN oficinas b ON b.id = d.destino_id
+            WHERE d.distancia_m IS NOT NULL
+        ) d
+        JOIN oficinas a ON a.id = d.origen_id
+        JOIN oficinas b ON b.id = d.destino_id
+        WHERE d.rango <= %s
+        ORDER BY a.id, d.distancia_m;
+    """, (vecinas,))
+    por_oficina = {}
+    for lat, lon, nombre, tipo, metros, minutos in cur.fetchall():
+        por_oficina.setdefault(f"{lat:.6f},{lon:.6f}", []).append(
+            {"nombre": nombre, "tipo": tipo, "distancia_m": round(metros), "caminata_min": round(minutos, 1)})
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump({"velocidad_m_min": VELOCIDAD_M_MIN, "oficinas": por_oficina}, f, ensure_ascii=False)
+    return len(por_oficina)
+
+
+def main(out_dir="/app/out"):
+    print("📏 DISTANCIAS ENTRE OFICINAS (red base, muchos-a-muchos)")
+    os.makedirs(out_dir, exist_ok=True)
+    out_file = os.path.join(out_dir, "distancias_oficinas.json")
+    conn = get_conn()
+    r = actualizar_distancias(conn)
+    if r["recalculadas"]:
+        print(f"✓ {r['recalculadas']} de {r['oficinas']} oficinas recalculadas ({r['pares']} pares)")
+    else:
+        print(f"✓ Tabla al día ({r['oficinas']} oficinas)")
+    cur = conn.cursor()
+    n = exportar_json(cur, out_file)
+    cur.close()
+    conn.close()
+    print(f"✅ Archivo generado: {out_file} ({n} oficinas)")
+    web_data_dir = os.environ.get("WEB_DATA_DIR")
+    if web_data_dir and os.path.isdir(web_data_dir):
+        shutil.copy2(out_file, os.path.join(web_data_dir, "distancias_oficinas.json"))
+    return r
+
+
+if __name__ == "__main__":
+    main()
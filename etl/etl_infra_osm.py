@@ -9,6 +9,12 @@ import shutil
 import requests
 from typing import Dict, List, Tuple
 import time
+from collections import Counter
+from itertools import chain
+
+import numpy as np
+
+from grafo_ruteo import haversine_np
 
 # Configuración
 OSM_OVERPASS_URL = "https://overpass-api.de/api/interpreter"
@@ -99,7 +105,7 @@ def _get_demo_data() -> Dict:
     }
 
 def transform_to_geojson(osm_data: Dict) -> Dict:
-    """Transforma elementos OSM a GeoJSON de calles"""
+    """Transforma elementos OSM a GeoJSON de calles, nodado en los nodos compartidos"""
     features = []
     
     for element in osm_data.get('elements', []):
@@ -134,69 +140,119 @@ def transform_to_geojson(osm_data: Dict) -> Dict:
     
     return {
         "type": "FeatureCollection",
-        "features": features
+        "features": asignar_longitudes(list(nodar_features(features)))
     }
 
+def asignar_longitudes(features: List[Dict]) -> List[Dict]:
+    """
+    Agrega length_m (metros, haversine) a las propiedades de cada LineString
+    que no la traiga, en una sola pasada vectorizada sobre todos los vértices:
+    suma acumulada de los tramos y diferencia entre el inicio y el fin de cada vía.
+    El loader la inserta como length_m / costo / reverse_costo.
+    """
+    pendientes = [f for f in features
+                  if (f.get('geometry') or {}).get('type') == 'LineString'
+                  and len(f['geometry']['coordinates']) >= 2
+                  and 'length_m' not in f.setdefault('properties', {})]
+    if not pendientes:
+        return features
+    puntos = np.fromiter(chain.from_iterable(chain.from_iterable(f['geometry']['coordinates'] for f in pendientes)),
+                         dtype=float).reshape(-1, 2)  # (lon, lat)
+    largos = np.array([len(f['geometry']['coordinates']) for f in pendientes])
+    inicios = np.concatenate(([0], np.cumsum(largos)[:-1]))
+    tramos = haversine_np(puntos[:-1, 1], puntos[:-1, 0], puntos[1:, 1], puntos[1:, 0])
+    acumulado = np.concatenate(([0.0], np.cumsum(tramos)))
+    longitudes = np.round(acumulado[inicios + largos - 1] - acumulado[inicios], 2)
+    for feat, largo in zip(pendientes, longitudes.tolist()):
+        feat['properties']['length_m'] = largo
+    return features
+
+def nodar_features(features: List[Dict]):
+    """
+    Corta cada vía (LineString) en todo nodo interior compartido con otra vía o
+    repetido en la misma (rotondas, lazos), para que la red quede nodada en los
+    cruces y no sólo en los extremos de cada way de OSM.
+
+    Hash espacial = clave_nodo (coordenada a 6 decimales, la misma de
+    transform_to_nodes_edges y topologia_directa): un conteo de usos por clave y
+    luego una sola pasada que emite los tramos a medida que recorre cada vía.
+    Cada tramo conserva las propiedades de su vía más "segmento" (orden dentro
+    de la vía). Es idempotente: una red ya nodada sale igual.
+    """
+    lineas = [f for f in features
+              if (f.get('geometry') or {}).get('type') == 'LineString' and len(f['geometry']['coordinates']) >= 2]
+    claves = [[clave_nodo(lon, lat) for lon, lat in f['geometry']['coordinates']] for f in lineas]
+    usos = Counter(clave for claves_via in claves for clave in claves_via)
+    for feat, claves_via in zip(lineas, claves):
+        coords = feat['geometry']['coordinates']
+        props = feat.get('properties', {})
+        inicio, segmento = 0, 0
+        for i in range(1, len(coords)):
+            if i < len(coords) - 1 and usos[claves_via[i]] < 2:
+                continue
+            yield {
+                "type": "Feature",
+                "geometry": {"type": "LineString", "coordinates": coords[inicio:i + 1]},
+                "properties": dict(props, segmento=props.get("segmento", 0) + segmento),
+            }
+            inicio, segmento = i, segmento + 1
+
+def clave_nodo(lon: float, lat: float) -> str:
+    """Clave de deduplicación de nodos por coordenada (6 decimales, ~0.1 m)"""
+    return f"{lon:.6f},{lat:.6f}"
+
 def transform_to_nodes_edges(osm_data: Dict) -> Dict:
-    """Transforma OSM a formato nodos/aristas para pgRouting"""
-    nodes_dict = {}
-    edges = []
-    node_counter = 0
-    edge_counter = 0
+    """
+    Transforma OSM a formato nodos/aristas para pgRouting.
+    Los nodos se deduplican por coordenada en un índice clave -> posición
+    (id N<posición>) y sus coordenadas viven en arreglos; las longitudes de
+    todas las aristas se calculan al final en una sola pasada vectorizada (haversine).
+    """
+    indice = {}
+    lats, lons = [], []
+    sources, targets, vias = [], [], []
     
     for element in osm_data.get('elements', []):
         if element.get('type') != 'way' or 'geometry' not in element:
             continue
         
-        geometry = element['geometry']
-        tags = element.get('tags', {})
-        
         # Procesar nodos de esta vía
         way_nodes = []
-        for node in geometry:
-            node_key = f"{node['lon']:.6f},{node['lat']:.6f}"
-            
-            if node_key not in nodes_dict:
-                node_id = f"N{node_counter}"
-                nodes_dict[node_key] = {
-                    "id": node_id,
-                    "lat": node['lat'],
-                    "lon": node['lon'],
-                    "tipo": "via"
-                }
-                node_counter += 1
-            
-            way_nodes.append(nodes_dict[node_key]['id'])
+        for node in element['geometry']:
+            node_key = clave_nodo(node['lon'], node['lat'])
+            k = indice.get(node_key)
+            if k is None:
+                k = indice[node_key] = len(lats)
+                lats.append(node['lat'])
+                lons.append(node['lon'])
+            way_nodes.append(k)
         
-        # Crear aristas entre nodos consecutivos
-        for i in range(len(way_nodes) - 1):
-            source = way_nodes[i]
-            target = way_nodes[i + 1]
-            
-            # Calcular costo aproximado (distancia euclidiana simple)
-            source_coords = next(n for n in nodes_dict.values() if n['id'] == source)
-            target_coords = next(n for n in nodes_dict.values() if n['id'] == target)
-            
-            # Distancia aproximada en metros (fórmula simple)
-            lat_diff = target_coords['lat'] - source_coords['lat']
-            lon_diff = target_coords['lon'] - source_coords['lon']
-            dist_aprox = ((lat_diff ** 2 + lon_diff ** 2) ** 0.5) * 111000  # ~111km por grado
-            
-            edge = {
-                "id": f"E{edge_counter}",
-                "source": source,
-                "target": target,
-                "costo": round(dist_aprox, 2),
-                "nombre": tags.get('name', 'Sin nombre'),
-                "tipo_via": tags.get('highway', 'unknown'),
-                "osm_way_id": element.get('id')
-            }
-            edges.append(edge)
-            edge_counter += 1
+        # Aristas entre nodos consecutivos (la vía de cada una queda en `vias`)
+        sources.extend(way_nodes[:-1])
+        targets.extend(way_nodes[1:])
+        vias.extend([element] * (len(way_nodes) - 1))
+    
+    lat, lon = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    s, t = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+    longitudes = np.round(haversine_np(lat[s], lon[s], lat[t], lon[t]), 2).tolist()
+    
+    nodos = [{"id": f"N{k}", "lat": la, "lon": lo, "tipo": "via"} for k, (la, lo) in enumerate(zip(lats, lons))]
+    aristas = []
+    for j, (a, b, costo, element) in enumerate(zip(sources, targets, longitudes, vias)):
+        tags = element.get('tags', {})
+        aristas.append({
+            "id": f"E{j}",
+            "source": f"N{a}",
+            "target": f"N{b}",
+            "costo": costo,
+            "nombre": tags.get('name', 'Sin nombre'),
+            "tipo_via": tags.get('highway', 'unknown'),
+            "osm_way_id": element.get('id')
+        })
     
     return {
-        "nodos": list(nodes_dict.values()),
-        "aristas": edges
+        "nodos": nodos,
+        "aristas": aristas
     }
 
 def export_files(geojson_data: Dict, nodes_edges_data: Dict, out_dir: str):
@@ -238,7 +294,8 @@ def main(out_dir: str = "/app/out"):
     print(f"📊 Estadísticas:")
     print(f"   - Nodos: {len(nodes_edges_data['nodos'])}")
     print(f"   - Aristas: {len(nodes_edges_data['aristas'])}")
-    print(f"   - Features GeoJSON: {len(geojson_data['features'])}")
+    vias = len({f['properties']['osm_id'] for f in geojson_data['features']})
+    print(f"   - Features GeoJSON: {len(geojson_data['features'])} tramos nodados ({vias} vías)")
     
     # 3. Cargar (exportar archivos)
     export_files(geojson_data, nodes_edges_data, out_dir)
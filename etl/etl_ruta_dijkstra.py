@@ -11,6 +11,65 @@ import shutil
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import math # Para calcular distancia recta
+from cache_rutas import PERFIL_AMENAZAS, PERFIL_BASE, CacheRutas, estadisticas
+from contraccion_cadenas import contraer
+from distancias_oficinas import distancias_vertices
+from grafo_ruteo import SQL_ARISTAS, cargar_grafo
+from loader_infraestructura import asegurar_componentes
+from penalizacion_amenazas import (MULTIPLICADOR_SEVERIDAD, SEVERIDAD_BLOQUEO, SQL_ARISTAS_PENALIZADAS, SQL_ARISTAS_PGR_PENALIZADAS,
+                                   actualizar_penalizacion, aristas_penalizadas)
+from salida_ruta import compactar_ruta, serializar
+from snapping import SnapperVertices
+
+# Motor de ruteo: "memoria" (grafo CSR cargado una vez) o "pgrouting" (pgr_dijkstra por segmento)
+MOTOR_RUTEO = os.getenv("RUTEO_MOTOR", "memoria")
+# Modo de cálculo: "segmentos" (snap + ruta por par de paradas) o "matriz" (todos los costos antes de pedir geometría)
+MODO_RUTEO = os.getenv("RUTEO_MODO", "matriz")
+# Motor en memoria: "1" busca sobre la red con cadenas de grado 2 contraídas (contraccion_cadenas; mismos costos)
+CONTRACCION_CADENAS = os.getenv("RUTEO_CONTRACCION", "1") == "1"
+# Algoritmo de búsqueda: "dijkstra" o "astar" (heurística haversine admisible)
+ALGORITMO_RUTEO = os.getenv("RUTEO_ALGORITMO", "dijkstra")
+# Amenazas: "1" aplica red_vial_penalizacion (multiplicador / bloqueo) al costo de las aristas;
+# por defecto no, el baseline de Fase 2 es sólo longitud
+CONSIDERA_AMENAZAS = os.getenv("RUTEO_AMENAZAS", "0") == "1"
+# Caché de tramos (rutas_calculadas + LRU en proceso): "0" para desactivarla
+USAR_CACHE = os.getenv("RUTEO_CACHE", "1") == "1"
+FACTOR_RODEO = 2.5
+# Formato de ruta_dijkstra.geojson: "aristas" (un Feature por arista), "tramos" (geometría fusionada por tramo) o "polyline"
+FORMATO_SALIDA = os.getenv("RUTEO_SALIDA", "tramos")
+# Alternativas (Yen en memoria / pgr_KSP) cuando el tramo se descarta; < 2 vuelve a la línea recta.
+# Sólo con amenazas: sin ellas el costo es la longitud, el rango 1 ya es el camino más corto en metros
+# y ninguna otra alternativa puede pasar el filtro de rodeo que él no pasó
+K_ALTERNATIVAS = int(os.getenv("RUTEO_K_ALTERNATIVAS", "3"))
+# Mayor multiplicador que no bloquea: una alternativa que pasa el filtro de rodeo cuesta a lo más esto × sus metros
+MULTIPLICADOR_MAXIMO = max(MULTIPLICADOR_SEVERIDAD[:SEVERIDAD_BLOQUEO - 1])
+# pgr_aStar mide la heurística en grados: metros por grado de longitud en el extremo sur de Gran Santiago (~34°S),
+# cota inferior para ambos ejes, así la heurística euclidiana sigue siendo admisible
+FACTOR_ASTAR_PGR = 111320 * math.cos(math.radians(34.0))
+
+SQL_ARISTAS_PGR = "SELECT id, source, target, costo as cost, reverse_costo as reverse_cost FROM red_vial WHERE source IS NOT NULL AND target IS NOT NULL AND costo > 0"
+SQL_ARISTAS_ASTAR_PGR = """SELECT rv.id, rv.source, rv.target, rv.costo as cost, rv.reverse_costo as reverse_cost,
+    ST_X(vs.the_geom) AS x1, ST_Y(vs.the_geom) AS y1, ST_X(vt.the_geom) AS x2, ST_Y(vt.the_geom) AS y2
+    FROM red_vial rv JOIN red_vial_vertices_pgr vs ON vs.id = rv.source JOIN red_vial_vertices_pgr vt ON vt.id = rv.target
+    WHERE rv.costo > 0"""
+SQL_ARISTAS_ASTAR_PGR_PENALIZADAS = """SELECT rv.id, rv.source, rv.target,
+    CASE WHEN p.bloqueado THEN -1 ELSE rv.costo * COALESCE(p.multiplicador, 1) END AS cost,
+    CASE WHEN p.bloqueado THEN -1 ELSE rv.reverse_costo * COALESCE(p.multiplicador, 1) END AS reverse_cost,
+    ST_X(vs.the_geom) AS x1, ST_Y(vs.the_geom) AS y1, ST_X(vt.the_geom) AS x2, ST_Y(vt.the_geom) AS y2
+    FROM red_vial rv JOIN red_vial_vertices_pgr vs ON vs.id = rv.source JOIN red_vial_vertices_pgr vt ON vt.id = rv.target
+    LEFT JOIN red_vial_penalizacion p ON p.edge_id = rv.id
+    WHERE rv.costo > 0"""
+
+def sql_aristas_pgr(amenazas=False, astar=False):
+    """SQL de aristas para pgRouting: costo crudo o penalizado por amenazas (join con red_vial_penalizacion)."""
+    if astar: return SQL_ARISTAS_ASTAR_PGR_PENALIZADAS if amenazas else SQL_ARISTAS_ASTAR_PGR
+    return SQL_ARISTAS_PGR_PENALIZADAS if amenazas else SQL_ARISTAS_PGR
+
+# Nombre que queda en metadata.algoritmo según (algoritmo, motor en memoria)
+NOMBRES_ALGORITMO = {
+    ("dijkstra", True): "dijkstra en memoria (CSR)", ("dijkstra", False): "pgr_dijkstra",
+    ("astar", True): "A* en memoria (heurística haversine)", ("astar", False): "pgr_aStar",
+}
 
 def get_connection():
     # (Misma función que ya tienes)
@@ -21,21 +80,12 @@ def get_connection():
     )
 
 def encontrar_vertice_cercano(cur, lat, lon):
-    # (Misma función inteligente que ya tienes)
+    # KNN sobre la componente principal ya marcada en red_vial_vertices_pgr (ver loader_infraestructura.marcar_componentes)
     print(f"   Buscando vértice cercano a ({lat}, {lon}) en el componente principal...")
-    # ... (código SQL idéntico) ...
     cur.execute("""
-        WITH componentes AS (
-            SELECT component, COUNT(node) as num_nodos
-            FROM pgr_connectedComponents('SELECT id, source, target, costo as cost FROM red_vial WHERE source IS NOT NULL AND costo > 0')
-            GROUP BY component ORDER BY num_nodos DESC LIMIT 1
-        ), vertices_validos AS (
-            SELECT id FROM red_vial_vertices_pgr v
-            JOIN pgr_connectedComponents('SELECT id, source, target, costo as cost FROM red_vial WHERE source IS NOT NULL AND costo > 0') cc ON v.id = cc.node
-            JOIN componentes c ON cc.component = c.component
-        )
         SELECT v.id, ST_Distance(v.the_geom::geography, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography) as dist
-        FROM red_vial_vertices_pgr v JOIN vertices_validos vv ON v.id = vv.id
+        FROM red_vial_vertices_pgr v
+        WHERE v.en_componente_principal
         ORDER BY v.the_geom <-> ST_SetSRID(ST_MakePoint(%s, %s), 4326)
         LIMIT 1;
     """, (lon, lat, lon, lat))
@@ -52,7 +102,233 @@ def haversine(lat1, lon1, lat2, lon2):
     a = math.sin(delta_phi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2)**2
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a)); return R * c
 
-def generar_ruta_compraventa(cur):
+def ruta_segmento_pgrouting(cur, origen_id, destino_id, algoritmo="dijkstra", amenazas=False):
+    """Segmento con pgr_dijkstra / pgr_aStar (pgRouting relee y arma el grafo en cada llamada)."""
+    if algoritmo == "astar":
+        ruta_sql = "SELECT seq, node, edge, cost FROM pgr_aStar(%s, %s::bigint, %s::bigint, directed := false, heuristic := 4, factor := %s)"
+        params = (sql_aristas_pgr(amenazas, astar=True), origen_id, destino_id, FACTOR_ASTAR_PGR)
+    else:
+        ruta_sql = "SELECT seq, node, edge, cost FROM pgr_dijkstra(%s, %s::bigint, %s::bigint, directed := false)"
+        params = (sql_aristas_pgr(amenazas), origen_id, destino_id)
+    cur.execute(f"""
+        WITH ruta AS ( {ruta_sql} )
+        SELECT r.seq, ST_AsGeoJSON(rv.geom)::json AS geometry, COALESCE(rv.length_m, 0) AS distancia_m,
+               COALESCE(rv.nombre, 'Calle sin nombre') as calle, rv.tipo_via, rv.id AS edge
+        FROM ruta r JOIN red_vial rv ON r.edge = rv.id WHERE r.edge > 0 ORDER BY r.seq;
+    """, params)
+    return cur.fetchall()
+
+def geometria_aristas(cur, edge_ids):
+    """Geometría y atributos de un conjunto de aristas en una sola consulta."""
+    cur.execute("""
+        SELECT id, ST_AsGeoJSON(geom)::json AS geometry, COALESCE(length_m, 0) AS distancia_m,
+               COALESCE(nombre, 'Calle sin nombre') as calle, tipo_via
+        FROM red_vial WHERE id = ANY(%s);
+    """, (list(edge_ids),))
+    return {row['id']: row for row in cur.fetchall()}
+
+def filas_con_geometria(pasos, por_id):
+    """Combina los pasos del motor en memoria con la geometría traída de la BD."""
+    return [{"seq": p['seq'], "geometry": por_id[p['edge']]['geometry'], "distancia_m": por_id[p['edge']]['distancia_m'],
+             "calle": por_id[p['edge']]['calle'], "tipo_via": por_id[p['edge']]['tipo_via'], "edge": p['edge']} for p in pasos if p['edge'] in por_id]
+
+def ruta_segmento_memoria(cur, grafo, origen_id, destino_id, algoritmo="dijkstra"):
+    """
+    Segmento con el grafo en memoria; a la BD sólo se le pide la geometría de las aristas usadas.
+    Retorna (filas, vértices expandidos).
+    """
+    pasos, expandidos = grafo.ruta(origen_id, destino_id, algoritmo)
+    if not pasos: return [], expandidos
+    return filas_con_geometria(pasos, geometria_aristas(cur, [p['edge'] for p in pasos])), expandidos
+
+def snap_y_matriz_pgrouting(cur, paradas, amenazas=False):
+    """
+    Snapping de todas las paradas + pgr_dijkstraCostMatrix en UNA consulta.
+    vertices queda alineado con paradas: None si la parada no tiene vértice (su tramo usa el fallback).
+    """
+    cur.execute("""
+        WITH paradas AS (
+            SELECT * FROM unnest(%s::int[], %s::float8[], %s::float8[]) AS p(idx, lon, lat)
+        ), snaps AS (
+            SELECT p.idx, v.id, ST_Distance(v.the_geom::geography, ST_SetSRID(ST_MakePoint(p.lon, p.lat), 4326)::geography) AS dist
+            FROM paradas p
+            LEFT JOIN LATERAL (
+                SELECT id, the_geom FROM red_vial_vertices_pgr
+                WHERE en_componente_principal
+                ORDER BY the_geom <-> ST_SetSRID(ST_MakePoint(p.lon, p.lat), 4326) LIMIT 1
+            ) v ON true
+        ), matriz AS (
+            SELECT start_vid, end_vid, agg_cost
+            FROM pgr_dijkstraCostMatrix(%s, (SELECT array_agg(DISTINCT id) FROM snaps WHERE id IS NOT NULL), directed := false)
+        )
+        SELECT (SELECT json_agg(snaps ORDER BY idx) FROM snaps) AS snaps,
+               (SELECT COALESCE(json_agg(matriz), '[]'::json) FROM matriz) AS matriz;
+    """, (list(range(len(paradas))), [p['lon'] for p in paradas], [p['lat'] for p in paradas], sql_aristas_pgr(amenazas)))
+    r = cur.fetchone()
+    vertices = [{"id": s['id'], "dist": s['dist']} if s['id'] is not None else None for s in (r['snaps'] or [])]
+    for k, v in enumerate(vertices):
+        if v is None: print(f"   ⚠️  Parada {k+1}: sin vértice en la componente principal")
+    costos = {(m['start_vid'], m['end_vid']): m['agg_cost'] for m in r['matriz']}
+    return vertices, costos
+
+def rutas_tramos_pgrouting(cur, pares, amenazas=False):
+    """Geometría de varios tramos con un solo pgr_dijkstra (combinaciones origen/destino)."""
+    combinaciones = "SELECT * FROM (VALUES " + ", ".join(f"({int(s)}::bigint, {int(t)}::bigint)" for s, t in pares) + ") AS c(source, target)"
+    cur.execute("""
+        WITH ruta AS ( SELECT start_vid, end_vid, seq, edge FROM pgr_dijkstra(%s, %s, directed := false) WHERE edge > 0 )
+        SELECT r.start_vid, r.end_vid, r.seq, ST_AsGeoJSON(rv.geom)::json AS geometry, COALESCE(rv.length_m, 0) AS distancia_m,
+               COALESCE(rv.nombre, 'Calle sin nombre') as calle, rv.tipo_via, rv.id AS edge
+        FROM ruta r JOIN red_vial rv ON r.edge = rv.id ORDER BY r.start_vid, r.end_vid, r.seq;
+    """, (sql_aristas_pgr(amenazas), combinaciones))
+    por_par = {}
+    for row in cur.fetchall(): por_par.setdefault((row['start_vid'], row['end_vid']), []).append(row)
+    return por_par
+
+def tramos_en_cache(cache, vertices, n_tramos):
+    """Tramos ya calculados {i: filas} según la caché ({} si no hay caché)."""
+    if cache is None: return {}
+    hits = {}
+    for i in range(n_tramos):
+        if i + 1 >= len(vertices) or not vertices[i] or not vertices[i + 1]: continue
+        filas = cache.obtener(vertices[i]['id'], vertices[i + 1]['id'])
+        if filas is not None: hits[i] = filas
+    return hits
+
+def rutas_ksp_pgrouting(cur, origen_id, destino_id, k, amenazas=False):
+    """k caminos con pgr_KSP, ya con geometría: [(costo, filas)]."""
+    cur.execute("""
+        WITH ksp AS ( SELECT path_id, path_seq, edge, cost FROM pgr_KSP(%s, %s::bigint, %s::bigint, %s, directed := false) WHERE edge > 0 )
+        SELECT k.path_id, k.path_seq AS seq, k.cost, ST_AsGeoJSON(rv.geom)::json AS geometry, COALESCE(rv.length_m, 0) AS distancia_m,
+               COALESCE(rv.nombre, 'Calle sin nombre') as calle, rv.tipo_via, rv.id AS edge
+        FROM ksp k JOIN red_vial rv ON k.edge = rv.id ORDER BY k.path_id, k.path_seq;
+    """, (sql_aristas_pgr(amenazas), origen_id, destino_id, k))
+    por_camino = {}
+    for row in cur.fetchall(): por_camino.setdefault(row['path_id'], []).append(row)
+    return [(sum(float(r['cost']) for r in filas), filas) for _, filas in sorted(por_camino.items())]
+
+def alternativas_tramo(cur, origen_id, destino_id, directa, grafo=None, cache=None, k=K_ALTERNATIVAS, amenazas=False):
+    """
+    Hasta k alternativas reales sin ciclos del tramo: caché (precalculadas en el ETL,
+    ver alternativas_rutas.py) → Yen en memoria (cortado en limite_alternativas(directa)) → pgr_KSP.
+    Retorna [{rango, costo, distancia_m, toca_amenazas, filas}] ordenadas por costo.
+    """
+    alts = cache.alternativas(origen_id, destino_id) if cache is not None else None
+    if alts is not None: return alts
+    if grafo is not None:
+        caminos = grafo.k_caminos(origen_id, destino_id, k, limite=limite_alternativas(directa))
+        por_id = geometria_aristas(cur, {f['edge'] for _, fs in caminos for f in fs})
+        caminos = [(c, filas_con_geometria(fs, por_id)) for c, fs in caminos]
+    else:
+        caminos = rutas_ksp_pgrouting(cur, origen_id, destino_id, k, amenazas)
+    penalizadas = aristas_penalizadas(cur, {f['edge'] for _, fs in caminos for f in fs}) if caminos else set()
+    alts = [{"rango": r, "costo": float(c), "distancia_m": sum(float(f['distancia_m'] or 0) for f in fs),
+             "toca_amenazas": any(f['edge'] in penalizadas for f in fs), "filas": fs} for r, (c, fs) in enumerate(caminos, start=1)]
+    if cache is not None: cache.guardar_alternativas(origen_id, destino_id, alts)
+    return alts
+
+def limite_alternativas(directa):
+    """Costo penalizado máximo de una alternativa que todavía puede medir menos de FACTOR_RODEO × directa."""
+    return MULTIPLICADOR_MAXIMO * FACTOR_RODEO * directa
+
+def elegir_alternativa(alts, directa):
+    """
+    Mejor alternativa real al tramo descartado (sólo con amenazas: el camino de menor costo
+    penalizado puede ser un rodeo en metros que una alternativa por zona amenazada no es).
+    El rango 1 es el mismo camino que se acaba de descartar, así que no se considera; las
+    demás deben pasar el mismo filtro de rodeo (metros de red < FACTOR_RODEO × distancia
+    directa). Entre las que pasan, la de menor costo que no toca aristas penalizadas; si no
+    hay, la más corta en metros. None → línea recta.
+    """
+    validas = [a for a in alts or [] if a['rango'] > 1 and a['distancia_m'] < directa * FACTOR_RODEO]
+    if not validas: return None
+    libres = [a for a in validas if not a['toca_amenazas']]
+    if libres: return libres[0]
+    return min(validas, key=lambda a: a['distancia_m'])
+
+def resolver_tramos_matriz(cur, paradas, grafo=None, snapper=None, amenazas=False, cache=None):
+    """
+    Modo matriz: todos los costos parada→parada primero (una consulta pgr_dijkstraCostMatrix
+    o una búsqueda en memoria por parada) y geometría SÓLO para los tramos que la ruta
+    final usa (los que pasan el filtro de rodeo 2.5x, medido en metros de red; el costo,
+    penalizado o no, sólo elige el camino).
+    Con pgRouting son 2 viajes a la BD (snap+matriz, geometría); en memoria, 1 (geometría).
+    Con caché, los tramos ya conocidos no se recalculan; en memoria, si están todos, ni siquiera se arma la matriz.
+    En memoria, los tramos entre oficinas se deciden con distancias_oficinas (red base): sin amenazas es su costo;
+    con amenazas es una cota inferior que basta para descartar por rodeo. Si todo se decide así, tampoco hay matriz.
+    Retorna (vertices, tramos, expandidos) con tramos[i] = filas del tramo i ([] si se usa fallback)
+    y expandidos = vértices expandidos por la matriz en memoria (0 si no hizo falta; None con pgRouting).
+    """
+    n_tramos = len(paradas) - 1
+    directas = [haversine(paradas[i]['lat'], paradas[i]['lon'], paradas[i + 1]['lat'], paradas[i + 1]['lon']) for i in range(n_tramos)]
+    tabla = {}; preds = None; expandidos = 0
+    if grafo is not None:
+        if snapper is not None:
+            ids, dists = snapper.snap([p['lat'] for p in paradas], [p['lon'] for p in paradas])
+            vertices = [{"id": int(v), "dist": float(d)} for v, d in zip(ids, dists)]
+        else:
+            vertices = [encontrar_vertice_cercano(cur, p['lat'], p['lon']) for p in paradas]
+        cacheados = tramos_en_cache(cache, vertices, n_tramos)
+        if len(cacheados) == n_tramos:
+            print(f"   ✓ {n_tramos} tramos desde caché, sin calcular matriz")
+            return vertices, cacheados, 0
+        vids = [v['id'] if v else None for v in vertices]
+        pendientes = [i for i in range(n_tramos) if i not in cacheados and vids[i] is not None and vids[i + 1] is not None]
+        base = distancias_vertices(cur.connection, [(vids[i], vids[i + 1]) for i in pendientes])
+        for i in pendientes:
+            d = base.get((vids[i], vids[i + 1]))
+            if d is not None and (not amenazas or d >= directas[i] * FACTOR_RODEO): tabla[i] = d
+        if tabla: print(f"   ✓ {len(tabla)} tramos decididos con distancias_oficinas")
+        if len(tabla) < len(pendientes):
+            ajustados = [v for v in vids if v is not None]
+            matriz, preds, expandidos = grafo.matriz_costos(ajustados)
+            pos = {v: k for k, v in enumerate(ajustados)}
+            costo = lambda a, b: matriz[pos[a], pos[b]]
+            print(f"   ✓ Matriz de costos {len(ajustados)}x{len(ajustados)} en memoria: {len(ajustados)} búsquedas Dijkstra, una por parada ({expandidos:,} vértices expandidos)")
+    else:
+        vertices, costos = snap_y_matriz_pgrouting(cur, paradas, amenazas); expandidos = None
+        costo = lambda a, b: 0.0 if a == b else costos.get((a, b), float("inf"))
+        cacheados = tramos_en_cache(cache, vertices, n_tramos)
+        print(f"   ✓ Matriz de costos {len(vertices)}x{len(vertices)} con una consulta pgr_dijkstraCostMatrix (snapping incluido)")
+
+    pares = {i: (vertices[i]['id'], vertices[i + 1]['id']) for i in range(n_tramos)
+             if i + 1 < len(vertices) and vertices[i] and vertices[i + 1] and i not in cacheados}
+    evaluados = {i: tabla[i] if i in tabla else costo(a, b) for i, (a, b) in pares.items()}
+    # El rodeo se mide en metros de red: con amenazas el costo penalizado no es una longitud. Sin amenazas
+    # costo = length_m; con amenazas, en memoria se reconstruye el camino desde preds y con pgRouting se trae
+    # la geometría de todos los tramos con ruta (la tabla de distancias ya está en metros).
+    pasos = {}; por_par = None
+    if amenazas and grafo is None:
+        por_par = rutas_tramos_pgrouting(cur, {pares[i] for i, c in evaluados.items() if c != float("inf")}, amenazas)
+    usados = {}
+    for i, (a, b) in pares.items():
+        c = evaluados[i]; directa = directas[i]
+        if c == float("inf"): print(f"   ⚠️  Tramo {i+1}: sin ruta en la red"); continue
+        if i in tabla or (not amenazas and grafo is None): largo = c
+        elif grafo is not None:
+            pasos[i] = grafo.ruta_desde_pred(preds[pos[a]], b)
+            largo = sum(p['distancia_m'] for p in pasos[i])
+        else: largo = sum(float(r['distancia_m'] or 0) for r in por_par.get((a, b), []))
+        if largo >= directa * FACTOR_RODEO: print(f"   ⚠️  Tramo {i+1}: descartado por rodeo ({largo:.0f}m vs {directa:.0f}m), no se pide geometría")
+        else: usados[i] = (a, b)
+
+    tramos = {i: [] for i in range(n_tramos)}
+    tramos.update(cacheados)
+    if usados:
+        if grafo is not None:
+            # Tramos decididos por la tabla no tienen predecesores: se buscan sólo esos
+            pasos = {i: pasos[i] if i in pasos else grafo.ruta(a, b)[0] for i, (a, b) in usados.items()}
+            por_id = geometria_aristas(cur, {p['edge'] for ps in pasos.values() for p in ps})
+            for i, ps in pasos.items(): tramos[i] = filas_con_geometria(ps, por_id)
+        else:
+            if por_par is None: por_par = rutas_tramos_pgrouting(cur, set(usados.values()), amenazas)
+            for i, par in usados.items(): tramos[i] = por_par.get(par, [])
+    if cache is not None:
+        # Tramos sin ruta útil se guardan vacíos (sólo quedan en el LRU)
+        for i, c in evaluados.items():
+            cache.guardar(vertices[i]['id'], vertices[i + 1]['id'], tramos[i], "dijkstra (matriz)", c if i in usados else None)
+    return vertices, tramos, expandidos
+
+def generar_ruta_compraventa(cur, grafo=None, snapper=None, modo=MODO_RUTEO, algoritmo=ALGORITMO_RUTEO, amenazas=False, cache=None):
     # (Misma definición de paradas que ya tienes)
     print("🏠 Simulando trámite: COMPRAVENTA DE INMUEBLE")
     print("=" * 60)
@@ -63,12 +339,24 @@ def generar_ruta_compraventa(cur):
     ]
     print("\n📋 RUTA DEL TRÁMITE:"); [print(f"\n{i+1}. {p['nombre']}\n   📍 {p['direccion']}") for i, p in enumerate(paradas)]
     
-    all_features = []; distancia_total_ruta = 0; distancia_total_directa = 0
+    all_features = []; distancia_total_ruta = 0; distancia_total_directa = 0; expandidos_total = 0
     tiempo_total = sum(p['tiempo_tramite'] for p in paradas)
     
     print("\n🗺️  CALCULANDO RUTAS (con fallback visual MÁS AGRESIVO):")
     print("-" * 60)
     
+    tramos = None
+    # Snapping: cada parada una sola vez; con índice en memoria, todas en una llamada vectorizada
+    if modo == "matriz":
+        vertices, tramos, expandidos_total = resolver_tramos_matriz(cur, paradas, grafo, snapper, amenazas, cache)
+        expandidos_total = expandidos_total or 0
+    elif snapper is not None:
+        ids, dists = snapper.snap([p['lat'] for p in paradas], [p['lon'] for p in paradas])
+        vertices = [{"id": int(v), "dist": float(d)} for v, d in zip(ids, dists)]
+        print(f"   ✓ {len(vertices)} paradas ajustadas a la red (KD-tree): " + ", ".join(f"{v['id']} ({v['dist']:.0f}m)" for v in vertices))
+    else:
+        vertices = [encontrar_vertice_cercano(cur, p['lat'], p['lon']) for p in paradas]
+    
     for i in range(len(paradas) - 1):
         origen = paradas[i]; destino = paradas[i + 1]
         distancia_directa_segmento = haversine(origen['lat'], origen['lon'], destino['lat'], destino['lon'])
@@ -76,34 +364,40 @@ def generar_ruta_compraventa(cur):
         print(f"\n🚶 Segmento {i+1}: {origen['nombre']} → {destino['nombre']}")
         print(f"   Distancia directa: {distancia_directa_segmento:.0f}m")
         
-        v_origen = encontrar_vertice_cercano(cur, origen['lat'], origen['lon'])
-        v_destino = encontrar_vertice_cercano(cur, destino['lat'], destino['lon'])
+        v_origen = vertices[i] if i < len(vertices) else None; v_destino = vertices[i + 1] if i + 1 < len(vertices) else None
         
         rows = None; distancia_calculada_segmento = 0; ruta_valida = False
 
         if v_origen and v_destino:
             print(f"   Vértices: {v_origen['id']} → {v_destino['id']}")
             try:
-                # (Misma consulta SQL a pgr_dijkstra que ya tienes)
-                cur.execute("""
-                    WITH ruta AS ( SELECT seq, node, edge, cost FROM pgr_dijkstra(
-                        'SELECT id, source, target, costo as cost, reverse_costo as reverse_cost FROM red_vial WHERE source IS NOT NULL AND target IS NOT NULL AND costo > 0',
-                        %s::bigint, %s::bigint, directed := false ) WHERE edge > 0 )
-                    SELECT r.seq, ST_AsGeoJSON(rv.geom)::json AS geometry, COALESCE(rv.length_m, 0) AS distancia_m,
-                           COALESCE(rv.nombre, 'Calle sin nombre') as calle, rv.tipo_via
-                    FROM ruta r JOIN red_vial rv ON r.edge = rv.id ORDER BY r.seq;
-                """, (v_origen['id'], v_destino['id']))
-                rows = cur.fetchall()
+                en_cache = cache.obtener(v_origen['id'], v_destino['id']) if cache is not None and tramos is None else None
+                if tramos is not None: rows = tramos[i]  # modo matriz: ya calculado (sólo tramos usados traen geometría)
+                elif en_cache is not None: rows = en_cache; print("   ✓ Tramo desde caché")
+                elif grafo is not None:
+                    rows, expandidos = ruta_segmento_memoria(cur, grafo, v_origen['id'], v_destino['id'], algoritmo)
+                    expandidos_total += expandidos
+                    print(f"   Vértices expandidos ({algoritmo}): {expandidos:,}")
+                    if cache is not None: cache.guardar(v_origen['id'], v_destino['id'], rows, algoritmo)
+                else:
+                    rows = ruta_segmento_pgrouting(cur, v_origen['id'], v_destino['id'], algoritmo, amenazas)
+                    if cache is not None: cache.guardar(v_origen['id'], v_destino['id'], rows, algoritmo)
                 
                 if rows:
                     distancia_calculada_segmento = sum(float(row['distancia_m'] or 0) for row in rows)
                     # *** ÚNICO CAMBIO: UMBRAL MÁS BAJO (2.5x) ***
-                    if distancia_calculada_segmento < (distancia_directa_segmento * 2.5): # <-- DE 5 A 2.5
+                    if distancia_calculada_segmento < (distancia_directa_segmento * FACTOR_RODEO): # <-- DE 5 A 2.5
                          ruta_valida = True
                     else:
                         print(f"   ⚠️  Ruta Dijkstra descartada: demasiado larga ({distancia_calculada_segmento:.0f}m vs {distancia_directa_segmento:.0f}m). Usando fallback.")
-            except Exception as e: print(f"   ❌ Error en pgr_dijkstra: {e}")
+            except Exception as e: print(f"   ❌ Error calculando ruta: {e}")
         
+        alt = None
+        if not ruta_valida and v_origen and v_destino and K_ALTERNATIVAS > 1 and amenazas:
+            try: alt = elegir_alternativa(alternativas_tramo(cur, v_origen['id'], v_destino['id'], distancia_directa_segmento, grafo, cache, K_ALTERNATIVAS, amenazas), distancia_directa_segmento)
+            except Exception as e: print(f"   ❌ Error calculando alternativas: {e}"); cur.connection.rollback()
+            if alt is None: print(f"   ⚠️  Ninguna alternativa pasa el filtro de rodeo ({FACTOR_RODEO}x)")
+
         if ruta_valida and rows:
             # Dijkstra OK: usar ruta calculada
             print(f"   ✓ Ruta Dijkstra válida: {distancia_calculada_segmento:.0f}m")
@@ -111,13 +405,20 @@ def generar_ruta_compraventa(cur):
             calles_usadas = []
             for row in rows:
                 if row['geometry']:
-                    all_features.append({"type": "Feature", "geometry": row['geometry'], "properties": { "tipo": "ruta_calculada", "segmento": i+1, "origen": origen['nombre'], "destino": destino['nombre'], "calle": row['calle'], "tipo_via": row['tipo_via'], "distancia_m": round(float(row['distancia_m'] or 0), 1), "secuencia": row['seq'] } })
+                    all_features.append({"type": "Feature", "geometry": row['geometry'], "properties": { "tipo": "ruta_calculada", "segmento": i+1, "origen": origen['nombre'], "destino": destino['nombre'], "calle": row['calle'], "tipo_via": row['tipo_via'], "distancia_m": round(float(row['distancia_m'] or 0), 1), "secuencia": row['seq'], "edge": row.get('edge') } })
                     if row['calle'] != 'Calle sin nombre' and row['calle'] not in calles_usadas: calles_usadas.append(row['calle'])
             if calles_usadas: print(f"   ✓ Calles principales: {', '.join(calles_usadas[:3])}")
+        elif alt:
+            # Fallback real: mejor de las k alternativas (precalculadas o Yen / pgr_KSP)
+            print(f"   ↪️  Alternativa {alt['rango']}/{K_ALTERNATIVAS}: {alt['distancia_m']:.0f}m{' (evita amenazas)' if not alt['toca_amenazas'] else ''}")
+            distancia_total_ruta += alt['distancia_m']
+            for row in alt['filas']:
+                if row['geometry']:
+                    all_features.append({"type": "Feature", "geometry": row['geometry'], "properties": { "tipo": "ruta_alternativa", "segmento": i+1, "origen": origen['nombre'], "destino": destino['nombre'], "calle": row['calle'], "tipo_via": row['tipo_via'], "distancia_m": round(float(row['distancia_m'] or 0), 1), "secuencia": row['seq'], "edge": row.get('edge'), "alternativa": alt['rango'], "toca_amenazas": alt['toca_amenazas'] } })
         else:
             # Fallback: dibujar línea recta
             if not (v_origen and v_destino): print(f"   ⚠️  Fallback: No se encontraron vértices válidos.")
-            elif not rows: print(f"   ⚠️  Fallback: pgr_dijkstra no encontró ruta.")
+            elif not rows: print(f"   ⚠️  Fallback: Dijkstra no encontró ruta.")
             print(f"   ➡️  Dibujando línea recta visual.")
             distancia_total_ruta += distancia_directa_segmento
             all_features.append({"type": "Feature", "geometry": { "type": "LineString", "coordinates": [[origen['lon'], origen['lat']], [destino['lon'], destino['lat']]] }, "properties": { "tipo": "ruta_fallback", "segmento": i+1, "origen": origen['nombre'], "destino": destino['nombre'], "distancia_m": round(distancia_directa_segmento, 1), "nota": "Línea recta visual" } })
@@ -135,13 +436,16 @@ def generar_ruta_compraventa(cur):
     print(f"   🚶 Tiempo caminando: {tiempo_caminata_total} min")
     print(f"   📋 Tiempo en trámites: {sum(p['tiempo_tramite'] for p in paradas)} min")
     print(f"   ⏱️  TIEMPO TOTAL ESTIMADO: {tiempo_total} min ({tiempo_total/60:.1f} horas)")
+    if expandidos_total: print(f"   🔎 Vértices expandidos ({algoritmo}): {expandidos_total:,}")
     print("=" * 60)
     
-    return all_features, distancia_total_ruta, tiempo_total
+    return all_features, distancia_total_ruta, tiempo_total, expandidos_total
 
-def main(out_dir="/app/out"):
+def main(out_dir="/app/out", motor=MOTOR_RUTEO, modo=MODO_RUTEO, algoritmo=ALGORITMO_RUTEO, amenazas=CONSIDERA_AMENAZAS, usar_cache=USAR_CACHE, formato=FORMATO_SALIDA, contraccion=CONTRACCION_CADENAS):
     # (Misma función main que ya tenías)
-    print("\n" + "🚀 " * 20); print("GENERADOR DE RUTA - TRÁMITE DE COMPRAVENTA (con fallback visual MÁS AGRESIVO)"); print("Algoritmo: pgr_dijkstra / Línea Recta si falla"); print("🚀 " * 20 + "\n")
+    # A* es punto a punto: la matriz muchos-a-muchos sigue siendo Dijkstra, así que A* usa el modo por segmentos
+    if algoritmo == "astar" and modo == "matriz": modo = "segmentos"
+    print("\n" + "🚀 " * 20); print("GENERADOR DE RUTA - TRÁMITE DE COMPRAVENTA (con fallback visual MÁS AGRESIVO)"); print(f"Algoritmo: {algoritmo} ({motor}, modo {modo}, amenazas {'sí' if amenazas else 'no'}) / Línea Recta si falla"); print("🚀 " * 20 + "\n")
     os.makedirs(out_dir, exist_ok=True); out_file = os.path.join(out_dir, "ruta_dijkstra.geojson")
     try:
         conn = get_connection(); cur = conn.cursor(cursor_factory=RealDictCursor)
@@ -150,12 +454,26 @@ def main(out_dir="/app/out"):
         if estado['aristas'] == 0 or estado['vertices'] == 0: raise Exception("La red vial no está lista")
         if estado['oficinas'] == 0: print("⚠️ ADVERTENCIA: No hay oficinas cargadas en la BD, la ruta podría fallar.")
 
-        features, distancia, tiempo = generar_ruta_compraventa(cur)
+        asegurar_componentes(conn)
+        if amenazas:
+            # Incremental: sólo recalcula aristas cerca de amenazas nuevas/expiradas/modificadas
+            r = actualizar_penalizacion(conn)
+            print(f"🚧 Penalización por amenazas al día ({r['amenazas_cambiadas']} amenazas cambiadas, {r['aristas_recalculadas']} aristas recalculadas)")
+        # Con el motor en memoria la red se lee una sola vez para todos los segmentos
+        grafo = cargar_grafo(conn, sql_aristas=SQL_ARISTAS_PENALIZADAS if amenazas else SQL_ARISTAS) if motor == "memoria" else None
+        if grafo is not None and contraccion: grafo = contraer(grafo)
+        snapper = SnapperVertices.desde_bd(conn) if motor == "memoria" else None
+        cache = CacheRutas(conn, PERFIL_AMENAZAS if amenazas else PERFIL_BASE) if usar_cache else None
+        features, distancia, tiempo, expandidos = generar_ruta_compraventa(cur, grafo, snapper, modo, algoritmo, amenazas, cache)
+        if cache is not None:
+            st = estadisticas(); print(f"🗃️  Caché de rutas: {st['hits_lru']} hits LRU, {st['hits_bd']} hits BD, {st['misses']} misses (topología v{cache.version_topologia}, amenazas v{cache.version_amenazas})")
         if not features: raise Exception("No se pudo generar ninguna ruta")
         
-        geojson = { "type": "FeatureCollection", "features": features, "metadata": { "tipo": "ruta_tramite_compraventa", "algoritmo": "pgr_dijkstra (con fallback 2.5x)", "descripcion": "Ruta para trámite de compraventa (puede ser línea recta)", "tramite": { "nombre": "Compraventa de Inmueble", "pasos": 3, "oficinas": ["Notaría", "Conservador BR", "SII"], "duracion_estimada_min": tiempo, "distancia_total_km": round(distancia/1000, 2) }, "nota": "Tiempos estimados." } }
-        with open(out_file, 'w', encoding='utf-8') as f: json.dump(geojson, f, ensure_ascii=False, indent=2)
-        print(f"\n✅ Archivo generado: {out_file}")
+        geojson = { "type": "FeatureCollection", "features": features, "metadata": { "tipo": "ruta_tramite_compraventa", "algoritmo": NOMBRES_ALGORITMO[(algoritmo, grafo is not None)] + " (con fallback 2.5x)", "nodos_expandidos": expandidos if grafo is not None else None, "modo_ruteo": modo, "considera_amenazas": amenazas, "k_alternativas": K_ALTERNATIVAS, "formato_salida": formato, "cache": estadisticas() if cache is not None else None, "descripcion": "Ruta para trámite de compraventa (puede ser línea recta)", "tramite": { "nombre": "Compraventa de Inmueble", "pasos": 3, "oficinas": ["Notaría", "Conservador BR", "SII"], "duracion_estimada_min": tiempo, "distancia_total_km": round(distancia/1000, 2) }, "nota": "Tiempos estimados." } }
+        # Formatos compactos: una geometría por tramo fusionada en PostGIS (ver salida_ruta.py)
+        geojson["features"] = compactar_ruta(conn, features, formato); texto = serializar(geojson, formato)
+        with open(out_file, 'w', encoding='utf-8') as f: f.write(texto)
+        print(f"\n✅ Archivo generado: {out_file} (formato {formato}, {len(geojson['features'])} features, {len(texto.encode('utf-8')) / 1024:.1f} KB)")
         web_data_dir = os.environ.get("WEB_DATA_DIR");
         if web_data_dir and os.path.isdir(web_data_dir): shutil.copy2(out_file, os.path.join(web_data_dir, "ruta_dijkstra.geojson")); print("✅ Copiado a servidor web")
         cur.close(); conn.close()
@@ -1,10 +1,33 @@
 #!/usr/bin/env python3
 """
-Script para diagnosticar y reparar la topología de pgRouting
+Script para diagnosticar y reparar la topología de pgRouting.
+
+QA de topología (no interactivo, paso del pipeline después de la carga):
+- lista cada componente conexa con vértices, aristas, km y extensión (caja),
+- busca extremos colgantes (vértices de grado 1) a menos de TOPOLOGIA_BRECHA_M
+  de OTRA componente, con KNN sobre el GiST de vértices,
+- con TOPOLOGIA_CONECTAR=1 (o --conectar) agrega aristas conectoras
+  (tipo_via='conector'): la brecha más corta que une dos componentes aún
+  separadas, como en Kruskal, así que no se agregan conectores redundantes.
+Las oficinas cuyo vértice más cercano cae en una isla quedan así ruteables
+sin que el snapping las fuerce a la componente principal.
+
+Uso: python fix_topology.py [--reparar] [--conectar] [--distancia METROS]
 """
-import psycopg2
+import argparse
+import json
 import os
 
+import psycopg2
+from cache_rutas import invalidar_aristas, invalidar_topologia
+from loader_infraestructura import asegurar_componentes, marcar_componentes
+from red_incremental import completar_longitudes
+from topologia_directa import TOPOLOGIA_MODO, topologia_por_extremos
+
+ARCHIVO_REPORTE = "topologia_componentes.json"
+BRECHA_M = float(os.getenv("TOPOLOGIA_BRECHA_M", "30"))  # distancia máxima de un conector
+TOPOLOGIA_CONECTAR = os.getenv("TOPOLOGIA_CONECTAR", "0") == "1"
+
 def get_conn():
     return psycopg2.connect(
         host=os.getenv("PGHOST","db"),
@@ -98,20 +121,11 @@ def reparar_topologia():
         """)
         conn.commit()
         
-        # 2. Calcular longitudes si faltan
-        print("   2. Calculando longitudes...")
-        cur.execute("""
-            UPDATE red_vial 
-            SET length_m = ST_Length(ST_Transform(geom, 3857))
-            WHERE length_m IS NULL;
-        """)
-        
-        cur.execute("""
-            UPDATE red_vial 
-            SET costo = length_m,
-                reverse_costo = length_m
-            WHERE costo IS NULL OR reverse_costo IS NULL;
-        """)
+        # 2. Completar longitudes faltantes (normalmente ya llegan con la carga)
+        print("   2. Verificando longitudes...")
+        completadas = completar_longitudes(cur)
+        if completadas:
+            print(f"      Longitudes completadas: {completadas} segmentos")
         conn.commit()
         
         # 3. Limpiar topología existente
@@ -120,19 +134,22 @@ def reparar_topologia():
         conn.commit()
         
         # 4. Crear nueva topología
-        print("   4. Creando nueva topología...")
-        cur.execute("""
-            SELECT pgr_createTopology(
-                'red_vial',     -- tabla
-                0.00001,        -- tolerancia
-                'geom',         -- columna geometría
-                'id',           -- columna id
-                'source',       -- columna source
-                'target',       -- columna target
-                rows_where := 'costo > 0',
-                clean := true
-            );
-        """)
+        print(f"   4. Creando nueva topología ({TOPOLOGIA_MODO})...")
+        if TOPOLOGIA_MODO == "directa":
+            topologia_por_extremos(cur, rows_where="costo > 0")
+        else:
+            cur.execute("""
+                SELECT pgr_createTopology(
+                    'red_vial',     -- tabla
+                    0.00001,        -- tolerancia
+                    'geom',         -- columna geometría
+                    'id',           -- columna id
+                    'source',       -- columna source
+                    'target',       -- columna target
+                    rows_where := 'costo > 0',
+                    clean := true
+                );
+            """)
         conn.commit()
         
         # 5. Verificar resultado
@@ -145,6 +162,10 @@ def reparar_topologia():
         """)
         conectados = cur.fetchone()[0]
         
+        marcar_componentes(cur)
+        invalidar_topologia(cur)
+        conn.commit()
+        
         print(f"\n✅ Topología reparada:")
         print(f"   - Vértices creados: {vertices}")
         print(f"   - Segmentos conectados: {conectados}")
@@ -178,17 +199,210 @@ def reparar_topologia():
         cur.close()
         conn.close()
 
-if __name__ == "__main__":
+def listar_componentes(cur):
+    """
+    Una fila por componente (ver loader_infraestructura.marcar_componentes; sin
+    las unitarias de vértices sin aristas, componente < 0), de mayor a menor: vértices, aristas, km, caja [xmin, ymin, xmax, ymax] y su
+    diagonal en metros, y oficinas activas cuyo vértice más cercano cae en ella.
+    """
+    cur.execute("SELECT to_regclass('oficinas') IS NOT NULL;")
+    hay_oficinas = cur.fetchone()[0]
+    oficinas = {}
+    if hay_oficinas:
+        cur.execute("""
+            SELECT c.componente, COUNT(*) FROM oficinas o
+            CROSS JOIN LATERAL (
+                SELECT v.componente FROM red_vial_vertices_pgr v
+                WHERE v.componente > 0
+                ORDER BY v.the_geom <-> o.geom LIMIT 1
+            ) c
+            WHERE o.geom IS NOT NULL AND o.activo
+            GROUP BY c.componente;
+        """)
+        oficinas = dict(cur.fetchall())
+    cur.execute("""
+        WITH v AS (
+            SELECT componente, COUNT(*) AS vertices, BOOL_OR(en_componente_principal) AS principal,
+                   ST_Extent(the_geom) AS caja
+            FROM red_vial_vertices_pgr WHERE componente > 0
+            GROUP BY componente
+        ), a AS (
+            SELECT vv.componente, COUNT(*) AS aristas, SUM(rv.length_m) AS largo
+            FROM red_vial rv JOIN red_vial_vertices_pgr vv ON vv.id = rv.source
+            WHERE rv.costo > 0
+            GROUP BY vv.componente
+        )
+        SELECT v.componente, v.vertices, COALESCE(a.aristas, 0), COALESCE(a.largo, 0), v.principal,
+               ST_XMin(v.caja), ST_YMin(v.caja), ST_XMax(v.caja), ST_YMax(v.caja),
+               ST_Distance(ST_SetSRID(ST_MakePoint(ST_XMin(v.caja), ST_YMin(v.caja)), 4326)::geography,
+                           ST_SetSRID(ST_MakePoint(ST_XMax(v.caja), ST_YMax(v.caja)), 4326)::geography)
+        FROM v LEFT JOIN a USING (componente)
+        ORDER BY v.vertices DESC, v.componente;
+    """)
+    return [{"componente": c, "vertices": nv, "aristas": na, "km": round(largo / 1000, 3), "principal": principal,
+             "caja": [round(x, 6) for x in (xmin, ymin, xmax, ymax)], "diagonal_m": round(diagonal, 1),
+             "oficinas": oficinas.get(c, 0)}
+            for c, nv, na, largo, principal, xmin, ymin, xmax, ymax, diagonal in cur.fetchall()]
+
+def buscar_brechas(cur, distancia_m=BRECHA_M):
+    """
+    Extremos colgantes (grado 1) a menos de `distancia_m` de otra componente.
+    KNN en dos pasadas para que cada una use un índice: desde las islas contra
+    cualquier otra componente (GiST de the_geom; la propia isla es chica y se
+    descarta rápido) y desde la componente principal sólo contra las islas
+    (GiST parcial red_vial_vertices_islas_geom_idx). El KNN ordena en grados y
+    la distancia se filtra en metros (geography) fuera del LATERAL, para no
+    recorrer el índice entero cuando no hay nada cerca.
+    Retorna (colgante, componente, vertice, componente_vertice, metros) por distancia.
+    """
+    cur.execute("""
+        CREATE TEMP TABLE _colgantes ON COMMIT DROP AS
+        SELECT v.id, v.componente, v.en_componente_principal AS principal, v.the_geom
+        FROM red_vial_vertices_pgr v
+        JOIN (
+            SELECT vertice FROM (
+                SELECT source AS vertice FROM red_vial WHERE costo > 0
+                UNION ALL SELECT target FROM red_vial WHERE costo > 0
+            ) x GROUP BY vertice HAVING COUNT(*) = 1
+        ) g ON g.vertice = v.id
+        WHERE v.componente > 0;
+    """)
+    cur.execute("""
+        SELECT c.id, c.componente, w.id, w.componente,
+               ST_Distance(c.the_geom::geography, w.the_geom::geography) AS metros
+        FROM _colgantes c
+        CROSS JOIN LATERAL (
+            SELECT w.id, w.componente, w.the_geom FROM red_vial_vertices_pgr w
+            WHERE w.componente <> c.componente AND w.componente > 0
+            ORDER BY w.the_geom <-> c.the_geom LIMIT 1
+        ) w
+        WHERE NOT c.principal AND ST_DWithin(c.the_geom::geography, w.the_geom::geography, %(d)s)
+        UNION ALL
+        SELECT c.id, c.componente, w.id, w.componente,
+               ST_Distance(c.the_geom::geography, w.the_geom::geography)
+        FROM _colgantes c
+        CROSS JOIN LATERAL (
+            SELECT w.id, w.componente, w.the_geom FROM red_vial_vertices_pgr w
+            WHERE NOT w.en_componente_principal AND w.componente > 0
+            ORDER BY w.the_geom <-> c.the_geom LIMIT 1
+        ) w
+        WHERE c.principal AND ST_DWithin(c.the_geom::geography, w.the_geom::geography, %(d)s)
+        ORDER BY metros;
+    """, {"d": distancia_m})
+    return cur.fetchall()
+
+def elegir_conectores(brechas):
+    """
+    Brechas a cerrar: de menor a mayor distancia, sólo las que unen dos
+    componentes que siguen separadas (union-find, como Kruskal).
+    """
+    padre = {}
+
+    def raiz(c):
+        while padre.get(c, c) != c:
+            padre[c] = padre.get(padre[c], padre[c])
+            c = padre[c]
+        return c
+
+    elegidas = []
+    for brecha in sorted(brechas, key=lambda b: b[4]):
+        a, b = raiz(brecha[1]), raiz(brecha[3])
+        if a != b:
+            padre[a] = b
+            elegidas.append(brecha)
+    return elegidas
+
+def agregar_conectores(cur, conectores):
+    """Inserta una arista recta por conector, con source/target ya resueltos. Retorna los ids nuevos."""
+    ids = []
+    for colgante, _, vertice, _, metros in conectores:
+        largo = round(max(metros, 0.01), 2)  # costo > 0: si no, marcar_componentes no la considera
+        cur.execute("""
+            INSERT INTO red_vial (nombre, tipo_via, source, target, geom, length_m, costo, reverse_costo)
+            SELECT 'Conector topológico', 'conector', a.id, b.id, ST_MakeLine(a.the_geom, b.the_geom), %s, %s, %s
+            FROM red_vial_vertices_pgr a, red_vial_vertices_pgr b
+            WHERE a.id = %s AND b.id = %s
+            RETURNING id;
+        """, (largo, largo, largo, colgante, vertice))
+        ids.extend(r[0] for r in cur.fetchall())
+    return ids
+
+def _resumen(componentes):
+    islas = [c for c in componentes if not c["principal"]]
+    return {"componentes": len(componentes), "islas": len(islas),
+            "vertices_en_islas": sum(c["vertices"] for c in islas),
+            "km_en_islas": round(sum(c["km"] for c in islas), 3),
+            "oficinas_en_islas": sum(c["oficinas"] for c in islas)}
+
+def main(out_dir="/app/out", reparar=False, conectar=TOPOLOGIA_CONECTAR, distancia_m=BRECHA_M):
+    """QA de topología no interactivo; escribe out/topologia_componentes.json."""
     print("=" * 60)
-    print("DIAGNÓSTICO Y REPARACIÓN DE TOPOLOGÍA")
+    print("DIAGNÓSTICO Y QA DE TOPOLOGÍA")
     print("=" * 60)
-    
     diagnosticar_red()
-    
-    respuesta = input("\n¿Desea reparar la topología? (s/n): ")
-    if respuesta.lower() == 's':
+    if reparar:
         reparar_topologia()
-        print("\n" + "=" * 60)
-        diagnosticar_red()
-    else:
-        print("Operación cancelada")
+
+    conn = get_conn()
+    asegurar_componentes(conn)
+    cur = conn.cursor()
+    componentes = listar_componentes(cur)
+    if not componentes:
+        print("⚠️  Red sin componentes (¿topología vacía?)")
+        cur.close()
+        conn.close()
+        return None
+    antes = _resumen(componentes)
+    principal = componentes[0]
+    print(f"\n🧩 {antes['componentes']:,} componentes; principal: {principal['vertices']:,} vértices, {principal['km']:,.1f} km")
+    print(f"   Islas: {antes['islas']:,} con {antes['vertices_en_islas']:,} vértices y {antes['km_en_islas']:,.1f} km"
+          f" ({antes['oficinas_en_islas']} oficinas con su vértice más cercano en una isla)")
+    for c in [c for c in componentes if not c["principal"]][:10]:
+        print(f"   • componente {c['componente']}: {c['vertices']:,} vértices, {c['aristas']:,} aristas,"
+              f" {c['km']:.2f} km, caja {c['caja']} ({c['diagonal_m']:,.0f} m), oficinas: {c['oficinas']}")
+
+    brechas = buscar_brechas(cur, distancia_m)
+    conectores = elegir_conectores(brechas)
+    print(f"\n🔗 Extremos colgantes a ≤ {distancia_m:g} m de otra componente: {len(brechas):,}"
+          f" → {len(conectores):,} conectores unirían componentes distintas")
+
+    nuevas = []
+    if conectar and conectores:
+        nuevas = agregar_conectores(cur, conectores)
+        if nuevas:
+            marcar_componentes(cur)
+            # Vértices y aristas previas conservan su id: del caché sólo cae lo que un conector podría acortar
+            invalidar_aristas(cur, [], [], nuevas)
+        conn.commit()
+        componentes = listar_componentes(cur)
+        print(f"   ✓ {len(nuevas):,} aristas conectoras agregadas; islas: {antes['islas']:,} → {_resumen(componentes)['islas']:,}")
+    elif conectores:
+        print("   (sin cambios: TOPOLOGIA_CONECTAR=1 o --conectar para agregarlos)")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    reporte = {
+        "distancia_m": distancia_m,
+        "antes": antes,
+        "despues": _resumen(componentes),
+        "brechas": [{"colgante": v, "componente": cv, "vertice": w, "componente_vertice": cw, "metros": round(m, 2)}
+                    for v, cv, w, cw, m in brechas],
+        "conectores": nuevas,
+        "componentes": componentes,
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, ARCHIVO_REPORTE), "w", encoding="utf-8") as f:
+        json.dump(reporte, f, ensure_ascii=False)
+    print(f"✓ Reporte: {os.path.join(out_dir, ARCHIVO_REPORTE)}")
+    return reporte
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diagnóstico, reparación y QA de topología")
+    parser.add_argument("--reparar", action="store_true", help="reconstruir la topología antes del QA")
+    parser.add_argument("--conectar", action="store_true", default=TOPOLOGIA_CONECTAR,
+                        help="agregar aristas conectoras entre componentes")
+    parser.add_argument("--distancia", type=float, default=BRECHA_M, help="metros máximos de un conector")
+    parser.add_argument("--out", default=os.getenv("OUT_DIR", "/app/out"))
+    args = parser.parse_args()
+    main(args.out, reparar=args.reparar, conectar=args.conectar, distancia_m=args.distancia)
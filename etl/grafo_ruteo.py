@@ -0,0 +1,552 @@
+#!/usr/bin/env python3
+"""
+Motor de ruteo en memoria sobre la tabla red_vial.
+Carga la red UNA sola vez en arreglos CSR (NumPy) y responde consultas de
+camino más corto dentro del proceso, sin que pgRouting tenga que releer y
+reconstruir el grafo completo en cada segmento.
+
+Semántica equivalente a:
+    pgr_dijkstra('SELECT id, source, target, costo as cost,
+                  reverse_costo as reverse_cost FROM red_vial ...',
+                 origen, destino, directed := false)
+"""
+import heapq
+from bisect import bisect_right
+
+import numpy as np
+
+# Mismo filtro de aristas que usa etl_ruta_dijkstra con pgr_dijkstra
+SQL_ARISTAS = """
+    SELECT id, source, target, costo, reverse_costo, length_m
+    FROM red_vial
+    WHERE source IS NOT NULL AND target IS NOT NULL AND costo > 0
+"""
+
+SQL_VERTICES = """
+    SELECT id, ST_X(the_geom), ST_Y(the_geom)
+    FROM red_vial_vertices_pgr
+"""
+
+INF = float("inf")
+R_TIERRA = 6371000.0
+# Piso de la escala de la heurística A* (costo por metro de línea recta). Los costos de la red son
+# metros (o más, con penalización), así que un arco por debajo es un defecto de datos (largo nulo o
+# mal calculado) y no debe apagar la heurística de todas las búsquedas
+FACTOR_HEURISTICA_MIN = 1.0
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Distancia geodésica (esfera, metros) vectorizada."""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = np.radians(np.asarray(lon2, dtype=np.float64) - np.asarray(lon1, dtype=np.float64))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlmb / 2) ** 2
+    return 2 * R_TIERRA * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GrafoRuteo:
+    """
+    Grafo de la red vial en formato CSR.
+
+    Arreglos por arista (orden de carga, índice e):
+        edge_id, edge_source, edge_target (índices densos), costo, reverse_costo, length_m
+    Arreglos por arco (CSR, agrupados por vértice de salida):
+        indptr[u]:indptr[u+1] -> arco_destino, arco_arista, arco_peso
+    Los ids de vértice de pgRouting se traducen a índices densos 0..n-1.
+    """
+
+    def __init__(self, edge_ids, sources, targets, costos, reverse_costos,
+                 longitudes=None, dirigido=False):
+        self.dirigido = dirigido
+        self.edge_id = np.asarray(edge_ids, dtype=np.int64)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        self.costo = np.asarray(costos, dtype=np.float64)
+        rc = np.asarray(reverse_costos, dtype=np.float64)
+        # reverse_costo NULL o negativo = sentido contrario inexistente
+        self.reverse_costo = np.where(np.isnan(rc), -1.0, rc)
+        if longitudes is None:
+            self.longitud = self.costo.copy()
+        else:
+            lon = np.asarray(longitudes, dtype=np.float64)
+            self.longitud = np.where(np.isnan(lon), 0.0, lon)
+
+        # Ids de vértice -> índices densos
+        self.vertex_id, inversa = np.unique(np.concatenate([sources, targets]), return_inverse=True)
+        m = len(self.edge_id)
+        self.edge_source = inversa[:m]
+        self.edge_target = inversa[m:]
+        self._indice = {int(v): i for i, v in enumerate(self.vertex_id)}
+
+        # Coordenadas (se completan con cargar_coordenadas)
+        self.lon = np.full(len(self.vertex_id), np.nan)
+        self.lat = np.full(len(self.vertex_id), np.nan)
+        self._factor = None  # escala de la heurística A* (se calcula al primer uso)
+        self._indice_arista = None  # edge_id -> índice de arista (se arma al primer uso)
+
+        self._construir_csr()
+
+    # ------------------------------------------------------------------
+    # Construcción
+    # ------------------------------------------------------------------
+    @classmethod
+    def desde_bd(cls, conn, sql_aristas=SQL_ARISTAS, dirigido=False, con_coordenadas=True):
+        """Carga red_vial con una sola consulta y arma el grafo."""
+        cur = conn.cursor()
+        cur.execute(sql_aristas)
+        filas = cur.fetchall()
+        cur.close()
+        if filas:
+            ids, src, tgt, costo, rcosto, largo = zip(*filas)
+        else:
+            ids = src = tgt = costo = rcosto = largo = ()
+        grafo = cls(
+            ids, src, tgt,
+            [float(c) for c in costo],
+            [float(r) if r is not None else np.nan for r in rcosto],
+            [float(l) if l is not None else np.nan for l in largo],
+            dirigido=dirigido,
+        )
+        if con_coordenadas:
+            grafo.cargar_coordenadas(conn)
+        return grafo
+
+    def cargar_coordenadas(self, conn, sql_vertices=SQL_VERTICES):
+        """Agrega lon/lat de cada vértice desde red_vial_vertices_pgr."""
+        cur = conn.cursor()
+        cur.execute(sql_vertices)
+        for vid, x, y in cur.fetchall():
+            i = self._indice.get(int(vid))
+            if i is not None:
+                self.lon[i] = x
+                self.lat[i] = y
+        cur.close()
+        self._factor = None
+
+    def _construir_csr(self):
+        n = len(self.vertex_id)
+        e = np.arange(len(self.edge_id))
+        fwd_ok = self.costo >= 0
+        rev_ok = self.reverse_costo >= 0
+
+        if self.dirigido:
+            peso_ida = np.where(fwd_ok, self.costo, np.inf)
+            peso_vuelta = np.where(rev_ok, self.reverse_costo, np.inf)
+        else:
+            # No dirigido: pgRouting agrega (s,t,cost) y (t,s,reverse_cost) como
+            # aristas no dirigidas, por lo que cada sentido vale el menor costo válido
+            peso = np.minimum(np.where(fwd_ok, self.costo, np.inf),
+                              np.where(rev_ok, self.reverse_costo, np.inf))
+            peso_ida = peso_vuelta = peso
+
+        origen = np.concatenate([self.edge_source, self.edge_target])
+        destino = np.concatenate([self.edge_target, self.edge_source])
+        arista = np.concatenate([e, e])
+        peso = np.concatenate([peso_ida, peso_vuelta])
+        validos = np.isfinite(peso)
+        origen, destino, arista, peso = origen[validos], destino[validos], arista[validos], peso[validos]
+
+        orden = np.argsort(origen, kind="stable")
+        self.arco_origen = origen[orden]
+        self.arco_destino = destino[orden]
+        self.arco_arista = arista[orden]
+        self.arco_peso = peso[orden]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.arco_origen, minlength=n), out=self.indptr[1:])
+
+        # Listas Python: el bucle de Dijkstra es mucho más rápido sobre listas
+        self._ptr = self.indptr.tolist()
+        self._dst = self.arco_destino.tolist()
+        self._ari = self.arco_arista.tolist()
+        self._peso = self.arco_peso.tolist()
+
+    # ------------------------------------------------------------------
+    # Utilidades
+    # ------------------------------------------------------------------
+    @property
+    def n_vertices(self):
+        return len(self.vertex_id)
+
+    @property
+    def n_aristas(self):
+        return len(self.edge_id)
+
+    def indice(self, vertex_id):
+        """Índice denso de un id de vértice (None si no está en la red)."""
+        return self._indice.get(int(vertex_id))
+
+    def indice_arista(self, edge_id):
+        """Índice de arista (orden de carga) de un id de red_vial (None si no está en la red)."""
+        if self._indice_arista is None:
+            self._indice_arista = {int(e): i for i, e in enumerate(self.edge_id)}
+        return self._indice_arista.get(int(edge_id))
+
+    # ------------------------------------------------------------------
+    # Búsqueda
+    # ------------------------------------------------------------------
+    def buscar(self, fuentes, destinos=None, limite=INF, pesos=None):
+        """
+        Dijkstra desde una o varias fuentes.
+
+        fuentes: iterable de (indice, costo_inicial)
+        destinos: conjunto de índices; la búsqueda se detiene al asentarlos todos
+        limite: no expande vértices con costo acumulado mayor
+        pesos: lista alternativa de pesos por arco (mismo orden que arco_peso)
+
+        Retorna (dist, pred_arco, expandidos) con dist como lista (inf = no alcanzado).
+        """
+        ptr, dst = self._ptr, self._dst
+        peso = self._peso if pesos is None else pesos
+        n = self.n_vertices
+        dist = [INF] * n
+        pred = [-1] * n
+        visto = [False] * n
+        heap = []
+        for i, c in fuentes:
+            if c < dist[i]:
+                dist[i] = c
+                heapq.heappush(heap, (c, i))
+        pendientes = set(destinos) if destinos else None
+        expandidos = 0
+
+        while heap:
+            d, u = heapq.heappop(heap)
+            if visto[u]:
+                continue
+            if d > limite:
+                break
+            visto[u] = True
+            expandidos += 1
+            if pendientes is not None:
+                pendientes.discard(u)
+                if not pendientes:
+                    break
+            for a in range(ptr[u], ptr[u + 1]):
+                v = dst[a]
+                nd = d + peso[a]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = a
+                    heapq.heappush(heap, (nd, v))
+
+        return dist, pred, expandidos
+
+    def buscar_temporal(self, fuentes, perfil, salida, velocidad, destinos=None, limite=INF):
+        """
+        Dijkstra dependiente del tiempo: como buscar(), pero el peso de cada arco
+        se multiplica por el factor vigente al momento de entrar en él.
+
+        El reloj va aparte del costo: reloj[v] = instante de llegada (minutos,
+        como salida) caminando la longitud real del camino elegido a `velocidad`
+        m/min. Los multiplicadores de amenazas encarecen el costo pero no el
+        tiempo; el factor vigente se lee en el reloj.
+
+        fuentes: (índice, costo inicial[, reloj inicial]); sin reloj se asume
+            salida + costo / velocidad.
+        perfil: ruteo_temporal.PerfilTemporal; perfil.arcos[a] es None (peso fijo)
+            o (cortes, factores) con factores[bisect_right(cortes, t)] vigente en t,
+            y perfil.vertices[u] indica si algún arco que sale de u tiene perfil
+            (los demás vértices se expanden igual que en buscar()).
+
+        No modela esperas en la red: si una amenaza termina poco después de
+        llegar a ella se la atraviesa penalizada o se la rodea.
+        Retorna (dist, pred, expandidos, reloj).
+        """
+        ptr, dst, peso = self._ptr, self._dst, self._peso
+        minutos = (self.longitud[self.arco_arista] / velocidad).tolist()
+        perfiles, variables = perfil.arcos, perfil.vertices
+        n = self.n_vertices
+        dist = [INF] * n
+        reloj = [INF] * n
+        pred = [-1] * n
+        visto = [False] * n
+        heap = []
+        for fuente in fuentes:
+            i, c = fuente[0], fuente[1]
+            if c < dist[i]:
+                dist[i] = c
+                reloj[i] = fuente[2] if len(fuente) > 2 else salida + c / velocidad
+                heapq.heappush(heap, (c, i))
+        pendientes = set(destinos) if destinos else None
+        expandidos = 0
+
+        while heap:
+            d, u = heapq.heappop(heap)
+            if visto[u]:
+                continue
+            if d > limite:
+                break
+            visto[u] = True
+            expandidos += 1
+            if pendientes is not None:
+                pendientes.discard(u)
+                if not pendientes:
+                    break
+            t = reloj[u]
+            if not variables[u]:
+                for a in range(ptr[u], ptr[u + 1]):
+                    v = dst[a]
+                    nd = d + peso[a]
+                    if nd < dist[v]:
+                        dist[v] = nd
+                        reloj[v] = t + minutos[a]
+                        pred[v] = a
+                        heapq.heappush(heap, (nd, v))
+                continue
+            for a in range(ptr[u], ptr[u + 1]):
+                v = dst[a]
+                escalones = perfiles[a]
+                if escalones is None:
+                    nd = d + peso[a]
+                else:
+                    nd = d + peso[a] * escalones[1][bisect_right(escalones[0], t)]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    reloj[v] = t + minutos[a]
+                    pred[v] = a
+                    heapq.heappush(heap, (nd, v))
+
+        return dist, pred, expandidos, reloj
+
+    def reconstruir(self, pred, destino):
+        """Lista de arcos desde la fuente hasta destino siguiendo pred."""
+        arcos = []
+        v = destino
+        while pred[v] != -1:
+            a = pred[v]
+            arcos.append(a)
+            v = int(self.arco_origen[a])
+        arcos.reverse()
+        return arcos
+
+    def filas_ruta(self, arcos, pesos=None):
+        """Convierte arcos a filas estilo pgr_dijkstra (seq, node, edge, cost, agg_cost)."""
+        peso = self._peso if pesos is None else pesos
+        filas = []
+        acumulado = 0.0
+        for seq, a in enumerate(arcos, start=1):
+            costo = peso[a]
+            filas.append({
+                "seq": seq,
+                "node": int(self.vertex_id[self.arco_origen[a]]),
+                "edge": int(self.edge_id[self._ari[a]]),
+                "cost": costo,
+                "agg_cost": acumulado,
+                "distancia_m": float(self.longitud[self._ari[a]]),
+            })
+            acumulado += costo
+        return filas
+
+    def dijkstra(self, origen_id, destino_id, pesos=None):
+        """
+        Camino más corto entre dos vértices (ids de pgRouting).
+        Retorna las filas con edge > 0 que entregaría pgr_dijkstra, o [] si no hay ruta.
+        Ante empates de costo el camino elegido puede diferir del de pgRouting,
+        pero la distancia total es la misma.
+        """
+        s, t = self.indice(origen_id), self.indice(destino_id)
+        if s is None or t is None:
+            return []
+        if s == t:
+            return []
+        dist, pred, _ = self.buscar([(s, 0.0)], destinos={t}, pesos=pesos)
+        if dist[t] == INF:
+            return []
+        return self.filas_ruta(self.reconstruir(pred, t), pesos=pesos)
+
+    def matriz_costos(self, vertex_ids, pesos=None):
+        """
+        Costos de red entre todos los pares de vértices (como pgr_dijkstraCostMatrix).
+        Una búsqueda por origen que se detiene al asentar todos los destinos.
+        Retorna (matriz n×n, preds, vértices expandidos en total); preds[k] permite
+        reconstruir rutas desde vertex_ids[k] con ruta_desde_pred sin volver a buscar.
+        """
+        idx = [self.indice(v) for v in vertex_ids]
+        matriz = np.full((len(idx), len(idx)), np.inf)
+        preds = [None] * len(idx)
+        destinos = {i for i in idx if i is not None}
+        expandidos = 0
+        for k, s in enumerate(idx):
+            if s is None:
+                continue
+            dist, pred, n = self.buscar([(s, 0.0)], destinos=destinos, pesos=pesos)
+            matriz[k] = [dist[t] if t is not None else np.inf for t in idx]
+            preds[k] = pred
+            expandidos += n
+        return matriz, preds, expandidos
+
+    def ruta_desde_pred(self, pred, destino_id, pesos=None):
+        """Filas estilo pgr_dijkstra hacia destino_id a partir de un pred ya calculado."""
+        t = self.indice(destino_id)
+        if pred is None or t is None:
+            return []
+        return self.filas_ruta(self.reconstruir(pred, t), pesos=pesos)
+
+    def factor_heuristica(self, pesos=None):
+        """
+        Escala de la heurística haversine: min(peso / distancia recta) sobre
+        todos los arcos, acotado a 1 por arriba y a FACTOR_HEURISTICA_MIN por
+        abajo. Sin el piso basta un arco defectuoso para llevarla a ~0 (A* pasa
+        a ser Dijkstra); con él la heurística puede sobreestimar en esos arcos,
+        así que se avisa cuántos son.
+        """
+        peso = self.arco_peso if pesos is None else np.asarray(pesos, dtype=np.float64)
+        recta = haversine_np(self.lat[self.arco_origen], self.lon[self.arco_origen],
+                             self.lat[self.arco_destino], self.lon[self.arco_destino])
+        validos = np.isfinite(recta) & (recta > 0)
+        if not validos.any():
+            return 0.0
+        razon = peso[validos] / recta[validos]
+        factor = float(min(1.0, np.min(razon)))
+        if factor < FACTOR_HEURISTICA_MIN:
+            bajo = int(np.count_nonzero(razon < FACTOR_HEURISTICA_MIN))
+            print(f"   ⚠️  Heurística A*: {bajo:,} arcos con costo menor que su distancia recta"
+                  f" (mínimo {factor:.3g}); factor acotado a {FACTOR_HEURISTICA_MIN:g}")
+            factor = FACTOR_HEURISTICA_MIN
+        return factor
+
+    def buscar_astar(self, s, t, pesos=None, factor=None):
+        """
+        A* de s a t (índices densos) con heurística haversine hacia t.
+        Retorna (dist, pred_arco, expandidos) como buscar().
+        """
+        if pesos is None:
+            if self._factor is None:
+                self._factor = self.factor_heuristica()
+            factor = self._factor if factor is None else factor
+        elif factor is None:
+            factor = self.factor_heuristica(pesos)
+        h = haversine_np(self.lat, self.lon, self.lat[t], self.lon[t]) * factor
+        h = np.where(np.isfinite(h), h, 0.0).tolist()  # sin coordenadas: h = 0 (sigue siendo admisible)
+
+        ptr, dst = self._ptr, self._dst
+        peso = self._peso if pesos is None else pesos
+        n = self.n_vertices
+        dist = [INF] * n
+        pred = [-1] * n
+        visto = [False] * n
+        dist[s] = 0.0
+        heap = [(h[s], s)]
+        expandidos = 0
+        while heap:
+            _, u = heapq.heappop(heap)
+            if visto[u]:
+                continue
+            visto[u] = True
+            expandidos += 1
+            if u == t:
+                break
+            d = dist[u]
+            for a in range(ptr[u], ptr[u + 1]):
+                v = dst[a]
+                nd = d + peso[a]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred[v] = a
+                    heapq.heappush(heap, (nd + h[v], v))
+        return dist, pred, expandidos
+
+    def ruta(self, origen_id, destino_id, algoritmo="dijkstra", pesos=None):
+        """
+        Camino más corto con el algoritmo elegido ("dijkstra" o "astar").
+        Retorna (filas, expandidos); filas como dijkstra().
+        """
+        s, t = self.indice(origen_id), self.indice(destino_id)
+        if s is None or t is None or s == t:
+            return [], 0
+        if algoritmo == "astar":
+            dist, pred, expandidos = self.buscar_astar(s, t, pesos=pesos)
+        else:
+            dist, pred, expandidos = self.buscar([(s, 0.0)], destinos={t}, pesos=pesos)
+        if dist[t] == INF:
+            return [], expandidos
+        return self.filas_ruta(self.reconstruir(pred, t), pesos=pesos), expandidos
+
+    def _buscar_restringido(self, s, t, peso, arcos_prohibidos, vertices_prohibidos, limite=INF):
+        """Dijkstra s→t sin usar ciertos arcos ni vértices (desvíos de Yen). Retorna (costo, arcos)."""
+        ptr, dst = self._ptr, self._dst
+        dist = {s: 0.0}
+        pred = {}
+        visto = set()
+        heap = [(0.0, s)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in visto:
+                continue
+            if d > limite:
+                break
+            visto.add(u)
+            if u == t:
+                arcos = []
+                while u != s:
+                    a = pred[u]
+                    arcos.append(a)
+                    u = int(self.arco_origen[a])
+                arcos.reverse()
+                return d, arcos
+            for a in range(ptr[u], ptr[u + 1]):
+                v = dst[a]
+                if v in vertices_prohibidos or a in arcos_prohibidos:
+                    continue
+                nd = d + peso[a]
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    pred[v] = a
+                    heapq.heappush(heap, (nd, v))
+        return INF, None
+
+    def k_caminos(self, origen_id, destino_id, k=3, pesos=None, limite=INF):
+        """
+        Algoritmo de Yen: hasta k caminos sin ciclos ordenados por costo
+        (equivalente en memoria a pgr_KSP). Los caminos se distinguen por sus
+        aristas, así que aristas paralelas cuentan como alternativas distintas.
+        limite: descarta alternativas de costo mayor (acota cada búsqueda de desvío).
+        Retorna [(costo, filas)] con filas como dijkstra().
+        """
+        s, t = self.indice(origen_id), self.indice(destino_id)
+        if s is None or t is None or s == t:
+            return []
+        peso = self._peso if pesos is None else pesos
+        costo, arcos = self._buscar_restringido(s, t, peso, set(), set())
+        if arcos is None:
+            return []
+        encontrados = [(costo, arcos)]
+        vistos = {tuple(arcos)}
+        candidatos = []
+        while len(encontrados) < k:
+            _, previo = encontrados[-1]
+            nodos = [s] + [self._dst[a] for a in previo]
+            costo_raiz = 0.0
+            for i in range(len(previo)):
+                raiz = previo[:i]
+                # Arcos que ya usan los caminos encontrados con la misma raíz
+                prohibidos = {c[i] for _, c in encontrados if len(c) > i and c[:i] == raiz}
+                desvio_costo, desvio = self._buscar_restringido(
+                    nodos[i], t, peso, prohibidos, set(nodos[:i]), limite - costo_raiz)
+                if desvio is not None:
+                    camino = tuple(raiz + desvio)
+                    if camino not in vistos:
+                        vistos.add(camino)
+                        heapq.heappush(candidatos, (costo_raiz + desvio_costo, camino))
+                costo_raiz += peso[previo[i]]
+            if not candidatos:
+                break
+            costo, camino = heapq.heappop(candidatos)
+            encontrados.append((costo, list(camino)))
+        return [(c, self.filas_ruta(a, pesos=pesos)) for c, a in encontrados]
+
+    def costo_ruta(self, origen_id, destino_id, pesos=None):
+        """Costo total del camino más corto (inf si no hay ruta)."""
+        s, t = self.indice(origen_id), self.indice(destino_id)
+        if s is None or t is None:
+            return INF
+        dist, _, _ = self.buscar([(s, 0.0)], destinos={t}, pesos=pesos)
+        return dist[t]
+
+
+def cargar_grafo(conn, **kwargs):
+    """Atajo: carga el grafo e informa tamaño."""
+    print("   Cargando red vial en memoria (CSR)...")
+    grafo = GrafoRuteo.desde_bd(conn, **kwargs)
+    print(f"   ✓ Grafo en memoria: {grafo.n_vertices:,} vértices, {grafo.n_aristas:,} aristas")
+    return grafo
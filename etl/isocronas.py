@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Isócronas de caminata (5/10/15/30 min) por oficina activa.
+Una búsqueda Dijkstra acotada (límite = mayor umbral) por oficina, repartidas
+en un pool de procesos que comparte el grafo en memoria por fork
+(copy-on-write, sin serializar la red). Los polígonos se arman en PostGIS
+(concave hull de los vértices alcanzados, simplificado) y se guardan en la
+tabla isocronas; luego se exportan a isocronas.geojson para el mapa.
+
+Incremental: sólo se recalculan oficinas cuyo vértice más cercano cambió,
+cuya topología es otra o cuyas amenazas dentro del alcance cambiaron.
+"""
+import json
+import multiprocessing as mp
+import os
+import shutil
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from cache_rutas import versiones
+from etl_ruta_dijkstra import CONSIDERA_AMENAZAS
+from grafo_ruteo import SQL_ARISTAS, cargar_grafo
+from loader_infraestructura import asegurar_componentes
+from penalizacion_amenazas import SQL_ARISTAS_PENALIZADAS, ensure_tablas
+
+MINUTOS = (5, 10, 15, 30)
+VELOCIDAD_M_MIN = 83.33
+# Distancia de red máxima; también acota (en línea recta) qué amenazas pueden afectar a una oficina
+ALCANCE_M = max(MINUTOS) * VELOCIDAD_M_MIN
+CONCAVIDAD = 0.3          # ST_ConcaveHull: 1 = convexa, menor = más ajustada
+BUFFER_M = 25             # margen alrededor de los vértices alcanzados
+SIMPLIFICACION = 0.00005  # tolerancia ST_SimplifyPreserveTopology (~5 m)
+PROCESOS = int(os.getenv("ISOCRONAS_PROCESOS", str(os.cpu_count() or 1)))
+
+# Grafo compartido con los workers (se asigna antes de crear el pool; fork lo hereda)
+_GRAFO = None
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def ensure_tabla(cur):
+    """Tabla isocronas (ver 00_schema_completo.sql)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS isocronas (
+          oficina_id INTEGER REFERENCES oficinas(id) ON DELETE CASCADE,
+          minutos INTEGER NOT NULL,
+          geom geometry(MultiPolygon, 4326),
+          vertex_id BIGINT,
+          firma_amenazas TEXT,
+          version_topologia INTEGER,
+          n_vertices INTEGER,
+          calculado TIMESTAMP DEFAULT NOW(),
+          PRIMARY KEY (oficina_id, minutos)
+        );
+        CREATE INDEX IF NOT EXISTS isocronas_geom_idx ON isocronas USING GIST(geom);
+    """)
+
+
+def _alcance(args):
+    """Worker: vértices alcanzados desde una oficina dentro de ALCANCE_M (índices y costo)."""
+    oficina_id, i = args
+    dist, _, expandidos = _GRAFO.buscar([(i, 0.0)], limite=ALCANCE_M)
+    d = np.asarray(dist)
+    alcanzados = np.nonzero(d <= ALCANCE_M)[0]
+    return oficina_id, alcanzados, d[alcanzados], expandidos
+
+
+def oficinas_pendientes(cur, version_topologia, amenazas):
+    """
+    Oficinas activas con vértice cuya isócrona falta o quedó obsoleta.
+    Retorna [(oficina_id, vertex_id, firma_amenazas)].
+    """
+    # Firma = amenazas aplicadas cuyo radio alcanza a caminar ALCANCE_M desde la oficina
+    cur.execute("""
+        SELECT o.id, o.vertex_id, COALESCE(f.firma, '')
+        FROM oficinas o
+        LEFT JOIN LATERAL (
+            SELECT md5(string_agg(a.amenaza_id || ':' || a.severidad || ':' || a.radio_afectacion_m || ':' || ST_AsText(a.geom),
+                                  ',' ORDER BY a.amenaza_id)) AS firma
+            FROM amenazas_aplicadas a
+            WHERE %(amenazas)s AND ST_DWithin(o.geom::geography, a.geom::geography, %(alcance)s + a.radio_afectacion_m)
+        ) f ON true
+        WHERE o.activo = true AND o.vertex_id IS NOT NULL;
+    """, {"amenazas": amenazas, "alcance": ALCANCE_M})
+    actuales = cur.fetchall()
+    cur.execute("SELECT oficina_id, vertex_id, firma_amenazas, version_topologia FROM isocronas WHERE minutos = %s;", (max(MINUTOS),))
+    guardadas = {r[0]: r[1:] for r in cur.fetchall()}
+    return [(oid, vid, firma) for oid, vid, firma in actuales
+            if guardadas.get(oid) != (vid, firma, version_topologia)]
+
+
+def guardar_isocronas(cur, grafo, filas):
+    """filas: [(oficina_id, vertex_id, firma, version, alcanzados, costos)] → polígonos en PostGIS."""
+    valores = []
+    for oficina_id, vertex_id, firma, version, alcanzados, costos in filas:
+        for m in MINUTOS:
+            sel = alcanzados[costos <= m * VELOCIDAD_M_MIN]
+            xs, ys = grafo.lon[sel], grafo.lat[sel]
+            ok = np.isfinite(xs) & np.isfinite(ys)
+            valores.append((oficina_id, m, vertex_id, firma, version, xs[ok].tolist(), ys[ok].tolist()))
+    execute_values(cur, f"""
+        INSERT INTO isocronas (oficina_id, minutos, vertex_id, firma_amenazas, version_topologia, n_vertices, geom, calculado)
+        SELECT v.oficina_id, v.minutos, v.vertex_id, v.firma, v.version, cardinality(v.xs),
+               ST_Multi(ST_SimplifyPreserveTopology(ST_Buffer(ST_ConcaveHull(
+                   (SELECT ST_SetSRID(ST_Collect(ST_MakePoint(p.x, p.y)), 4326) FROM unnest(v.xs, v.ys) AS p(x, y)),
+                   {CONCAVIDAD})::geography, {BUFFER_M})::geometry, {SIMPLIFICACION})),
+               NOW()
+        FROM (VALUES %s) AS v(oficina_id, minutos, vertex_id, firma, version, xs, ys)
+        WHERE cardinality(v.xs) > 0;
+    """, valores, template="(%s, %s, %s, %s, %s, %s::float8[], %s::float8[])", page_size=200)
+
+
+def exportar_geojson(cur, out_file):
+    """Capa para el mapa: una feature por (oficina, umbral), umbrales mayores primero."""
+    cur.execute("""
+        SELECT ST_AsGeoJSON(i.geom)::json, i.oficina_id, o.nombre, o.tipo, i.minutos
+        FROM isocronas i JOIN oficinas o ON o.id = i.oficina_id
+        WHERE o.activo = true AND i.geom IS NOT NULL
+        ORDER BY i.minutos DESC, i.oficina_id;
+    """)
+    features = [{"type": "Feature", "geometry": g,
+                 "properties": {"tipo": "isocrona", "oficina_id": oid, "nombre": nombre, "tipo_oficina": tipo, "minutos": m}}
+                for g, oid, nombre, tipo, m in cur.fetchall()]
+    geojson = {"type": "FeatureCollection", "features": features,
+               "metadata": {"tipo": "isocronas_caminata", "minutos": list(MINUTOS), "velocidad_m_min": VELOCIDAD_M_MIN}}
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump(geojson, f, ensure_ascii=False)
+    return len(features)
+
+
+def main(out_dir="/app/out", amenazas=CONSIDERA_AMENAZAS, procesos=PROCESOS):
+    global _GRAFO
+    print(f"⏱️  ISÓCRONAS de caminata {'/'.join(map(str, MINUTOS))} min por oficina")
+    os.makedirs(out_dir, exist_ok=True)
+    out_file = os.path.join(out_dir, "isocronas.geojson")
+    conn = get_conn()
+    cur = conn.cursor()
+    ensure_tabla(cur)
+    ensure_tablas(cur)
+    asegurar_componentes(conn)
+    version_topologia, _ = versiones(cur)
+    cur.execute("DELETE FROM isocronas i USING oficinas o WHERE o.id = i.oficina_id AND (NOT o.activo OR o.vertex_id IS NULL);")
+    pendientes = oficinas_pendientes(cur, version_topologia, amenazas)
+    conn.commit()
+    print(f"   Oficinas a recalcular: {len(pendientes)}")
+
+    if pendientes:
+        _GRAFO = grafo = cargar_grafo(conn, sql_aristas=SQL_ARISTAS_PENALIZADAS if amenazas else SQL_ARISTAS)
+        tareas = [(oid, grafo.indice(vid)) for oid, vid, _ in pendientes if grafo.indice(vid) is not None]
+        meta = {oid: (vid, firma) for oid, vid, firma in pendientes}
+        cur.execute("DELETE FROM isocronas WHERE oficina_id = ANY(%s);", ([oid for oid, _, _ in pendientes],))
+
+        filas, expandidos_total = [], 0
+        # fork: los workers heredan _GRAFO sin copiarlo ni serializarlo
+        with mp.get_context("fork").Pool(max(1, procesos)) as pool:
+            for oficina_id, alcanzados, costos, expandidos in pool.imap_unordered(_alcance, tareas, chunksize=4):
+                vid, firma = meta[oficina_id]
+                filas.append((oficina_id, vid, firma, version_topologia, alcanzados, costos))
+                expandidos_total += expandidos
+                if len(filas) >= 50:
+                    guardar_isocronas(cur, grafo, filas)
+                    filas = []
+        if filas:
+            guardar_isocronas(cur, grafo, filas)
+        conn.commit()
+        _GRAFO = None
+        print(f"✓ {len(tareas)} oficinas en {procesos} procesos ({expandidos_total:,} vértices expandidos)")
+
+    n = exportar_geojson(cur, out_file)
+    cur.close()
+    conn.close()
+    print(f"✅ Archivo generado: {out_file} ({n} polígonos)")
+    web_data_dir = os.environ.get("WEB_DATA_DIR")
+    if web_data_dir and os.path.isdir(web_data_dir):
+        shutil.copy2(out_file, os.path.join(web_data_dir, "isocronas.geojson"))
+    return n
+
+
+if __name__ == "__main__":
+    main()
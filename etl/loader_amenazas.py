@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import json, os, psycopg2
 from psycopg2.extras import execute_batch
-from datetime import datetime
+from datetime import datetime, timedelta
 
 def get_conn():
     return psycopg2.connect(
@@ -32,18 +32,26 @@ def load_file(path, tipo_base, fuente, conn):
         
         inicio_str = item.get('inicio', item.get('fecha_inicio'))
         inicio = datetime.fromisoformat(inicio_str.replace('Z','')) if inicio_str else datetime.now()
+        # Ventana de vigencia (ruteo_temporal): fin explícito o inicio + duración estimada
+        fin_str = item.get('fin', item.get('fecha_fin'))
+        if fin_str:
+            fin = datetime.fromisoformat(fin_str.replace('Z',''))
+        elif item.get('duracion_estimada_min'):
+            fin = inicio + timedelta(minutes=float(item['duracion_estimada_min']))
+        else:
+            fin = None
         
         rows.append((
             item.get('tipo', tipo_base), int(item.get('severidad', 3)),
             item.get('categoria', tipo_base), item.get('titulo', item.get('descripcion',''))[:100],
             item.get('descripcion',''), float(item['lat']), float(item['lon']),
-            item.get('radio_afectacion_m', 500), inicio, True, fuente,
+            item.get('radio_afectacion_m', 500), inicio, fin, True, fuente,
             json.dumps(item, ensure_ascii=False)
         ))
     
     execute_batch(cur, """
-        INSERT INTO amenazas (tipo, severidad, categoria, titulo, descripcion, lat, lon, radio_afectacion_m, fecha_inicio, activo, fuente, datos_raw)
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s::jsonb)
+        INSERT INTO amenazas (tipo, severidad, categoria, titulo, descripcion, lat, lon, radio_afectacion_m, fecha_inicio, fecha_fin, activo, fuente, datos_raw)
+        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s::jsonb)
     """, rows, page_size=100)
     conn.commit()
     cur.close()
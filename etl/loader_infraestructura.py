@@ -2,6 +2,12 @@
 import json, os, psycopg2
 from psycopg2.extras import execute_batch
 
+from cache_rutas import invalidar_topologia
+from etl_infra_osm import asignar_longitudes, nodar_features
+from penalizacion_amenazas import invalidar_penalizacion
+from red_incremental import RED_CARGA, completar_longitudes, ensure_columnas, refrescar_red
+from topologia_directa import TOPOLOGIA_MODO, cargar_red_directa, ids_nodos
+
 def get_conn():
     return psycopg2.connect(
         host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
@@ -9,8 +15,79 @@ def get_conn():
         user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
     )
 
-def main(data_dir="/app/out"):
-    print("🔥 LOADER Infraestructura → PostgreSQL")
+def marcar_componentes(cur):
+    """
+    Calcula las componentes conexas UNA vez y las guarda en red_vial_vertices_pgr
+    (columnas componente / en_componente_principal, con índices GiST parciales
+    para la principal y para las islas).
+    Como viven en la tabla de vértices, desaparecen solas cuando la topología
+    se reconstruye (DROP/pgr_createTopology). Los vértices sin aristas ruteables
+    quedan como componente unitaria con id negativo (-id), así ningún vértice
+    queda en NULL y asegurar_componentes no recalcula en cada corrida.
+    """
+    cur.execute("""
+        ALTER TABLE red_vial_vertices_pgr
+        ADD COLUMN IF NOT EXISTS componente BIGINT,
+        ADD COLUMN IF NOT EXISTS en_componente_principal BOOLEAN NOT NULL DEFAULT false;
+    """)
+    cur.execute("""
+        DROP TABLE IF EXISTS _componentes;
+        CREATE TEMP TABLE _componentes ON COMMIT DROP AS
+        SELECT node, component FROM pgr_connectedComponents(
+            'SELECT id, source, target, costo as cost FROM red_vial WHERE source IS NOT NULL AND costo > 0'
+        );
+        CREATE INDEX ON _componentes (node);
+        UPDATE red_vial_vertices_pgr v
+        SET componente = COALESCE((SELECT c.component FROM _componentes c WHERE c.node = v.id), -v.id);
+    """)
+    cur.execute("""
+        WITH principal AS (
+            SELECT componente FROM red_vial_vertices_pgr
+            WHERE componente > 0
+            GROUP BY componente ORDER BY COUNT(*) DESC LIMIT 1
+        )
+        UPDATE red_vial_vertices_pgr v
+        SET en_componente_principal = COALESCE(v.componente = (SELECT componente FROM principal), false);
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS red_vial_vertices_componente_idx ON red_vial_vertices_pgr(componente);")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS red_vial_vertices_principal_geom_idx
+        ON red_vial_vertices_pgr USING GIST(the_geom) WHERE en_componente_principal;
+    """)
+    # Islas: KNN desde extremos colgantes de la principal (fix_topology.buscar_brechas)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS red_vial_vertices_islas_geom_idx
+        ON red_vial_vertices_pgr USING GIST(the_geom) WHERE NOT en_componente_principal;
+    """)
+    cur.execute("ANALYZE red_vial_vertices_pgr;")
+    cur.execute("SELECT COUNT(*) FROM red_vial_vertices_pgr WHERE en_componente_principal;")
+    return cur.fetchone()[0]
+
+def asegurar_componentes(conn):
+    """
+    Recalcula las componentes sólo si faltan (topología nueva o vértices agregados
+    después de marcarlas; los aislados ya tienen su componente unitaria).
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT EXISTS (
+            SELECT FROM information_schema.columns
+            WHERE table_name = 'red_vial_vertices_pgr' AND column_name = 'componente'
+        );
+    """)
+    if cur.fetchone()[0]:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM red_vial_vertices_pgr WHERE componente IS NULL);")
+        if not cur.fetchone()[0]:
+            cur.close()
+            return False
+    print("   Calculando componentes conexas (topología nueva)...")
+    marcar_componentes(cur)
+    conn.commit()
+    cur.close()
+    return True
+
+def main(data_dir="/app/out", modo=TOPOLOGIA_MODO, carga=RED_CARGA):
+    print(f"🔥 LOADER Infraestructura → PostgreSQL (topología {modo}, carga {carga})")
     gj_path = os.path.join(data_dir, "infraestructura.geojson")
     if not os.path.exists(gj_path):
         print("⚠️  Archivo no encontrado")
@@ -23,20 +100,53 @@ def main(data_dir="/app/out"):
     if not features:
         print("⚠️  Sin features")
         return False
+
+    # Cortar las vías en los nodos compartidos (no-op si el GeoJSON ya viene nodado)
+    antes = len(features)
+    features = asignar_longitudes(list(nodar_features(features)))
+    if len(features) != antes:
+        print(f"   Nodado: {antes} vías → {len(features)} tramos")
     
     conn = get_conn()
     cur = conn.cursor()
+
+    if carga == "incremental":
+        # Diferencias por (osm_id, segmento): ids estables, sólo se re-nodan los vértices tocados
+        cambios = refrescar_red(conn, features, modo)
+        if cambios is not None:
+            print(f"✔ Refresco incremental: {cambios['insertadas']} insertados, {cambios['modificadas']} modificados,"
+                  f" {cambios['borradas']} borrados, {cambios['renombradas']} renombrados de {cambios['tramos']} tramos")
+            print(f"✔ Vértices: {cambios['vertices_nuevos']} nuevos, {cambios['vertices_borrados']} borrados")
+            if not cambios["cambios"]:
+                print("✔ Red sin cambios: se conservan topología, componentes y distancias")
+                cur.close()
+                conn.close()
+                return True
+            return _finalizar_carga(conn, cur, incremental=True)
+        print("   Sin red previa con clave (osm_id, segmento): carga completa")
     
     # Limpiar tabla si existe
     try:
         cur.execute("DROP TABLE IF EXISTS red_vial_vertices_pgr CASCADE;")
         cur.execute("TRUNCATE TABLE red_vial RESTART IDENTITY CASCADE;")
+        # Los ids de arista cambian: la penalización por amenazas se recalcula desde cero
+        invalidar_penalizacion(cur)
         conn.commit()
     except Exception as e:
         print(f"   (Error menor al limpiar: {e})")
         conn.rollback() # Asegura que la transacción fallida no bloquee
         cur = conn.cursor() # Restablece el cursor
+    ensure_columnas(cur)
+    conn.commit()
     
+    if modo == "directa":
+        # source/target y vértices desde el diccionario de nodos del ETL, con COPY
+        print(f"   Cargando {len(features)} segmentos con topología directa (COPY)...")
+        segmentos, vertices_count = cargar_red_directa(cur, features, ids_nodos(data_dir, features))
+        conn.commit()
+        print(f"✔ Insertados {segmentos} segmentos, {vertices_count} vértices (sin pgr_createTopology)")
+        return _finalizar_carga(conn, cur)
+
     rows = []
     for feat in features:
         geom = feat.get('geometry')
@@ -47,7 +157,9 @@ def main(data_dir="/app/out"):
         if len(coords) < 2:
             continue
         wkt = 'LINESTRING(' + ', '.join([f"{lon} {lat}" for lon,lat in coords]) + ')'
-        rows.append((props.get('osm_id'), props.get('nombre','Sin nombre'), props.get('tipo_via','unknown'), wkt))
+        largo = props.get('length_m')
+        rows.append((props.get('osm_id'), props.get('segmento'), props.get('nombre','Sin nombre'), props.get('tipo_via','unknown'), wkt,
+                     largo, largo, largo))
     
     if not rows:
         print("⚠️  No hay datos para insertar")
@@ -59,8 +171,8 @@ def main(data_dir="/app/out"):
     for i in range(0, len(rows), batch_size):
         batch = rows[i:i+batch_size]
         execute_batch(cur, """
-            INSERT INTO red_vial (osm_id, nombre, tipo_via, geom)
-            VALUES (%s, %s, %s, ST_GeomFromText(%s, 4326))
+            INSERT INTO red_vial (osm_id, segmento, nombre, tipo_via, geom, length_m, costo, reverse_costo)
+            VALUES (%s, %s, %s, %s, ST_GeomFromText(%s, 4326), %s, %s, %s)
             ON CONFLICT DO NOTHING
         """, batch, page_size=100)
         if i % 5000 == 0 and i > 0:
@@ -69,17 +181,6 @@ def main(data_dir="/app/out"):
     conn.commit()
     print(f"✔ Insertados {len(rows)} segmentos")
     
-    # Calcular longitudes y costos
-    print("   Calculando longitudes y costos...")
-    cur.execute("""
-        UPDATE red_vial 
-        SET length_m = ST_Length(ST_Transform(geom, 3857)),
-            costo = ST_Length(ST_Transform(geom, 3857)),
-            reverse_costo = ST_Length(ST_Transform(geom, 3857))
-        WHERE length_m IS NULL OR costo IS NULL;
-    """)
-    conn.commit()
-    
     # CRÍTICO: Crear topología pgRouting correctamente
     print("   Creando topología pgRouting (tolerancia 0.0002)...")
     try:
@@ -130,6 +231,24 @@ def main(data_dir="/app/out"):
         
         print(f"✔ Topología creada con {vertices_count} vértices")
         
+    except Exception as e:
+        print(f"⚠️  Error en topología: {e}")
+        return False
+    
+    return _finalizar_carga(conn, cur)
+
+def _finalizar_carga(conn, cur, incremental=False):
+    """
+    Pasos comunes a ambos modos de topología: costos, componentes, invalidaciones y estadísticas.
+    En un refresco incremental la versión de topología y el caché ya se actualizaron en refrescar_red.
+    """
+    # Longitudes y costos llegan con el insert (etl_infra_osm.asignar_longitudes); sólo se completan faltantes
+    completadas = completar_longitudes(cur)
+    if completadas:
+        print(f"   Longitudes completadas en BD: {completadas} segmentos")
+    conn.commit()
+    
+    try:
         # Analizar la conectividad
         cur.execute("""
             SELECT COUNT(*) FROM red_vial 
@@ -138,6 +257,15 @@ def main(data_dir="/app/out"):
         connected_edges = cur.fetchone()[0]
         print(f"✔ Aristas conectadas: {connected_edges}")
         
+        # Componente principal: se calcula aquí una vez, no en cada snap
+        en_principal = marcar_componentes(cur)
+        # Topología nueva: las rutas cacheadas apuntan a vértices que ya no existen
+        # (el refresco incremental ya subió la versión en invalidar_aristas)
+        if not incremental:
+            invalidar_topologia(cur)
+        conn.commit()
+        print(f"✔ Vértices en componente principal: {en_principal}")
+        
     except Exception as e:
         print(f"⚠️  Error en topología: {e}")
         return False
@@ -3,6 +3,9 @@
 """
 loader_metadata.py
 Carga notarios.geojson y sii.geojson a la tabla 'oficinas'.
+Upsert por la clave natural (tipo, nombre, lat, lon): las oficinas que siguen
+conservan su id, así distancias_oficinas e isocronas (FK a oficinas.id) sólo se
+recalculan para las oficinas nuevas, movidas o borradas.
 """
 
 import os
@@ -10,6 +13,8 @@ import json
 import psycopg2
 from psycopg2.extras import execute_batch
 
+from ruteo_temporal import horario_oficina
+
 def get_conn():
     return psycopg2.connect(
         host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
@@ -43,9 +48,11 @@ def ensure_table(cur, conn):
       activo BOOLEAN DEFAULT true,
       created_at TIMESTAMP DEFAULT NOW(),
       updated_at TIMESTAMP DEFAULT NOW(),
-      datos_raw JSONB -- Agregada para compatibilidad si el schema completo ya existe
+      datos_raw JSONB, -- Agregada para compatibilidad si el schema completo ya existe
+      horario_ventanas JSONB -- Ventanas de atención en minutos del día (ruteo_temporal)
     );
     """)
+    cur.execute("ALTER TABLE oficinas ADD COLUMN IF NOT EXISTS horario_ventanas JSONB;")
     # Asegurar que la columna datos_raw exista si la tabla ya existía sin ella
     try:
         cur.execute("ALTER TABLE oficinas ADD COLUMN IF NOT EXISTS datos_raw JSONB;")
@@ -77,35 +84,35 @@ def ensure_table(cur, conn):
     print("   ✓ Tabla 'oficinas' lista.")
 
 
-def safe_clear_oficinas(cur, conn):
-    """Intenta TRUNCATE CASCADE; si falla, hace DELETE y resetea secuencia."""
-    print("   Limpiando tabla 'oficinas'...")
-    try:
-        cur.execute("TRUNCATE TABLE oficinas RESTART IDENTITY CASCADE;")
-        conn.commit()
-    except Exception as e:
-        print(f"   (TRUNCATE falló: {e}. Usando DELETE.)")
-        conn.rollback()
-        cur = conn.cursor() # Restablecer cursor por si TRUNCATE falló
-        cur.execute("DELETE FROM oficinas;")
-        try:
-            # Intenta resetear la secuencia si existe
-            cur.execute("SELECT 1 FROM information_schema.sequences WHERE sequence_name = 'oficinas_id_seq';")
-            if cur.fetchone():
-                cur.execute("ALTER SEQUENCE oficinas_id_seq RESTART WITH 1;")
-        except Exception as e_seq:
-            print(f"   (No se pudo resetear secuencia: {e_seq})")
-        conn.commit()
-    print("   ✓ Tabla 'oficinas' limpiada.")
+def ensure_clave(cur, conn):
+    """
+    Clave natural de oficinas (tipo, nombre, lat, lon) para el upsert de load_geojson.
+    Si el índice aún no existe, antes se borran las filas repetidas de cargas antiguas (queda la de menor id).
+    """
+    cur.execute("SELECT to_regclass('oficinas_clave_idx') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        cur.execute("""
+            DELETE FROM oficinas a USING oficinas b
+            WHERE a.tipo = b.tipo AND a.nombre = b.nombre AND a.lat = b.lat AND a.lon = b.lon AND a.id > b.id;
+        """)
+        if cur.rowcount:
+            print(f"   ✓ {cur.rowcount} oficinas repetidas eliminadas")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS oficinas_clave_idx ON oficinas(tipo, nombre, lat, lon);")
+    conn.commit()
 
 
 def load_geojson(cur, path):
+    """
+    Upsert de las oficinas del archivo y borrado de las de ese tipo que ya no vienen
+    (el borrado arrastra sus filas de distancias_oficinas e isocronas por ON DELETE CASCADE).
+    Retorna (filas cargadas, oficinas borradas).
+    """
     with open(path, encoding="utf-8") as f:
         data = json.load(f)
     
     feats = data.get("features", [])
     if not feats:
-        return 0
+        return 0, 0
         
     # Determinar el 'tipo' de oficina basado en el nombre del archivo
     tipo_oficina = "desconocido"
@@ -125,6 +132,8 @@ def load_geojson(cur, path):
             continue
         
         lon, lat = float(coords[0]), float(coords[1])
+        horario = horario_oficina(props)
+        semana = horario["semana"] if horario else []
         
         # Prepara la fila SÓLO con las columnas que sabemos que existen
         rows.append((
@@ -134,19 +143,41 @@ def load_geojson(cur, path):
             props.get("comuna"),
             lat,
             lon,
-            props.get("telefono")
+            props.get("telefono"),
             # Ya no intentamos insertar en datos_raw aquí
+            "%02d:%02d" % divmod(semana[0][0], 60) if semana else None,
+            "%02d:%02d" % divmod(semana[-1][1], 60) if semana else None,
+            json.dumps(horario) if horario else None
         ))
 
-    # Insertar por lotes en las columnas específicas
+    # Insertar por lotes en las columnas específicas; una oficina que ya existe toma los datos nuevos
+    # (sólo si cambiaron: una recarga idéntica no toca filas)
     execute_batch(cur, """
         INSERT INTO oficinas
-        (nombre, tipo, direccion, comuna, lat, lon, telefono)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT DO NOTHING;
+        (nombre, tipo, direccion, comuna, lat, lon, telefono, horario_apertura, horario_cierre, horario_ventanas)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s::jsonb)
+        ON CONFLICT (tipo, nombre, lat, lon) DO UPDATE SET
+          direccion = EXCLUDED.direccion, comuna = EXCLUDED.comuna, telefono = EXCLUDED.telefono,
+          horario_apertura = EXCLUDED.horario_apertura, horario_cierre = EXCLUDED.horario_cierre,
+          horario_ventanas = EXCLUDED.horario_ventanas
+        WHERE (oficinas.direccion, oficinas.comuna, oficinas.telefono, oficinas.horario_apertura,
+               oficinas.horario_cierre, oficinas.horario_ventanas)
+              IS DISTINCT FROM
+              (EXCLUDED.direccion, EXCLUDED.comuna, EXCLUDED.telefono, EXCLUDED.horario_apertura,
+               EXCLUDED.horario_cierre, EXCLUDED.horario_ventanas);
     """, rows, page_size=100)
+
+    # Oficinas de este tipo que ya no están en el archivo
+    cur.execute("""
+        DELETE FROM oficinas o
+        WHERE o.tipo = %s
+          AND NOT EXISTS (
+              SELECT 1 FROM unnest(%s::text[], %s::float8[], %s::float8[]) AS n(nombre, lat, lon)
+              WHERE n.nombre = o.nombre AND n.lat = o.lat AND n.lon = o.lon
+          );
+    """, (tipo_oficina, [r[0] for r in rows], [r[4] for r in rows], [r[5] for r in rows]))
     
-    return len(rows)
+    return len(rows), cur.rowcount
 
 def main(data_dir="/app/out"):
     print("📥 LOADER Metadata (Oficinas) → PostgreSQL")
@@ -160,8 +191,8 @@ def main(data_dir="/app/out"):
     # 1) Asegurar que la tabla y trigger existan
     ensure_table(cur, conn)
 
-    # 2) Limpiar la tabla de oficinas
-    safe_clear_oficinas(cur, conn)
+    # 2) Clave natural para el upsert (sin vaciar la tabla: los ids de oficinas se conservan)
+    ensure_clave(cur, conn)
 
     # 3) Cargar archivos
     total = 0
@@ -173,9 +204,9 @@ def main(data_dir="/app/out"):
         
         print(f"   Cargando {fname} ...")
         try:
-            cnt = load_geojson(cur, path)
+            cnt, borradas = load_geojson(cur, path)
             conn.commit()
-            print(f"     → {cnt} filas insertadas")
+            print(f"     → {cnt} filas cargadas, {borradas} oficinas que ya no vienen borradas")
             total += cnt
         except Exception as e:
             print(f"     ❌ Error cargando {fname}: {e}")
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Penalización de aristas por amenazas (tabla materializada red_vial_penalizacion).
+Cada arista dentro del radio de afectación de una amenaza activa recibe un
+multiplicador de costo (o queda bloqueada si la severidad es crítica).
+
+La tabla se mantiene de forma INCREMENTAL: se compara v_amenazas_activas con la
+foto de amenazas ya aplicadas (amenazas_aplicadas) y sólo se recalculan las
+aristas cercanas a amenazas nuevas, expiradas o modificadas. Los joins
+espaciales usan ST_DWithin en metros sobre red_vial.geom_utm (UTM 19S, con
+índice GiST); sólo la amenaza se proyecta en la consulta.
+"""
+import os
+
+import numpy as np
+import psycopg2
+
+from cache_rutas import invalidar_por_amenazas
+
+# Multiplicador de costo por severidad (1=bajo ... 5=crítico). Severidad >= SEVERIDAD_BLOQUEO bloquea la arista.
+MULTIPLICADOR_SEVERIDAD = [1.2, 1.5, 2.0, 3.0, 5.0]
+SEVERIDAD_BLOQUEO = 5
+RADIO_DEFECTO_M = 500
+
+# Aristas para el motor en memoria (GrafoRuteo.desde_bd) con la penalización aplicada; costo -1 = bloqueada
+SQL_ARISTAS_PENALIZADAS = """
+    SELECT rv.id, rv.source, rv.target,
+           CASE WHEN p.bloqueado THEN -1 ELSE rv.costo * COALESCE(p.multiplicador, 1) END AS costo,
+           CASE WHEN p.bloqueado THEN -1 ELSE rv.reverse_costo * COALESCE(p.multiplicador, 1) END AS reverse_costo,
+           rv.length_m
+    FROM red_vial rv
+    LEFT JOIN red_vial_penalizacion p ON p.edge_id = rv.id
+    WHERE rv.source IS NOT NULL AND rv.target IS NOT NULL AND rv.costo > 0
+"""
+
+# Mismo join con los nombres de columna que espera pgRouting
+SQL_ARISTAS_PGR_PENALIZADAS = """
+    SELECT rv.id, rv.source, rv.target,
+           CASE WHEN p.bloqueado THEN -1 ELSE rv.costo * COALESCE(p.multiplicador, 1) END AS cost,
+           CASE WHEN p.bloqueado THEN -1 ELSE rv.reverse_costo * COALESCE(p.multiplicador, 1) END AS reverse_cost
+    FROM red_vial rv
+    LEFT JOIN red_vial_penalizacion p ON p.edge_id = rv.id
+    WHERE rv.source IS NOT NULL AND rv.target IS NOT NULL AND rv.costo > 0
+"""
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def ensure_tablas(cur):
+    """Crea tablas e índices de penalización si no existen (ver 00_schema_completo.sql)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS red_vial_penalizacion (
+          edge_id BIGINT PRIMARY KEY REFERENCES red_vial(id) ON DELETE CASCADE,
+          multiplicador DOUBLE PRECISION NOT NULL DEFAULT 1,
+          bloqueado BOOLEAN NOT NULL DEFAULT false,
+          amenaza_ids INTEGER[] NOT NULL,
+          actualizado TIMESTAMP DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS amenazas_aplicadas (
+          amenaza_id INTEGER PRIMARY KEY,
+          geom geometry(Point, 4326) NOT NULL,
+          radio_afectacion_m DOUBLE PRECISION NOT NULL,
+          severidad INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS red_vial_geom_utm_idx ON red_vial USING GIST(geom_utm);
+        CREATE INDEX IF NOT EXISTS amenazas_geog_idx ON amenazas USING GIST((geom::geography));
+    """)
+
+
+def invalidar_penalizacion(cur):
+    """
+    Descarta penalización y foto de amenazas aplicadas. Se llama cuando la red
+    vial se recarga (los ids de arista cambian), para que el próximo
+    actualizar_penalizacion recalcule desde cero.
+    """
+    cur.execute("""
+        DO $$ BEGIN
+          IF to_regclass('amenazas_aplicadas') IS NOT NULL THEN TRUNCATE amenazas_aplicadas; END IF;
+          IF to_regclass('red_vial_penalizacion') IS NOT NULL THEN TRUNCATE red_vial_penalizacion; END IF;
+        END $$;
+    """)
+
+
+def actualizar_penalizacion(conn):
+    """
+    Aplica a red_vial_penalizacion sólo los cambios de amenazas desde la última
+    ejecución. Retorna dict con amenazas cambiadas, aristas recalculadas y la
+    versión de amenazas nueva (None si ningún costo cambió).
+    """
+    cur = conn.cursor()
+    ensure_tablas(cur)
+
+    # 1) Amenazas cambiadas: versión actual y versión aplicada (para limpiar su huella anterior)
+    cur.execute("""
+        CREATE TEMP TABLE _amenazas_cambiadas ON COMMIT DROP AS
+        WITH actuales AS (
+            SELECT id, geom, COALESCE(radio_afectacion_m, %(radio)s) AS radio, COALESCE(severidad, 3) AS severidad
+            FROM v_amenazas_activas WHERE geom IS NOT NULL
+        ), distintas AS (
+            SELECT COALESCE(a.id, p.amenaza_id) AS id
+            FROM actuales a
+            FULL JOIN amenazas_aplicadas p ON p.amenaza_id = a.id
+            WHERE a.id IS NULL OR p.amenaza_id IS NULL
+               OR NOT ST_Equals(a.geom, p.geom) OR a.radio <> p.radio_afectacion_m OR a.severidad <> p.severidad
+        )
+        SELECT a.id, a.geom, a.radio FROM actuales a JOIN distintas d ON d.id = a.id
+        UNION ALL
+        SELECT p.amenaza_id, p.geom, p.radio_afectacion_m FROM amenazas_aplicadas p JOIN distintas d ON d.id = p.amenaza_id;
+    """, {"radio": RADIO_DEFECTO_M})
+    cur.execute("SELECT COUNT(DISTINCT id) FROM _amenazas_cambiadas;")
+    cambiadas = cur.fetchone()[0]
+    if cambiadas == 0:
+        conn.commit()
+        cur.close()
+        return {"amenazas_cambiadas": 0, "aristas_recalculadas": 0, "amenaza_ids": [],
+                "version_amenazas": None, "rutas_invalidadas": 0}
+
+    # 2) Aristas en el radio de alguna versión (nueva o anterior) de esas amenazas
+    cur.execute("""
+        CREATE TEMP TABLE _aristas_afectadas ON COMMIT DROP AS
+        SELECT DISTINCT rv.id
+        FROM _amenazas_cambiadas c
+        JOIN red_vial rv ON ST_DWithin(rv.geom_utm, ST_Transform(c.geom, 32719), c.radio);
+    """)
+
+    # 3) Recalcular sólo esas aristas contra TODAS las amenazas activas (guardando la penalización anterior)
+    cur.execute("""
+        CREATE TEMP TABLE _penalizacion_anterior ON COMMIT DROP AS
+        SELECT edge_id, multiplicador, bloqueado FROM red_vial_penalizacion
+        WHERE edge_id IN (SELECT id FROM _aristas_afectadas);
+    """)
+    cur.execute("DELETE FROM red_vial_penalizacion WHERE edge_id IN (SELECT id FROM _aristas_afectadas);")
+    cur.execute("""
+        INSERT INTO red_vial_penalizacion (edge_id, multiplicador, bloqueado, amenaza_ids, actualizado)
+        SELECT rv.id,
+               MAX((%(mult)s::float8[])[LEAST(GREATEST(COALESCE(a.severidad, 3), 1), 5)]),
+               bool_or(COALESCE(a.severidad, 3) >= %(bloqueo)s),
+               array_agg(a.id ORDER BY a.id),
+               NOW()
+        FROM _aristas_afectadas x
+        JOIN red_vial rv ON rv.id = x.id
+        JOIN v_amenazas_activas a
+          ON a.geom IS NOT NULL
+         AND ST_DWithin(rv.geom_utm, ST_Transform(a.geom, 32719), COALESCE(a.radio_afectacion_m, %(radio)s))
+        GROUP BY rv.id;
+    """, {"mult": MULTIPLICADOR_SEVERIDAD, "bloqueo": SEVERIDAD_BLOQUEO, "radio": RADIO_DEFECTO_M})
+
+    # 4) Aristas cuyo costo efectivo cambió (el multiplicador es el máximo, así que puede no cambiar)
+    #    y si bajó: una amenaza expirada o con menos severidad abarata aristas
+    cur.execute("""
+        CREATE TEMP TABLE _penalizacion_cambiada ON COMMIT DROP AS
+        WITH comparada AS (
+            SELECT x.id,
+                   COALESCE(a.bloqueado, false) AS bloq_antes, COALESCE(a.multiplicador, 1) AS mult_antes,
+                   COALESCE(n.bloqueado, false) AS bloq_ahora, COALESCE(n.multiplicador, 1) AS mult_ahora
+            FROM _aristas_afectadas x
+            LEFT JOIN _penalizacion_anterior a ON a.edge_id = x.id
+            LEFT JOIN red_vial_penalizacion n ON n.edge_id = x.id
+        )
+        SELECT id, (bloq_antes AND NOT bloq_ahora) OR (NOT bloq_antes AND NOT bloq_ahora AND mult_ahora < mult_antes) AS baja
+        FROM comparada
+        WHERE bloq_antes <> bloq_ahora OR (NOT bloq_ahora AND mult_ahora <> mult_antes);
+    """)
+
+    # 5) Rutas cacheadas afectadas por esos cambios de costo
+    version, rutas_borradas = invalidar_por_amenazas(cur, "_penalizacion_cambiada")
+
+    # 6) Actualizar la foto de amenazas aplicadas
+    cur.execute("SELECT COUNT(*) FROM _aristas_afectadas;")
+    recalculadas = cur.fetchone()[0]
+    cur.execute("SELECT array_agg(DISTINCT id) FROM _amenazas_cambiadas;")
+    ids = cur.fetchone()[0] or []
+    cur.execute("DELETE FROM amenazas_aplicadas WHERE amenaza_id = ANY(%s);", (ids,))
+    cur.execute("""
+        INSERT INTO amenazas_aplicadas (amenaza_id, geom, radio_afectacion_m, severidad)
+        SELECT id, geom, COALESCE(radio_afectacion_m, %s), COALESCE(severidad, 3)
+        FROM v_amenazas_activas WHERE geom IS NOT NULL AND id = ANY(%s);
+    """, (RADIO_DEFECTO_M, ids))
+    conn.commit()
+    cur.close()
+    return {"amenazas_cambiadas": cambiadas, "aristas_recalculadas": recalculadas, "amenaza_ids": ids,
+            "version_amenazas": version, "rutas_invalidadas": rutas_borradas}
+
+
+def aristas_penalizadas(cur, edge_ids):
+    """Subconjunto de edge_ids con penalización o bloqueo vigente."""
+    cur.execute("""
+        SELECT edge_id FROM red_vial_penalizacion
+        WHERE edge_id = ANY(%s) AND (bloqueado OR multiplicador > 1);
+    """, (list(edge_ids),))
+    return {int(r[0] if isinstance(r, tuple) else r["edge_id"]) for r in cur.fetchall()}
+
+
+def pesos_penalizados(conn, grafo):
+    """
+    Pesos por arco (mismo orden que grafo.arco_peso) con la penalización
+    aplicada, para reutilizar un grafo ya cargado sin volver a leer red_vial:
+        grafo.ruta(o, d, pesos=pesos_penalizados(conn, grafo))
+    Las aristas bloqueadas quedan con peso infinito.
+    """
+    mult = np.ones(grafo.n_aristas)
+    posicion = {int(e): i for i, e in enumerate(grafo.edge_id)}
+    cur = conn.cursor()
+    cur.execute("SELECT edge_id, multiplicador, bloqueado FROM red_vial_penalizacion;")
+    for edge_id, m, bloqueado in cur.fetchall():
+        i = posicion.get(int(edge_id))
+        if i is not None:
+            mult[i] = np.inf if bloqueado else m
+    cur.close()
+    return (grafo.arco_peso * mult[grafo.arco_arista]).tolist()
+
+
+def main(data_dir="/app/out"):
+    print("🚧 PENALIZACIÓN por amenazas → red_vial_penalizacion (incremental)")
+    conn = get_conn()
+    r = actualizar_penalizacion(conn)
+    print(f"✓ Amenazas nuevas/expiradas/modificadas: {r['amenazas_cambiadas']}")
+    print(f"✓ Aristas recalculadas: {r['aristas_recalculadas']}")
+    print(f"✓ Rutas cacheadas invalidadas: {r['rutas_invalidadas']}")
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*), COUNT(*) FILTER (WHERE bloqueado) FROM red_vial_penalizacion;")
+    total, bloqueadas = cur.fetchone()
+    print(f"✓ Aristas penalizadas: {total} ({bloqueadas} bloqueadas)")
+    cur.close()
+    conn.close()
+    return r
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Planificador de trámites: elige la oficina concreta de cada paso.
+Para un origen y un trámite (tramites.pasos → oficina_tipo por paso) busca la
+combinación de oficinas que minimiza la caminata. El catálogo sólo tiene tiempo
+de trámite por paso, igual para todas las oficinas del tipo: suma al total pero
+no cambia la elección. Con hora de salida sí la cambian las esperas de apertura
+y el factor peak, que dependen del horario de cada oficina.
+
+En vez de rutear contra cada combinación de candidatas, resuelve una
+programación dinámica por capas sobre la red: la capa k guarda, para cada
+vértice, el costo mínimo de haber completado los pasos 1..k y estar ahí.
+Cada capa es UNA búsqueda Dijkstra multi-fuente sembrada con las oficinas del
+paso anterior (costo acumulado como costo inicial), así que el costo es
+O(pasos) búsquedas sin importar cuántas notarías o sucursales SII haya.
+"""
+import json
+import os
+import shutil
+import sys
+import time
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from etl_ruta_dijkstra import CONSIDERA_AMENAZAS, filas_con_geometria, geometria_aristas
+from grafo_ruteo import INF, SQL_ARISTAS, cargar_grafo
+from loader_infraestructura import asegurar_componentes
+from penalizacion_amenazas import SQL_ARISTAS_PENALIZADAS
+from ruteo_temporal import PerfilTemporal, hora_salida, inicio_atencion
+from snapping import SnapperVertices
+
+VELOCIDAD_M_MIN = 83.33  # caminata, como en etl_ruta_dijkstra
+TRAMITE_DEFECTO = os.getenv("PLAN_TRAMITE", "Compraventa de Inmueble")
+# Origen por defecto: Plaza de Armas de Santiago
+ORIGEN_DEFECTO = (float(os.getenv("PLAN_ORIGEN_LAT", "-33.4378")), float(os.getenv("PLAN_ORIGEN_LON", "-70.6504")))
+# Hora de salida (ISO u "HH:MM" de hoy) para el modo dependiente del tiempo; vacío = estático
+SALIDA_DEFECTO = os.getenv("PLAN_SALIDA") or None
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def cargar_tramite(conn, nombre):
+    """(nombre, pasos) con pasos = [{orden, oficina_tipo, descripcion, tiempo_min}] ordenados."""
+    cur = conn.cursor()
+    cur.execute("SELECT nombre, tiempo_estimado_min, pasos FROM tramites WHERE nombre = %s LIMIT 1;", (nombre,))
+    fila = cur.fetchone()
+    cur.close()
+    if not fila:
+        raise ValueError(f"Trámite no encontrado: {nombre}")
+    nombre, total_min, pasos = fila
+    pasos = sorted(pasos or [], key=lambda p: p.get("orden", 0))
+    if not pasos:
+        raise ValueError(f"El trámite '{nombre}' no tiene pasos")
+    # Sin tiempo por paso en el catálogo: se reparte el tiempo estimado del trámite
+    por_paso = (total_min or 0) / len(pasos)
+    for p in pasos:
+        p.setdefault("tiempo_min", por_paso)
+    return nombre, pasos
+
+
+def cargar_oficinas(conn, tipos, snapper=None):
+    """Oficinas activas por tipo: {tipo: [{id, nombre, direccion, lat, lon, vertex_id, horario}]}."""
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, nombre, tipo, direccion, lat, lon, vertex_id, horario_ventanas
+        FROM oficinas WHERE activo = true AND tipo = ANY(%s) ORDER BY id;
+    """, (list(tipos),))
+    filas = cur.fetchall()
+    cur.close()
+    por_tipo = {t: [] for t in tipos}
+    sin_vertice = []
+    for oid, nombre, tipo, direccion, lat, lon, vid, horario in filas:
+        o = {"id": oid, "nombre": nombre, "tipo": tipo, "direccion": direccion, "lat": lat, "lon": lon, "vertex_id": vid,
+             "horario": horario}
+        por_tipo[tipo].append(o)
+        if vid is None:
+            sin_vertice.append(o)
+    # Oficinas sin vertex_id precalculado (snapping.py): se ajustan aquí en una sola llamada
+    if sin_vertice and snapper is not None:
+        ids, _ = snapper.snap([o["lat"] for o in sin_vertice], [o["lon"] for o in sin_vertice])
+        for o, v in zip(sin_vertice, ids):
+            o["vertex_id"] = int(v)
+    return por_tipo
+
+
+def planificar(grafo, origen_id, pasos, oficinas_por_tipo, perfil=None, salida=0.0):
+    """
+    Elige una oficina por paso minimizando la caminata (con perfil: caminata + esperas + atención).
+    pasos: [{oficina_tipo, tiempo_min}] en orden; origen_id: vértice de pgRouting.
+    perfil: ruteo_temporal.PerfilTemporal para el modo dependiente del tiempo
+    (salida en minutos desde perfil.origen): las amenazas pesan sólo en su
+    ventana, se espera a que abra la oficina y llegar tras el cierre es infactible.
+    Las amenazas encarecen el costo, no el reloj: llegadas, horarios y total_min
+    salen de la caminata real (length_m) que buscar_temporal lleva aparte.
+    Retorna dict con oficinas elegidas, filas de ruta por tramo y totales.
+    """
+    s = grafo.indice(origen_id)
+    if s is None:
+        raise ValueError(f"Vértice de origen fuera de la red: {origen_id}")
+
+    fuentes = [(s, 0.0, salida)]
+    capas = []
+    expandidos_total = 0
+    for paso in pasos:
+        tipo = paso["oficina_tipo"]
+        candidatas = {}
+        for o in oficinas_por_tipo.get(tipo, []):
+            i = grafo.indice(o["vertex_id"]) if o["vertex_id"] is not None else None
+            if i is not None:
+                candidatas.setdefault(i, o)
+        if not candidatas:
+            raise ValueError(f"Sin oficinas '{tipo}' en la red")
+
+        # Una sola búsqueda para todo el tipo; se detiene al asentar todas sus candidatas
+        if perfil is None:
+            dist, pred, expandidos = grafo.buscar([(i, c) for i, c, _ in fuentes], destinos=set(candidatas))
+        else:
+            dist, pred, expandidos, reloj = grafo.buscar_temporal(fuentes, perfil, salida, VELOCIDAD_M_MIN,
+                                                                  destinos=set(candidatas))
+        expandidos_total += expandidos
+        # El tiempo de trámite (en costo equivalente de caminata) entra como costo inicial de la capa siguiente;
+        # con horarios, la siguiente capa parte además con el reloj en el fin de la atención
+        terminadas, agenda, relojes = {}, {}, {}
+        for i in candidatas:
+            if dist[i] == INF:
+                continue
+            if perfil is None:
+                terminadas[i] = dist[i] + paso["tiempo_min"] * VELOCIDAD_M_MIN
+                continue
+            llegada = reloj[i]
+            atencion = inicio_atencion(candidatas[i].get("horario"), llegada, perfil)
+            if atencion is None:
+                continue
+            inicio, factor = atencion
+            fin = inicio + paso["tiempo_min"] * factor
+            terminadas[i] = dist[i] + (fin - llegada) * VELOCIDAD_M_MIN
+            relojes[i] = fin
+            agenda[i] = {"llegada": llegada, "inicio": inicio, "fin": fin}
+        if not terminadas:
+            raise ValueError(f"Ninguna oficina '{tipo}' alcanzable" + (" antes de su cierre" if perfil else ""))
+        capas.append((pred, candidatas, agenda))
+        fuentes = [(i, c, relojes.get(i)) for i, c in terminadas.items()]
+
+    # Reconstrucción hacia atrás: cada tramo termina en la fuente (oficina anterior) que lo originó
+    actual = min(terminadas, key=terminadas.get)
+    oficinas, tramos, horarios = [], [], []
+    for pred, candidatas, agenda in reversed(capas):
+        arcos = grafo.reconstruir(pred, actual)
+        oficinas.append(candidatas[actual])
+        tramos.append(grafo.filas_ruta(arcos))
+        horarios.append(agenda.get(actual))
+        actual = int(grafo.arco_origen[arcos[0]]) if arcos else actual
+    oficinas.reverse()
+    tramos.reverse()
+    horarios.reverse()
+
+    distancia = sum(f["distancia_m"] for t in tramos for f in t)
+    plan = {
+        "oficinas": oficinas,
+        "tramos": tramos,
+        "costo_red": sum(f["cost"] for t in tramos for f in t),
+        "distancia_m": distancia,
+        "caminata_min": distancia / VELOCIDAD_M_MIN,
+        "tramites_min": sum(p["tiempo_min"] for p in pasos),
+        "total_min": distancia / VELOCIDAD_M_MIN + sum(p["tiempo_min"] for p in pasos),
+        "expandidos": expandidos_total,
+    }
+    if perfil is not None:
+        # Con horarios el total incluye esperas de apertura, trámites en horario peak y desvíos por amenazas
+        plan.update(tramites_min=sum(h["fin"] - h["inicio"] for h in horarios),
+                    espera_min=sum(h["inicio"] - h["llegada"] for h in horarios),
+                    total_min=horarios[-1]["fin"] - salida, salida=perfil.momento(salida),
+                    horarios=[{k: perfil.momento(v) for k, v in h.items()} for h in horarios])
+    return plan
+
+
+def plan_a_geojson(cur, plan, pasos, origen, nombre_tramite):
+    """FeatureCollection con los tramos (geometría por arista) y las oficinas elegidas."""
+    por_id = geometria_aristas(cur, {f["edge"] for t in plan["tramos"] for f in t})
+    features = [{"type": "Feature", "geometry": {"type": "Point", "coordinates": [origen[1], origen[0]]},
+                 "properties": {"tipo": "origen"}}]
+    horarios = plan.get("horarios") or [None] * len(pasos)
+    for k, (filas, oficina, paso, horario) in enumerate(zip(plan["tramos"], plan["oficinas"], pasos, horarios), start=1):
+        for row in filas_con_geometria(filas, por_id):
+            features.append({"type": "Feature", "geometry": row["geometry"], "properties": {
+                "tipo": "ruta_plan", "segmento": k, "calle": row["calle"], "tipo_via": row["tipo_via"],
+                "distancia_m": round(float(row["distancia_m"] or 0), 1), "secuencia": row["seq"]}})
+        features.append({"type": "Feature", "geometry": {"type": "Point", "coordinates": [oficina["lon"], oficina["lat"]]},
+                         "properties": {"tipo": "parada", "numero": k, "nombre": oficina["nombre"],
+                                        "direccion": oficina["direccion"], "tipo_oficina": oficina["tipo"],
+                                        "tiempo_tramite": round(paso["tiempo_min"]), "descripcion": paso.get("descripcion")}})
+        if horario:
+            features[-1]["properties"].update({k: v.strftime("%H:%M") for k, v in horario.items()})
+    metadata = {
+        "tipo": "plan_tramite", "tramite": nombre_tramite, "origen": {"lat": origen[0], "lon": origen[1]},
+        "distancia_total_km": round(plan["distancia_m"] / 1000, 2), "caminata_min": round(plan["caminata_min"]),
+        "tramites_min": round(plan["tramites_min"]), "duracion_estimada_min": round(plan["total_min"]),
+        "nodos_expandidos": plan["expandidos"], "algoritmo": "Dijkstra multi-fuente por paso (programación dinámica por capas)"}
+    if plan.get("horarios"):
+        metadata.update(salida=plan["salida"].isoformat(timespec="minutes"), espera_min=round(plan["espera_min"]),
+                        algoritmo="Dijkstra dependiente del tiempo multi-fuente por paso (ventanas de amenazas y horarios)")
+    return {"type": "FeatureCollection", "features": features, "metadata": metadata}
+
+
+def main(out_dir="/app/out", tramite=TRAMITE_DEFECTO, origen=ORIGEN_DEFECTO, amenazas=CONSIDERA_AMENAZAS,
+         salida=SALIDA_DEFECTO):
+    """salida: hora de salida (ISO u "HH:MM" de hoy) para el modo dependiente del tiempo; None = estático."""
+    print(f"🧭 PLANIFICADOR: {tramite} desde ({origen[0]}, {origen[1]})" + (f" saliendo {salida}" if salida else ""))
+    os.makedirs(out_dir, exist_ok=True)
+    out_file = os.path.join(out_dir, "plan_tramite.geojson")
+    conn = get_conn()
+    asegurar_componentes(conn)
+    nombre, pasos = cargar_tramite(conn, tramite)
+    tipos = [p["oficina_tipo"] for p in pasos]
+    print(f"   Pasos: {' → '.join(tipos)}")
+
+    # Con hora de salida las amenazas entran por su perfil temporal, no por la penalización vigente;
+    # sin amenazas el perfil queda vacío y sólo cuentan los horarios de las oficinas
+    grafo = cargar_grafo(conn, sql_aristas=SQL_ARISTAS_PENALIZADAS if amenazas and not salida else SQL_ARISTAS)
+    perfil = None
+    if salida:
+        if amenazas:
+            perfil = PerfilTemporal.desde_bd(conn, grafo, hora_salida(salida))
+            print(f"   ✓ Perfil temporal: {perfil.n_aristas:,} aristas con amenazas en alguna ventana")
+        else:
+            perfil = PerfilTemporal(grafo, [], hora_salida(salida))
+            print("   ✓ Perfil temporal sin amenazas (RUTEO_AMENAZAS=0): sólo horarios de oficinas")
+    snapper = SnapperVertices.desde_bd(conn)
+    oficinas = cargar_oficinas(conn, set(tipos), snapper)
+    for t in dict.fromkeys(tipos):
+        print(f"   • {t}: {len(oficinas[t])} candidatas")
+
+    origen_v = snapper.snap_uno(*origen)
+    t0 = time.perf_counter()
+    plan = planificar(grafo, origen_v["id"], pasos, oficinas, perfil=perfil)
+    ms = (time.perf_counter() - t0) * 1000
+    for k, o in enumerate(plan["oficinas"], start=1):
+        horario = plan["horarios"][k - 1] if perfil else None
+        print(f"   {k}. {o['nombre']} ({o['tipo']}) - {o['direccion'] or 'sin dirección'}"
+              + (f" | llega {horario['llegada']:%H:%M}, atiende {horario['inicio']:%H:%M}-{horario['fin']:%H:%M}" if horario else ""))
+    print(f"✓ Caminata {plan['distancia_m']/1000:.2f} km ({plan['caminata_min']:.0f} min) + trámites {plan['tramites_min']:.0f} min"
+          + (f" + esperas {plan['espera_min']:.0f} min" if perfil else "")
+          + f" = {plan['total_min']:.0f} min | {len(pasos)} búsquedas, {plan['expandidos']:,} vértices expandidos, {ms:.0f} ms")
+
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    geojson = plan_a_geojson(cur, plan, pasos, origen, nombre)
+    cur.close()
+    conn.close()
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump(geojson, f, ensure_ascii=False, indent=2)
+    print(f"✅ Archivo generado: {out_file}")
+    web_data_dir = os.environ.get("WEB_DATA_DIR")
+    if web_data_dir and os.path.isdir(web_data_dir):
+        shutil.copy2(out_file, os.path.join(web_data_dir, "plan_tramite.geojson"))
+    return plan
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4:
+        main(tramite=sys.argv[1], origen=(float(sys.argv[2]), float(sys.argv[3])),
+             salida=sys.argv[4] if len(sys.argv) >= 5 else SALIDA_DEFECTO)
+    else:
+        main()
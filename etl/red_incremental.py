@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Refresco incremental de red_vial (RED_CARGA=incremental en loader_infraestructura).
+
+En vez de TRUNCATE + topología completa, compara la extracción nueva (ya
+nodada, ver etl_infra_osm.nodar_features) con red_vial por (osm_id, segmento):
+- tramos que ya no están se borran (sus penalizaciones caen por ON DELETE CASCADE),
+- tramos con otra geometría, nombre o tipo de vía se actualizan en su misma fila
+  (si sólo cambió el nombre o el tipo de vía, la topología y los costos no se
+  tocan y la versión de topología no sube),
+- tramos nuevos se insertan.
+Los ids de las aristas que no cambian se conservan, y también los de sus
+vértices: sólo se re-nodan los extremos de los tramos insertados o
+modificados (vértice existente dentro de la tolerancia del modo de topología,
+o uno nuevo) y se borran los vértices que quedaron sin aristas.
+
+Todo ocurre en una transacción. Tramos sin osm_id (capas que no vienen de
+OSM) no tienen clave estable y se reemplazan en cada corrida, salvo los
+conectores de fix_topology (tipo_via='conector'), que se conservan mientras
+sus vértices no cambien. Si red_vial está
+vacía, no tiene topología o se cargó antes de la columna segmento, retorna
+None y el loader hace la carga completa.
+"""
+import os
+
+import psycopg2
+
+from cache_rutas import invalidar_aristas
+from penalizacion_amenazas import invalidar_penalizacion
+from topologia_directa import copiar_csv
+
+RED_CARGA = os.getenv("RED_CARGA", "completa")  # "completa" | "incremental"
+# Distancia (grados) para reutilizar un vértice existente, como la de pgr_createTopology en cada modo
+TOLERANCIA = {"pgr": 0.0002, "directa": 0.000001}
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def ensure_columnas(cur):
+    """
+    Columnas agregadas a red_vial después de su versión original (ver 00_schema_completo.sql):
+    segmento (clave (osm_id, segmento)) y geom_utm (UTM 19S, generada desde geom, con GiST propio).
+    """
+    cur.execute("""
+        ALTER TABLE red_vial ADD COLUMN IF NOT EXISTS segmento INTEGER;
+        CREATE INDEX IF NOT EXISTS red_vial_osm_segmento_idx ON red_vial(osm_id, segmento);
+        ALTER TABLE red_vial ADD COLUMN IF NOT EXISTS geom_utm geometry(LineString, 32719)
+          GENERATED ALWAYS AS (ST_Transform(geom, 32719)) STORED;
+        CREATE INDEX IF NOT EXISTS red_vial_geom_utm_idx ON red_vial USING GIST(geom_utm);
+    """)
+
+
+def completar_longitudes(cur):
+    """
+    length_m / costo / reverse_costo de los segmentos que llegaron sin longitud
+    (GeoJSON de otra fuente o filas antiguas): geodésica, un ST_Length por fila.
+    Retorna la cantidad de filas completadas.
+    """
+    cur.execute("""
+        UPDATE red_vial rv SET length_m = x.largo, costo = x.largo, reverse_costo = x.largo
+        FROM (SELECT id, ST_Length(geom::geography) AS largo FROM red_vial
+              WHERE length_m IS NULL OR costo IS NULL OR reverse_costo IS NULL) x
+        WHERE rv.id = x.id;
+    """)
+    return cur.rowcount
+
+
+def _red_previa(cur):
+    """True si hay una red con topología y clave (osm_id, segmento) contra la cual comparar."""
+    cur.execute("SELECT to_regclass('red_vial_vertices_pgr') IS NOT NULL;")
+    if not cur.fetchone()[0]:
+        return False
+    cur.execute("SELECT EXISTS (SELECT 1 FROM red_vial WHERE segmento IS NOT NULL);")
+    return cur.fetchone()[0]
+
+
+def _cargar_extraccion(cur, features):
+    """Tramos de la extracción nueva en la tabla temporal _red_nueva (COPY)."""
+    cur.execute("""
+        CREATE TEMP TABLE _red_nueva (
+          osm_id BIGINT, segmento INTEGER, nombre TEXT, tipo_via TEXT, geom geometry(LineString, 4326),
+          length_m DOUBLE PRECISION
+        ) ON COMMIT DROP;
+    """)
+    filas = []
+    for feat in features:
+        geom = feat.get("geometry")
+        props = feat.get("properties", {})
+        if not geom or geom.get("type") != "LineString" or len(geom["coordinates"]) < 2:
+            continue
+        wkt = "SRID=4326;LINESTRING(" + ", ".join(f"{lon} {lat}" for lon, lat in geom["coordinates"]) + ")"
+        filas.append((props.get("osm_id"), props.get("segmento"), props.get("nombre", "Sin nombre"),
+                      props.get("tipo_via", "unknown"), wkt, props.get("length_m")))
+    copiar_csv(cur, "_red_nueva", ("osm_id", "segmento", "nombre", "tipo_via", "geom", "length_m"), filas)
+    cur.execute("CREATE INDEX ON _red_nueva (osm_id, segmento); ANALYZE _red_nueva;")
+    return len(filas)
+
+
+def _renodar(cur, aristas, tolerancia):
+    """
+    source/target de las aristas dadas: cada extremo (a 6 decimales) toma el
+    vértice existente más cercano dentro de `tolerancia` o un vértice nuevo.
+    Retorna la cantidad de vértices nuevos.
+    """
+    cur.execute("""
+        CREATE TEMP TABLE _extremos ON COMMIT DROP AS
+        SELECT id, ST_SnapToGrid(ST_StartPoint(geom), 0.000001) AS inicio,
+                   ST_SnapToGrid(ST_EndPoint(geom), 0.000001) AS fin
+        FROM red_vial WHERE id = ANY(%s);
+        CREATE TEMP TABLE _puntos ON COMMIT DROP AS
+        SELECT inicio AS punto, NULL::BIGINT AS vertice FROM _extremos
+        UNION SELECT fin, NULL FROM _extremos;
+    """, (aristas,))
+    cur.execute("""
+        UPDATE _puntos p SET vertice = (
+            SELECT v.id FROM red_vial_vertices_pgr v
+            WHERE ST_DWithin(v.the_geom, p.punto, %s)
+            ORDER BY v.the_geom <-> p.punto LIMIT 1
+        );
+    """, (tolerancia,))
+    cur.execute("""
+        WITH nuevos AS (
+            INSERT INTO red_vial_vertices_pgr (the_geom)
+            SELECT punto FROM _puntos WHERE vertice IS NULL
+            RETURNING id, the_geom
+        )
+        UPDATE _puntos p SET vertice = n.id FROM nuevos n
+        WHERE p.vertice IS NULL AND p.punto = n.the_geom;
+    """)
+    nuevos = cur.rowcount
+    cur.execute("""
+        UPDATE red_vial rv SET source = ps.vertice, target = pt.vertice
+        FROM _extremos e
+        JOIN _puntos ps ON ps.punto = e.inicio
+        JOIN _puntos pt ON pt.punto = e.fin
+        WHERE rv.id = e.id;
+    """)
+    return nuevos
+
+
+def refrescar_red(conn, features, modo="pgr"):
+    """
+    Aplica a red_vial sólo las diferencias con `features`. Retorna dict con
+    insertadas, modificadas (geometría), renombradas (sólo nombre o tipo de
+    vía), borradas, vertices_nuevos, vertices_borrados, cambios (tramos con
+    cambio de topología o costo) y version_topologia (la nueva, o None si no
+    hubo cambios), o None si corresponde una carga completa.
+    """
+    cur = conn.cursor()
+    ensure_columnas(cur)
+    if not _red_previa(cur):
+        conn.commit()
+        cur.close()
+        return None
+
+    tramos = _cargar_extraccion(cur, features)
+
+    # 1) Diferencias por clave (osm_id, segmento)
+    cur.execute("""
+        CREATE TEMP TABLE _red_borradas ON COMMIT DROP AS
+        SELECT rv.id, rv.source, rv.target FROM red_vial rv
+        WHERE rv.tipo_via IS DISTINCT FROM 'conector'
+          AND NOT EXISTS (SELECT 1 FROM _red_nueva n WHERE n.osm_id = rv.osm_id AND n.segmento = rv.segmento);
+        CREATE TEMP TABLE _red_modificadas ON COMMIT DROP AS
+        SELECT rv.id, rv.source, rv.target FROM red_vial rv
+        JOIN _red_nueva n ON n.osm_id = rv.osm_id AND n.segmento = rv.segmento
+        WHERE NOT ST_OrderingEquals(rv.geom, n.geom);
+        CREATE TEMP TABLE _red_renombradas ON COMMIT DROP AS
+        SELECT rv.id FROM red_vial rv
+        JOIN _red_nueva n ON n.osm_id = rv.osm_id AND n.segmento = rv.segmento
+        WHERE ST_OrderingEquals(rv.geom, n.geom)
+          AND (rv.nombre IS DISTINCT FROM n.nombre OR rv.tipo_via IS DISTINCT FROM n.tipo_via);
+        SELECT ARRAY(SELECT id FROM _red_borradas), ARRAY(SELECT id FROM _red_modificadas),
+               ARRAY(SELECT id FROM _red_renombradas),
+               ARRAY(SELECT source FROM _red_borradas UNION SELECT target FROM _red_borradas
+                     UNION SELECT source FROM _red_modificadas UNION SELECT target FROM _red_modificadas);
+    """)
+    borradas, modificadas, renombradas, vertices_previos = cur.fetchone()
+    vertices_previos = [v for v in vertices_previos if v is not None]
+    # Conectores del QA de topología: se mantienen salvo que toquen un vértice afectado (fix_topology los vuelve a crear)
+    cur.execute("""
+        DELETE FROM red_vial WHERE tipo_via = 'conector' AND (source = ANY(%s) OR target = ANY(%s)) RETURNING id;
+    """, (vertices_previos, vertices_previos))
+    borradas = borradas + [r[0] for r in cur.fetchall()]
+
+    # 2) Aplicar: borrar, actualizar en la misma fila (mismo id) e insertar lo nuevo
+    cur.execute("DELETE FROM red_vial WHERE id = ANY(%s);", (borradas,))
+    cur.execute("""
+        UPDATE red_vial rv
+        SET geom = n.geom, nombre = n.nombre, tipo_via = n.tipo_via,
+            source = NULL, target = NULL, length_m = n.length_m, costo = n.length_m, reverse_costo = n.length_m
+        FROM _red_nueva n
+        WHERE rv.id = ANY(%s) AND n.osm_id = rv.osm_id AND n.segmento = rv.segmento;
+    """, (modificadas,))
+    # Sólo atributos: misma geometría, mismos extremos y mismo costo
+    cur.execute("""
+        UPDATE red_vial rv SET nombre = n.nombre, tipo_via = n.tipo_via
+        FROM _red_nueva n
+        WHERE rv.id = ANY(%s) AND n.osm_id = rv.osm_id AND n.segmento = rv.segmento;
+    """, (renombradas,))
+    cur.execute("""
+        INSERT INTO red_vial (osm_id, segmento, nombre, tipo_via, geom, length_m, costo, reverse_costo)
+        SELECT n.osm_id, n.segmento, n.nombre, n.tipo_via, n.geom, n.length_m, n.length_m, n.length_m
+        FROM _red_nueva n
+        WHERE NOT EXISTS (SELECT 1 FROM red_vial rv WHERE rv.osm_id = n.osm_id AND rv.segmento = n.segmento)
+        RETURNING id;
+    """)
+    insertadas = [r[0] for r in cur.fetchall()]
+
+    # 3) Re-nodar sólo lo tocado y soltar los vértices que quedaron sin aristas
+    renodar = modificadas + insertadas
+    vertices_nuevos = _renodar(cur, renodar, TOLERANCIA.get(modo, TOLERANCIA["pgr"])) if renodar else 0
+    cur.execute("""
+        DELETE FROM red_vial_vertices_pgr v
+        WHERE v.id = ANY(%s)
+          AND NOT EXISTS (SELECT 1 FROM red_vial WHERE source = v.id)
+          AND NOT EXISTS (SELECT 1 FROM red_vial WHERE target = v.id)
+        RETURNING id;
+    """, (vertices_previos,))
+    vertices_borrados = [r[0] for r in cur.fetchall()]
+
+    cambios = len(borradas) + len(modificadas) + len(insertadas)
+    version = None
+    if cambios:
+        # La penalización se recalcula en su paso. Sube la versión de topología (distancias, isócronas y
+        # servicio se recalculan); del caché sólo cae lo que toca aristas o vértices cambiados o lo que
+        # una arista nueva o modificada podría acortar
+        invalidar_penalizacion(cur)
+        version, _ = invalidar_aristas(cur, borradas + modificadas, vertices_borrados, renodar)
+        cur.execute("ANALYZE red_vial; ANALYZE red_vial_vertices_pgr;")
+    conn.commit()
+    cur.close()
+    return {"tramos": tramos, "insertadas": len(insertadas), "modificadas": len(modificadas),
+            "renombradas": len(renombradas),
+            "borradas": len(borradas), "vertices_nuevos": vertices_nuevos,
+            "vertices_borrados": len(vertices_borrados), "cambios": cambios,
+            "version_topologia": version}
@@ -70,6 +70,7 @@ def verificar_y_crear_schema():
             CREATE TABLE IF NOT EXISTS red_vial (
               id BIGSERIAL PRIMARY KEY,
               osm_id BIGINT,
+              segmento INTEGER,
               nombre TEXT,
               tipo_via TEXT,
               geom geometry(LineString, 4326) NOT NULL,
@@ -77,9 +78,11 @@ def verificar_y_crear_schema():
               target INTEGER,
               length_m DOUBLE PRECISION,
               costo DOUBLE PRECISION,
-              reverse_costo DOUBLE PRECISION
+              reverse_costo DOUBLE PRECISION,
+              geom_utm geometry(LineString, 32719) GENERATED ALWAYS AS (ST_Transform(geom, 32719)) STORED
             );
             CREATE INDEX IF NOT EXISTS red_vial_geom_idx ON red_vial USING GIST(geom);
+            CREATE INDEX IF NOT EXISTS red_vial_geom_utm_idx ON red_vial USING GIST(geom_utm);
             CREATE INDEX IF NOT EXISTS red_vial_source_idx ON red_vial(source);
             CREATE INDEX IF NOT EXISTS red_vial_target_idx ON red_vial(target);
 
@@ -95,6 +98,7 @@ def verificar_y_crear_schema():
               geom geometry(Point, 4326),
               horario_apertura TIME,
               horario_cierre TIME,
+              horario_ventanas JSONB,
               dias_atencion TEXT[],
               telefono TEXT,
               email TEXT,
@@ -105,6 +109,7 @@ def verificar_y_crear_schema():
               updated_at TIMESTAMP DEFAULT NOW()
             );
             CREATE INDEX IF NOT EXISTS oficinas_geom_idx ON oficinas USING GIST(geom);
+            CREATE UNIQUE INDEX IF NOT EXISTS oficinas_clave_idx ON oficinas(tipo, nombre, lat, lon);
 
             CREATE OR REPLACE FUNCTION oficinas_sync_geom()
             RETURNS TRIGGER AS $$
@@ -278,6 +283,20 @@ def ejecutar_etl():
         except Exception as e:
             print(f"⚠️  Error: {e}")
         
+        # QA de topología: componentes, brechas y conectores (out/topologia_componentes.json)
+        try:
+            from fix_topology import main as qa_topologia
+            qa_topologia(OUT_DIR)
+        except Exception as e:
+            print(f"⚠️  Error en QA de topología: {e}")
+
+        # Cadenas de grado 2: reducción de la red y aceleración por consulta (out/contraccion_cadenas.json)
+        try:
+            from contraccion_cadenas import main as contraer_cadenas
+            contraer_cadenas(OUT_DIR)
+        except Exception as e:
+            print(f"⚠️  Error contrayendo cadenas: {e}")
+        
         time.sleep(1)
         
         # 2.2 Cargar Metadata
@@ -300,12 +319,56 @@ def ejecutar_etl():
         except Exception as e:
             print(f"⚠️  Error: {e}")
         
+        # 2.4 Vértice de red más cercano para oficinas y amenazas
+        print("\n📌 Asignando vértices de red (snapping por lotes)...")
+        print("-" * 70)
+        try:
+            from snapping import main as snap_vertices
+            snap_vertices(OUT_DIR)
+        except Exception as e:
+            print(f"⚠️  Error: {e}")
+        
+        # 2.5 Distancias de red entre oficinas (sólo pares de oficinas nuevas o cambiadas)
+        print("\n📏 Actualizando distancias entre oficinas...")
+        print("-" * 70)
+        try:
+            from distancias_oficinas import main as distancias_oficinas
+            distancias_oficinas(OUT_DIR)
+        except Exception as e:
+            print(f"⚠️  Error: {e}")
+        
+        # 2.6 Penalización de aristas por amenazas activas (incremental)
+        print("\n🚧 Penalizando aristas cercanas a amenazas...")
+        print("-" * 70)
+        try:
+            from penalizacion_amenazas import main as penalizar
+            penalizar(OUT_DIR)
+        except Exception as e:
+            print(f"⚠️  Error: {e}")
+        
+        # 2.7 Perfiles temporales de amenazas (ventanas fecha_inicio/fecha_fin) para ruteo con hora de salida
+        print("\n🕐 Precalculando perfiles temporales de amenazas...")
+        print("-" * 70)
+        try:
+            from ruteo_temporal import main as perfiles_temporales
+            perfiles_temporales(OUT_DIR)
+        except Exception as e:
+            print(f"⚠️  Error: {e}")
+        
         # ═══════════════════════════════════════════════════════════
         # FASE 3: GENERACIÓN DE RUTA (PEOR CASO)
         # ═══════════════════════════════════════════════════════════
         
         print_header("FASE 3: GENERACIÓN DE RUTA - pgr_dijkstra")
         
+        print("\n🔀 Precalculando rutas alternativas entre oficinas...")
+        print("-" * 70)
+        try:
+            from alternativas_rutas import main as precalcular_alternativas
+            precalcular_alternativas(OUT_DIR)
+        except Exception as e:
+            print(f"⚠️  Error: {e}")
+        
         print("\n🗺️  Generando ruta de ejemplo (peor caso)...")
         print("-" * 70)
         try:
@@ -314,6 +377,38 @@ def ejecutar_etl():
         except Exception as e:
             print(f"⚠️  Error: {e}")
         
+        print("\n🧭 Planificando trámite (elección de oficinas por paso)...")
+        print("-" * 70)
+        try:
+            from planificador_tramite import main as planificar_tramite
+            planificar_tramite(OUT_DIR)
+        except Exception as e:
+            print(f"⚠️  Error: {e}")
+        
+        print("\n⏱️  Calculando isócronas de caminata por oficina...")
+        print("-" * 70)
+        try:
+            from isocronas import main as calcular_isocronas
+            calcular_isocronas(OUT_DIR)
+        except Exception as e:
+            print(f"⚠️  Error: {e}")
+        
+        print("\n🕸️  Midiendo criticidad de aristas (demanda oficina→oficina)...")
+        print("-" * 70)
+        try:
+            from criticidad_aristas import main as medir_criticidad
+            medir_criticidad(OUT_DIR)
+        except Exception as e:
+            print(f"⚠️  Error: {e}")
+        
+        print("\n🎲 Simulando fallas de red por amenazas (Monte Carlo)...")
+        print("-" * 70)
+        try:
+            from simulacion_fallas import main as simular_fallas
+            simular_fallas(OUT_DIR)
+        except Exception as e:
+            print(f"⚠️  Error: {e}")
+        
         # ═══════════════════════════════════════════════════════════
         # RESUMEN FINAL
         # ═══════════════════════════════════════════════════════════
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Ruteo por lotes para planificación de capacidad.
+Para cada origen (ciudadano sintético o leído de archivo/tabla) y cada trámite
+del catálogo, planifica la ruta con planificador_tramite y la guarda en
+rutas_calculadas.
+
+- El grafo, el catálogo y las oficinas se cargan UNA vez en el proceso padre y
+  los workers los heredan por fork (copy-on-write; gc.freeze evita que el
+  recolector toque esas páginas y las copie).
+- Los resultados se escriben en la BD a medida que llegan, en lotes de
+  execute_values, sin acumular todo en memoria.
+
+Uso:
+    python ruteo_lote.py --sinteticos 5000
+    python ruteo_lote.py --archivo origenes.csv        (columnas lat,lon[,id])
+    python ruteo_lote.py --tabla ciudadanos             (columnas id, lat, lon)
+"""
+import argparse
+import csv
+import gc
+import json
+import multiprocessing as mp
+import os
+import random
+import time
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from cache_rutas import ensure_cache
+from etl_ruta_dijkstra import CONSIDERA_AMENAZAS
+from grafo_ruteo import SQL_ARISTAS, cargar_grafo
+from loader_infraestructura import asegurar_componentes
+from penalizacion_amenazas import SQL_ARISTAS_PENALIZADAS
+from planificador_tramite import cargar_oficinas, cargar_tramite, planificar
+from snapping import SnapperVertices
+
+PROCESOS = int(os.getenv("LOTE_PROCESOS", str(os.cpu_count() or 1)))
+TAMANO_LOTE = 500       # filas por INSERT
+ORIGENES_POR_TAREA = 25  # orígenes que procesa un worker por tarea
+# Gran Santiago, para ciudadanos sintéticos (lat_min, lat_max, lon_min, lon_max)
+BBOX_SINTETICOS = (-33.55, -33.38, -70.75, -70.55)
+
+# Estado compartido con los workers (se asigna antes del fork)
+_GRAFO = None
+_TRAMITES = None
+_OFICINAS = None
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def origenes_sinteticos(n, semilla=42):
+    rnd = random.Random(semilla)
+    return [(i, rnd.uniform(BBOX_SINTETICOS[0], BBOX_SINTETICOS[1]), rnd.uniform(BBOX_SINTETICOS[2], BBOX_SINTETICOS[3]))
+            for i in range(1, n + 1)]
+
+
+def origenes_archivo(ruta):
+    """CSV con columnas lat, lon e id opcional."""
+    with open(ruta, newline="", encoding="utf-8") as f:
+        return [(int(fila.get("id") or i), float(fila["lat"]), float(fila["lon"]))
+                for i, fila in enumerate(csv.DictReader(f), start=1)]
+
+
+def origenes_tabla(conn, tabla):
+    cur = conn.cursor()
+    cur.execute(sql.SQL("SELECT id, lat, lon FROM {} WHERE lat IS NOT NULL AND lon IS NOT NULL ORDER BY id;")
+                .format(sql.Identifier(tabla)))
+    filas = [(int(i), float(lat), float(lon)) for i, lat, lon in cur.fetchall()]
+    cur.close()
+    return filas
+
+
+def _rutear(tarea):
+    """Worker: planifica todos los trámites para un grupo de orígenes ya ajustados a la red."""
+    resultados, fallidos = [], 0
+    for origen_id, lat, lon, vertex_id in tarea:
+        for tramite_id, (nombre, pasos) in _TRAMITES.items():
+            try:
+                plan = planificar(_GRAFO, vertex_id, pasos, _OFICINAS)
+            except ValueError:
+                fallidos += 1
+                continue
+            ultima = plan["oficinas"][-1]
+            resultados.append((origen_id, tramite_id, lat, lon, vertex_id, ultima["lat"], ultima["lon"],
+                               [f["edge"] for t in plan["tramos"] for f in t],
+                               plan["distancia_m"], round(plan["total_min"]), plan["costo_red"],
+                               [o["id"] for o in plan["oficinas"]]))
+    return resultados, fallidos
+
+
+def guardar(cur, filas, lote, amenazas):
+    execute_values(cur, """
+        INSERT INTO rutas_calculadas (tramite_id, origen_lat, origen_lon, destino_lat, destino_lon, algoritmo,
+                                      geom, distancia_m, tiempo_estimado_min, costo_total, considera_amenazas,
+                                      edge_ids, parametros)
+        SELECT v.tramite_id, v.olat, v.olon, v.dlat, v.dlon, 'planificador multi-fuente (lote)',
+               linea_ruta(v.edge_ids, v.overtex), v.distancia, v.minutos, v.costo, v.amenazas, v.edge_ids, v.parametros
+        FROM (VALUES %s) AS v(tramite_id, olat, olon, overtex, dlat, dlon, edge_ids, distancia, minutos, costo, amenazas, parametros);
+    """, [(tid, olat, olon, overtex, dlat, dlon, edges, dist, minutos, costo, amenazas,
+           json.dumps({"lote": lote, "origen_id": oid, "oficinas": oficinas}))
+          for oid, tid, olat, olon, overtex, dlat, dlon, edges, dist, minutos, costo, oficinas in filas],
+        template="(%s, %s, %s, %s::bigint, %s, %s, %s::bigint[], %s, %s, %s, %s, %s::jsonb)", page_size=TAMANO_LOTE)
+
+
+def main(origenes, procesos=PROCESOS, amenazas=CONSIDERA_AMENAZAS):
+    global _GRAFO, _TRAMITES, _OFICINAS
+    lote = time.strftime("lote-%Y%m%d-%H%M%S")
+    print(f"🏭 RUTEO POR LOTES ({lote}): {len(origenes):,} orígenes, {procesos} procesos")
+    conn = get_conn()
+    cur = conn.cursor()
+    asegurar_componentes(conn)
+    ensure_cache(cur)
+    conn.commit()
+
+    cur.execute("SELECT id, nombre FROM tramites ORDER BY id;")
+    _TRAMITES = {tid: cargar_tramite(conn, nombre) for tid, nombre in cur.fetchall()}
+    snapper = SnapperVertices.desde_bd(conn)
+    _OFICINAS = cargar_oficinas(conn, {p["oficina_tipo"] for _, pasos in _TRAMITES.values() for p in pasos}, snapper)
+    _GRAFO = cargar_grafo(conn, sql_aristas=SQL_ARISTAS_PENALIZADAS if amenazas else SQL_ARISTAS, con_coordenadas=False)
+    print(f"   Trámites: {', '.join(n for n, _ in _TRAMITES.values())}")
+
+    # Snapping de todos los orígenes en una llamada vectorizada
+    vertices, _ = snapper.snap([o[1] for o in origenes], [o[2] for o in origenes])
+    ajustados = [(oid, lat, lon, int(v)) for (oid, lat, lon), v in zip(origenes, vertices)]
+    tareas = [ajustados[i:i + ORIGENES_POR_TAREA] for i in range(0, len(ajustados), ORIGENES_POR_TAREA)]
+
+    # Lo cargado hasta aquí no cambia: fuera del GC para que los workers no copien sus páginas
+    gc.freeze()
+    t0 = time.perf_counter()
+    pendientes, guardadas, fallidas = [], 0, 0
+    with mp.get_context("fork").Pool(max(1, procesos)) as pool:
+        for resultados, n_fallidos in pool.imap_unordered(_rutear, tareas):
+            pendientes.extend(resultados)
+            fallidas += n_fallidos
+            if len(pendientes) >= TAMANO_LOTE:
+                guardar(cur, pendientes, lote, amenazas)
+                conn.commit()
+                guardadas += len(pendientes)
+                pendientes = []
+                print(f"   … {guardadas:,} rutas guardadas ({guardadas / (time.perf_counter() - t0):,.0f} rutas/s)")
+    if pendientes:
+        guardar(cur, pendientes, lote, amenazas)
+        conn.commit()
+        guardadas += len(pendientes)
+    duracion = time.perf_counter() - t0
+    gc.unfreeze()
+    _GRAFO = _TRAMITES = _OFICINAS = None
+
+    cur.close()
+    conn.close()
+    print(f"✅ {guardadas:,} rutas en {duracion:.1f}s ({guardadas / duracion:,.1f} rutas/s con {procesos} procesos)")
+    if fallidas:
+        print(f"   ⚠️  {fallidas:,} combinaciones origen/trámite sin oficinas alcanzables")
+    return {"lote": lote, "rutas": guardadas, "fallidas": fallidas, "segundos": duracion}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ruteo por lotes de orígenes × trámites")
+    fuente = parser.add_mutually_exclusive_group()
+    fuente.add_argument("--archivo", help="CSV con columnas lat,lon[,id]")
+    fuente.add_argument("--tabla", help="tabla con columnas id, lat, lon")
+    fuente.add_argument("--sinteticos", type=int, default=1000, help="cantidad de ciudadanos sintéticos")
+    parser.add_argument("--procesos", type=int, default=PROCESOS)
+    args = parser.parse_args()
+    if args.archivo:
+        origenes = origenes_archivo(args.archivo)
+    elif args.tabla:
+        c = get_conn()
+        origenes = origenes_tabla(c, args.tabla)
+        c.close()
+    else:
+        origenes = origenes_sinteticos(args.sinteticos)
+    main(origenes, procesos=args.procesos)
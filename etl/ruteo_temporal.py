@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Ruteo dependiente del tiempo (hora de salida).
+
+- Amenazas: cada amenaza activa penaliza las aristas de su radio sólo entre
+  fecha_inicio y fecha_fin (NULL = sin término conocido). actualizar_perfiles
+  precalcula, por arista, el perfil escalonado (intervalos con multiplicador o
+  bloqueo, como red_vial_penalizacion) en red_vial_penalizacion_temporal.
+  PerfilTemporal lo deja por arco en memoria y GrafoRuteo.buscar_temporal
+  evalúa cada arco en el instante en que se entra a él: los arcos sin amenazas
+  cuestan lo mismo que en la búsqueda estática y los demás una búsqueda binaria
+  sobre sus pocos cortes, así que una consulta con hora de salida cuesta casi
+  lo mismo que una estática.
+- Oficinas: los horarios de la metadata (horario_semana / horario_sabado de
+  notarías, horario de SII, horario_atencion de ChileAtiende) se guardan como
+  ventanas en oficinas.horario_ventanas. Llegar antes de abrir o en la pausa de
+  almuerzo es esperar; llegar después del último cierre del día es infactible.
+  Si la atención empieza dentro de horario_peak, el trámite tarda FACTOR_PEAK veces más.
+
+El tiempo se mide en minutos desde PerfilTemporal.origen (la hora de salida);
+un costo de red c equivale a c / VELOCIDAD_M_MIN minutos de caminata.
+"""
+import os
+import re
+from datetime import datetime, timedelta
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from penalizacion_amenazas import MULTIPLICADOR_SEVERIDAD, RADIO_DEFECTO_M, SEVERIDAD_BLOQUEO
+
+VELOCIDAD_M_MIN = 83.33  # caminata, como en etl_ruta_dijkstra
+FACTOR_PEAK = float(os.getenv("PLAN_FACTOR_PEAK", "1.5"))
+RE_RANGO = re.compile(r"(\d{1,2})[:.](\d{2})\s*-\s*(\d{1,2})[:.](\d{2})")
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def ensure_tabla(cur):
+    """Tabla red_vial_penalizacion_temporal (ver 00_schema_completo.sql)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS red_vial_penalizacion_temporal (
+          edge_id BIGINT REFERENCES red_vial(id) ON DELETE CASCADE,
+          desde TIMESTAMP NOT NULL,
+          hasta TIMESTAMP,
+          multiplicador DOUBLE PRECISION NOT NULL DEFAULT 1,
+          bloqueado BOOLEAN NOT NULL DEFAULT false,
+          amenaza_ids INTEGER[] NOT NULL,
+          PRIMARY KEY (edge_id, desde)
+        );
+        CREATE INDEX IF NOT EXISTS red_vial_geom_utm_idx ON red_vial USING GIST(geom_utm);
+        CREATE INDEX IF NOT EXISTS amenazas_geog_idx ON amenazas USING GIST((geom::geography));
+    """)
+
+
+# ----------------------------------------------------------------------
+# Perfiles de amenazas por arista
+# ----------------------------------------------------------------------
+def intervalos_arista(amenazas):
+    """
+    Perfil escalonado de una arista a partir de sus amenazas [(id, inicio, fin, severidad)]:
+    [(desde, hasta, multiplicador, bloqueado, ids)] sin solapes, uniendo tramos contiguos iguales.
+    """
+    cortes = sorted({a[1] for a in amenazas} | {a[2] for a in amenazas if a[2] is not None})
+    intervalos = []
+    for k, desde in enumerate(cortes):
+        hasta = cortes[k + 1] if k + 1 < len(cortes) else None
+        activas = [a for a in amenazas if a[1] <= desde and (a[2] is None or a[2] > desde)]
+        if not activas:
+            continue
+        severidades = [min(max(s, 1), 5) for _, _, _, s in activas]
+        estado = (max(MULTIPLICADOR_SEVERIDAD[s - 1] for s in severidades),
+                  any(s >= SEVERIDAD_BLOQUEO for s in severidades),
+                  sorted(a[0] for a in activas))
+        if intervalos and intervalos[-1][1] == desde and intervalos[-1][2:] == estado:
+            intervalos[-1] = (intervalos[-1][0], hasta) + estado
+        else:
+            intervalos.append((desde, hasta) + estado)
+    return intervalos
+
+
+def actualizar_perfiles(conn):
+    """
+    Reconstruye red_vial_penalizacion_temporal con las amenazas activas que aún
+    no terminaron (vigentes y programadas). Retorna dict con amenazas, aristas e intervalos.
+    """
+    cur = conn.cursor()
+    ensure_tabla(cur)
+    cur.execute("""
+        SELECT rv.id, a.id, a.fecha_inicio, a.fecha_fin, COALESCE(a.severidad, 3)
+        FROM amenazas a
+        JOIN red_vial rv ON ST_DWithin(rv.geom_utm, ST_Transform(a.geom, 32719), COALESCE(a.radio_afectacion_m, %s))
+        WHERE a.activo AND a.geom IS NOT NULL AND (a.fecha_fin IS NULL OR a.fecha_fin >= NOW());
+    """, (RADIO_DEFECTO_M,))
+    por_arista = {}
+    for edge_id, amenaza_id, inicio, fin, severidad in cur.fetchall():
+        por_arista.setdefault(edge_id, []).append((amenaza_id, inicio, fin, severidad))
+    filas = [(e,) + i for e, amenazas in por_arista.items() for i in intervalos_arista(amenazas)]
+    cur.execute("TRUNCATE red_vial_penalizacion_temporal;")
+    execute_values(cur, """
+        INSERT INTO red_vial_penalizacion_temporal (edge_id, desde, hasta, multiplicador, bloqueado, amenaza_ids)
+        VALUES %s;
+    """, filas, page_size=1000)
+    conn.commit()
+    cur.close()
+    return {"amenazas": len({a[0] for v in por_arista.values() for a in v}),
+            "aristas": len(por_arista), "intervalos": len(filas)}
+
+
+class PerfilTemporal:
+    """
+    Perfiles de amenazas por arco de un GrafoRuteo, listos para buscar_temporal.
+    arcos[a] = None (peso fijo) o (cortes, factores) en minutos desde `origen`:
+    factores[bisect_right(cortes, t)] es el multiplicador vigente en t (inf = bloqueado).
+    vertices[u] = True si algún arco que sale de u tiene perfil.
+    """
+
+    def __init__(self, grafo, intervalos, origen):
+        """intervalos: [(edge_id, desde, hasta, multiplicador, bloqueado)] ordenados por arista y desde."""
+        self.origen = origen
+        por_arista = {}
+        for edge_id, desde, hasta, mult, bloqueado in intervalos:
+            e = grafo.indice_arista(edge_id)
+            if e is None:
+                continue
+            cortes, factores = por_arista.setdefault(e, ([], [1.0]))
+            d = self.minutos(desde)
+            if cortes and cortes[-1] == d:
+                factores[-1] = np.inf if bloqueado else mult
+            else:
+                cortes.append(d)
+                factores.append(np.inf if bloqueado else mult)
+            if hasta is not None:
+                cortes.append(self.minutos(hasta))
+                factores.append(1.0)
+        self.arcos = [None] * len(grafo.arco_arista)
+        self.vertices = [False] * grafo.n_vertices
+        for a in np.flatnonzero(np.isin(grafo.arco_arista, list(por_arista))).tolist():
+            self.arcos[a] = por_arista[int(grafo.arco_arista[a])]
+            self.vertices[int(grafo.arco_origen[a])] = True
+        self.n_aristas = len(por_arista)
+
+    @classmethod
+    def desde_bd(cls, conn, grafo, origen):
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT edge_id, desde, hasta, multiplicador, bloqueado
+            FROM red_vial_penalizacion_temporal ORDER BY edge_id, desde;
+        """)
+        filas = cur.fetchall()
+        cur.close()
+        return cls(grafo, filas, origen)
+
+    def minutos(self, momento):
+        return (momento - self.origen).total_seconds() / 60.0
+
+    def momento(self, minutos):
+        return self.origen + timedelta(minutes=minutos)
+
+
+# ----------------------------------------------------------------------
+# Horarios de oficinas
+# ----------------------------------------------------------------------
+def ventanas_horario(texto):
+    """
+    [[apertura, cierre]] en minutos del día a partir de un texto de horario
+    ("Lunes a Viernes 09:00-14:00 y 15:00-17:30", "09:00-13:30", "Cerrado").
+    Rangos solapados o de distintos días de la semana se unen.
+    """
+    rangos = sorted([int(h1) * 60 + int(m1), int(h2) * 60 + int(m2)]
+                    for h1, m1, h2, m2 in RE_RANGO.findall(texto or ""))
+    ventanas = []
+    for a, c in rangos:
+        if c <= a:
+            continue
+        if ventanas and a <= ventanas[-1][1]:
+            ventanas[-1][1] = max(ventanas[-1][1], c)
+        else:
+            ventanas.append([a, c])
+    return ventanas
+
+
+def horario_oficina(datos):
+    """
+    {"semana", "sabado", "domingo", "peak"} como listas de ventanas a partir de
+    las propiedades de una oficina (formatos de etl_notarios, etl_sii y
+    etl_metadata_completa). None si no trae horario (se asume siempre abierta).
+    """
+    horario = datos.get("horario_atencion") or datos.get("horario")
+    if isinstance(horario, dict):
+        semana, sabado = horario.get("lunes_viernes"), horario.get("sabado")
+    else:
+        semana, sabado = datos.get("horario_semana") or horario, datos.get("horario_sabado")
+    if not semana:
+        return None
+    peak = datos.get("horario_peak") or (datos.get("estadisticas") or {}).get("horario_peak")
+    return {"semana": ventanas_horario(semana), "sabado": ventanas_horario(sabado),
+            "domingo": [], "peak": ventanas_horario(peak)}
+
+
+def inicio_atencion(horario, llegada, perfil):
+    """
+    (inicio, factor de duración) de la atención si se llega en `llegada`
+    (minutos desde perfil.origen); None si la oficina ya cerró ese día.
+    """
+    if not horario:
+        return llegada, 1.0
+    momento = perfil.momento(llegada)
+    dia = "semana" if momento.weekday() < 5 else ("sabado" if momento.weekday() == 5 else "domingo")
+    minuto = momento.hour * 60 + momento.minute + momento.second / 60.0
+    for apertura, cierre in horario[dia]:
+        if minuto < cierre:
+            inicio = max(minuto, apertura)
+            factor = FACTOR_PEAK if any(a <= inicio < c for a, c in horario["peak"]) else 1.0
+            return llegada + (inicio - minuto), factor
+    return None
+
+
+def hora_salida(texto):
+    """datetime desde ISO ("2025-03-10T09:30") u hora de hoy ("09:30")."""
+    if re.fullmatch(r"\d{1,2}:\d{2}", texto.strip()):
+        h, m = map(int, texto.split(":"))
+        return datetime.now().replace(hour=h, minute=m, second=0, microsecond=0)
+    return datetime.fromisoformat(texto.strip())
+
+
+def main(data_dir="/app/out"):
+    print("🕐 PERFILES TEMPORALES de amenazas → red_vial_penalizacion_temporal")
+    conn = get_conn()
+    r = actualizar_perfiles(conn)
+    print(f"✓ Amenazas vigentes o programadas: {r['amenazas']}")
+    print(f"✓ Aristas con perfil: {r['aristas']} ({r['intervalos']} intervalos)")
+    conn.close()
+    return r
+
+
+if __name__ == "__main__":
+    main()
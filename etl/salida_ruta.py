@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Formatos de salida de ruta_dijkstra.geojson (RUTEO_SALIDA):
+- "aristas":  un Feature por arista de red_vial con todas las propiedades (formato original).
+- "tramos":   un Feature por tramo con la geometría fusionada en PostGIS
+              (ST_LineMerge(ST_Collect(...)) sobre red_vial) y el detalle por calle
+              como arreglo compacto [calle, tipo_via, metros].
+- "polyline": como "tramos", pero la geometría va en properties.polylines como
+              encoded polyline (precisión 1e-5) y geometry es null; el mapa la decodifica.
+Los formatos compactos se escriben sin indentación.
+"""
+import json
+import time
+
+FORMATOS = ("aristas", "tramos", "polyline")
+# Features de ruta que se fusionan por tramo (paradas y líneas rectas quedan como están)
+TIPOS_RUTA = ("ruta_calculada", "ruta_alternativa")
+PRECISION_POLYLINE = 5
+
+
+def calles_compactas(props):
+    """[[calle, tipo_via, metros]] uniendo aristas consecutivas de la misma calle."""
+    calles = []
+    for p in props:
+        if calles and calles[-1][0] == p.get("calle") and calles[-1][1] == p.get("tipo_via"):
+            calles[-1][2] += p.get("distancia_m") or 0
+        else:
+            calles.append([p.get("calle"), p.get("tipo_via"), p.get("distancia_m") or 0])
+    for c in calles:
+        c[2] = round(c[2], 1)
+    return calles
+
+
+def codificar_polyline(coords, precision=PRECISION_POLYLINE):
+    """Encoded polyline (algoritmo de Google) de [[lon, lat], ...]."""
+    factor = 10 ** precision
+    salida, prev_lat, prev_lon = [], 0, 0
+    for lon, lat in coords:
+        lat_i, lon_i = round(lat * factor), round(lon * factor)
+        for delta in (lat_i - prev_lat, lon_i - prev_lon):
+            v = ~(delta << 1) if delta < 0 else delta << 1
+            while v >= 0x20:
+                salida.append(chr((0x20 | (v & 0x1f)) + 63))
+                v >>= 5
+            salida.append(chr(v + 63))
+        prev_lat, prev_lon = lat_i, lon_i
+    return "".join(salida)
+
+
+def decodificar_polyline(texto, precision=PRECISION_POLYLINE):
+    """Inverso de codificar_polyline → [[lon, lat], ...] (para verificar y medir)."""
+    factor = 10 ** precision
+    coords, i, lat, lon = [], 0, 0, 0
+    while i < len(texto):
+        valores = []
+        for _ in range(2):
+            resultado, corrimiento = 0, 0
+            while True:
+                b = ord(texto[i]) - 63
+                i += 1
+                resultado |= (b & 0x1f) << corrimiento
+                corrimiento += 5
+                if b < 0x20:
+                    break
+            valores.append(~(resultado >> 1) if resultado & 1 else resultado >> 1)
+        lat += valores[0]
+        lon += valores[1]
+        coords.append([lon / factor, lat / factor])
+    return coords
+
+
+def geometrias_fusionadas(conn, tramos):
+    """
+    {clave: geometría GeoJSON} con las aristas de cada tramo fusionadas en PostGIS
+    (una sola consulta para todos los tramos). tramos: {clave: [edge_id, ...] en orden}.
+    """
+    claves = list(tramos)
+    if not claves:
+        return {}
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT t.k, ST_AsGeoJSON(ST_LineMerge(ST_Collect(rv.geom ORDER BY t.ord)), 6)
+        FROM unnest(%s::int[], %s::bigint[], %s::int[]) AS t(k, edge, ord)
+        JOIN red_vial rv ON rv.id = t.edge
+        GROUP BY t.k;
+    """, ([k for k, c in enumerate(claves) for _ in tramos[c]],
+          [e for c in claves for e in tramos[c]],
+          [o for c in claves for o in range(len(tramos[c]))]))
+    resultado = {claves[k]: json.loads(g) for k, g in cur.fetchall() if g}
+    cur.close()
+    return resultado
+
+
+def compactar_ruta(conn, features, formato="tramos"):
+    """Features de salida en el formato pedido a partir de los Features por arista."""
+    if formato == "aristas":
+        return features
+    grupos, otros = {}, []
+    for f in features:
+        p = f["properties"]
+        if p.get("tipo") in TIPOS_RUTA and p.get("edge") is not None:
+            grupos.setdefault((p["segmento"], p["tipo"]), []).append(p)
+        else:
+            otros.append(f)
+    for props in grupos.values():
+        props.sort(key=lambda p: p.get("secuencia") or 0)
+    geometrias = geometrias_fusionadas(conn, {clave: [p["edge"] for p in props] for clave, props in grupos.items()})
+
+    tramos = []
+    for (segmento, tipo), props in sorted(grupos.items()):
+        geom = geometrias.get((segmento, tipo))
+        if geom is None:
+            continue
+        p0 = props[0]
+        propiedades = {"tipo": tipo, "segmento": segmento, "origen": p0.get("origen"), "destino": p0.get("destino"),
+                       "distancia_m": round(sum(p.get("distancia_m") or 0 for p in props), 1), "n_aristas": len(props),
+                       "calles": calles_compactas(props)}
+        if tipo == "ruta_alternativa":
+            propiedades.update(alternativa=p0.get("alternativa"), toca_amenazas=p0.get("toca_amenazas"))
+        if formato == "polyline":
+            partes = [geom["coordinates"]] if geom["type"] == "LineString" else geom["coordinates"]
+            propiedades["polylines"] = [codificar_polyline(c) for c in partes]
+            geom = None
+        tramos.append({"type": "Feature", "geometry": geom, "properties": propiedades})
+    return tramos + otros
+
+
+def serializar(geojson, formato="tramos"):
+    """Texto del archivo: el formato original conserva indent=2, los compactos van sin espacios."""
+    if formato == "aristas":
+        return json.dumps(geojson, ensure_ascii=False, indent=2)
+    return json.dumps(geojson, ensure_ascii=False, separators=(",", ":"))
+
+
+def medir(texto, repeticiones=20):
+    """(bytes UTF-8, ms medianos de json.loads + decodificar polylines) del archivo serializado."""
+    tiempos = []
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        datos = json.loads(texto)
+        for f in datos["features"]:
+            for linea in f["properties"].get("polylines", ()):
+                decodificar_polyline(linea)
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    return len(texto.encode("utf-8")), sorted(tiempos)[len(tiempos) // 2]
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Servicio HTTP de rutas (asyncio, sólo biblioteca estándar + psycopg2).
+Mantiene caliente el grafo en memoria, el índice de snapping, el catálogo de
+trámites/oficinas y un pool de conexiones a PostgreSQL, y atiende consultas
+concurrentes sin abrir una conexión nueva por request.
+
+Endpoints:
+    GET /route?tramite=<nombre>&lat=<lat>&lon=<lon>   plan del trámite (GeoJSON)
+    GET /stats                                        contadores y versiones
+    GET /health
+
+El cálculo (Dijkstra en Python, consultas de geometría) corre en un pool de
+hilos para no bloquear el event loop. Si cambia la versión de topología o de
+amenazas (ver cache_rutas.versiones) se recarga el grafo en segundo plano.
+
+Uso: python servicio_rutas.py   (puerto SERVICIO_PUERTO, por defecto 8090)
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
+
+from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+
+from cache_rutas import LRU, versiones
+from etl_ruta_dijkstra import CONSIDERA_AMENAZAS
+from grafo_ruteo import SQL_ARISTAS, cargar_grafo
+from loader_infraestructura import asegurar_componentes
+from penalizacion_amenazas import SQL_ARISTAS_PENALIZADAS
+from planificador_tramite import cargar_oficinas, cargar_tramite, plan_a_geojson, planificar
+from snapping import SnapperVertices
+
+HOST = os.getenv("SERVICIO_HOST", "0.0.0.0")
+PUERTO = int(os.getenv("SERVICIO_PUERTO", "8090"))
+POOL_MIN = int(os.getenv("SERVICIO_POOL_MIN", "2"))
+POOL_MAX = int(os.getenv("SERVICIO_POOL_MAX", "8"))
+# Cada cuántos segundos se revisa si la red o las amenazas cambiaron
+INTERVALO_VERSIONES_S = float(os.getenv("SERVICIO_INTERVALO_VERSIONES", "30"))
+
+class TramiteDesconocido(LookupError):
+    """El trámite pedido no está en el catálogo cargado (404; cualquier otro error es 500)."""
+
+
+RAZONES = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           422: "Unprocessable Entity", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def con_origen(geojson, lat, lon):
+    """
+    Plan memorizado con el origen de este request: la clave es el vértice ajustado,
+    pero el punto y metadata.origen deben ser los de quien consulta (copia superficial).
+    """
+    features = [dict(f, geometry={"type": "Point", "coordinates": [lon, lat]})
+                if f["properties"].get("tipo") == "origen" else f for f in geojson["features"]]
+    return dict(geojson, features=features, metadata=dict(geojson["metadata"], origen={"lat": lat, "lon": lon}))
+
+
+class ServicioRutas:
+    """Estado caliente del servicio: pool de conexiones, grafo, snapper y catálogo."""
+
+    def __init__(self, amenazas=CONSIDERA_AMENAZAS, pool_min=POOL_MIN, pool_max=POOL_MAX):
+        self.amenazas = amenazas
+        self.pool = ThreadedConnectionPool(
+            pool_min, pool_max,
+            host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+            dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+            user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+        )
+        self._iniciar_estado(pool_max)
+
+    def _iniciar_estado(self, hilos):
+        """Ejecutor, memo de planes y contadores (el grafo y el catálogo los pone cargar)."""
+        self.ejecutor = ThreadPoolExecutor(max_workers=hilos)
+        self.planes = LRU(capacidad=2048)
+        # El LRU (OrderedDict) se toca desde varios hilos del ejecutor: get también reordena
+        self.cerrojo_planes = threading.Lock()
+        self.contadores = {"requests": 0, "rutas": 0, "hits_plan": 0, "errores": 0}
+        self.versiones = None
+
+    @contextmanager
+    def conexion(self):
+        conn = self.pool.getconn()
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+            self.pool.putconn(conn)
+
+    def cargar(self):
+        """Lee red, índice de snapping y catálogo (se llama al iniciar y al cambiar versiones)."""
+        with self.conexion() as conn:
+            asegurar_componentes(conn)
+            cur = conn.cursor()
+            nuevas = versiones(cur)
+            cur.execute("SELECT nombre FROM tramites ORDER BY id;")
+            nombres = [r[0] for r in cur.fetchall()]
+            conn.commit()
+            cur.close()
+            grafo = cargar_grafo(conn, sql_aristas=SQL_ARISTAS_PENALIZADAS if self.amenazas else SQL_ARISTAS)
+            snapper = SnapperVertices.desde_bd(conn)
+            tramites = {}
+            for n in nombres:
+                # Un trámite mal configurado (sin pasos) no debe impedir levantar el servicio
+                try:
+                    nombre, pasos = cargar_tramite(conn, n)
+                except ValueError as e:
+                    print(f"   ⚠️  Trámite omitido: {e}")
+                    continue
+                tramites[nombre] = pasos
+            tipos = {p["oficina_tipo"] for pasos in tramites.values() for p in pasos}
+            oficinas = cargar_oficinas(conn, tipos, snapper)
+        # Reemplazo atómico: los requests en curso terminan con el estado anterior
+        self.grafo, self.snapper, self.tramites, self.oficinas = grafo, snapper, tramites, oficinas
+        self.versiones = nuevas
+        with self.cerrojo_planes:
+            self.planes.clear()
+        print(f"   ✓ Servicio listo: {len(tramites)} trámites, {sum(len(v) for v in oficinas.values())} oficinas,"
+              f" topología v{nuevas[0]}, amenazas v{nuevas[1]}")
+
+    def versiones_cambiaron(self):
+        with self.conexion() as conn:
+            cur = conn.cursor()
+            actuales = versiones(cur)
+            conn.commit()
+            cur.close()
+        return actuales != self.versiones
+
+    def calcular(self, tramite, lat, lon):
+        """Plan del trámite desde (lat, lon) como GeoJSON (síncrono, corre en el pool de hilos)."""
+        pasos = self.tramites.get(tramite)
+        if pasos is None:
+            raise TramiteDesconocido(tramite)
+        origen = self.snapper.snap_uno(lat, lon)
+        clave = (tramite, origen["id"])
+        with self.cerrojo_planes:
+            geojson = self.planes.get(clave)
+            if geojson is not None:
+                self.contadores["hits_plan"] += 1
+        if geojson is not None:
+            return con_origen(geojson, lat, lon)
+        plan = planificar(self.grafo, origen["id"], pasos, self.oficinas)
+        geojson = self.armar_geojson(plan, pasos, lat, lon, tramite)
+        with self.cerrojo_planes:
+            self.planes.put(clave, geojson)
+        return geojson
+
+    def armar_geojson(self, plan, pasos, lat, lon, tramite):
+        """GeoJSON del plan con la geometría de las aristas (una consulta con una conexión del pool)."""
+        with self.conexion() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            geojson = plan_a_geojson(cur, plan, pasos, (lat, lon), tramite)
+            cur.close()
+        return geojson
+
+    async def despachar(self, metodo, destino):
+        """(estado HTTP, cuerpo JSON) para un request."""
+        if metodo != "GET":
+            return 405, {"error": "sólo GET"}
+        url = urlsplit(destino)
+        if url.path == "/health":
+            return 200, {"estado": "ok"}
+        if url.path == "/stats":
+            return 200, dict(self.contadores, planes_en_cache=len(self.planes),
+                             version_topologia=self.versiones[0], version_amenazas=self.versiones[1])
+        if url.path != "/route":
+            return 404, {"error": f"ruta desconocida: {url.path}"}
+
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        try:
+            tramite, lat, lon = q["tramite"], float(q["lat"]), float(q["lon"])
+        except (KeyError, ValueError):
+            return 400, {"error": "parámetros requeridos: tramite, lat, lon"}
+        loop = asyncio.get_running_loop()
+        try:
+            geojson = await loop.run_in_executor(self.ejecutor, self.calcular, tramite, lat, lon)
+        except TramiteDesconocido:
+            return 404, {"error": f"trámite desconocido: {tramite}", "tramites": sorted(self.tramites)}
+        except ValueError as e:
+            return 422, {"error": str(e)}
+        self.contadores["rutas"] += 1
+        return 200, geojson
+
+    async def atender(self, reader, writer):
+        """Conexión HTTP/1.1 con keep-alive."""
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                try:
+                    metodo, destino, _ = linea.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    break
+                cabeceras = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    cabeceras[k.strip().lower()] = v.strip()
+
+                self.contadores["requests"] += 1
+                try:
+                    estado, cuerpo = await self.despachar(metodo, destino)
+                except Exception as e:
+                    self.contadores["errores"] += 1
+                    estado, cuerpo = 500, {"error": str(e)}
+                datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+                mantener = cabeceras.get("connection", "").lower() != "close"
+                writer.write((f"HTTP/1.1 {estado} {RAZONES[estado]}\r\n"
+                              f"Content-Type: application/json; charset=utf-8\r\n"
+                              f"Content-Length: {len(datos)}\r\n"
+                              f"Connection: {'keep-alive' if mantener else 'close'}\r\n\r\n").encode("latin-1") + datos)
+                await writer.drain()
+                if not mantener:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def vigilar_versiones(self):
+        """Recarga el grafo en segundo plano si se reconstruyó la topología o cambiaron amenazas."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(INTERVALO_VERSIONES_S)
+            try:
+                if await loop.run_in_executor(self.ejecutor, self.versiones_cambiaron):
+                    print("🔄 Red o amenazas cambiaron: recargando grafo")
+                    await loop.run_in_executor(self.ejecutor, self.cargar)
+            except Exception as e:
+                print(f"⚠️  Error revisando versiones: {e}")
+
+
+async def servir(host=HOST, puerto=PUERTO):
+    print("🛰️  SERVICIO DE RUTAS (asyncio)")
+    servicio = ServicioRutas()
+    await asyncio.get_running_loop().run_in_executor(servicio.ejecutor, servicio.cargar)
+    servidor = await asyncio.start_server(servicio.atender, host, puerto)
+    vigia = asyncio.create_task(servicio.vigilar_versiones())
+    print(f"✅ Escuchando en http://{host}:{puerto} (pool {POOL_MIN}-{POOL_MAX} conexiones)")
+    try:
+        async with servidor:
+            await servidor.serve_forever()
+    finally:
+        vigia.cancel()
+        servicio.ejecutor.shutdown(wait=False)
+        servicio.pool.closeall()
+
+
+def main():
+    t0 = time.perf_counter()
+    try:
+        asyncio.run(servir())
+    except KeyboardInterrupt:
+        print(f"\n👋 Servicio detenido tras {time.perf_counter() - t0:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
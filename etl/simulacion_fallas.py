@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Simulación Monte Carlo de fallas de red por amenazas.
+En cada escenario cada arista dentro del radio de alguna amenaza (vista
+v_amenazas_activas: activas y vigentes) cae con una probabilidad según la severidad más alta
+que la alcanza; luego se mide, entre todas las oficinas activas, qué pares
+siguen conectados y cuánto se alarga el viaje respecto de la red intacta.
+
+- Un solo grafo compartido por fork; cada worker aplica la máscara del
+  escenario sobre su arreglo de pesos (peso infinito = arista caída) y la
+  revierte al terminar, sin copiar la red por escenario.
+- Sólo se vuelven a buscar los orígenes cuyo árbol de caminos mínimos hacia
+  oficinas pierde alguna arista: quitar aristas nunca acorta un camino.
+- Resumen por comuna de la oficina de origen en simulacion_fallas_comunas
+  (alcanzabilidad media y p05, inflación media y p95, probabilidad de quedar
+  con algún par desconectado).
+"""
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from cache_rutas import versiones
+from grafo_ruteo import INF, SQL_ARISTAS, cargar_grafo
+from loader_infraestructura import asegurar_componentes
+from penalizacion_amenazas import RADIO_DEFECTO_M
+
+# Probabilidad de que una arista al alcance caiga, por severidad 1..5
+PROB_SEVERIDAD = [0.05, 0.15, 0.30, 0.60, 0.90]
+# Histograma de inflación por viaje: clases geométricas de ~0,6% entre 1x y 100x (lo que excede cae en la última)
+BORDES_INFLACION = np.geomspace(1.0, 100.0, 801)
+ESCENARIOS = int(os.getenv("SIMULACION_ESCENARIOS", "200"))
+PROCESOS = int(os.getenv("SIMULACION_PROCESOS", str(os.cpu_count() or 1)))
+SEMILLA = 42
+
+# Estado compartido con los workers (se asigna antes del fork)
+_GRAFO = None
+_ORIGENES = None        # índices de vértice de origen (uno por vértice de oficina)
+_DESTINOS = None        # índice de vértice de cada oficina
+_DESTINOS_SET = None
+_FILA_OFICINA = None    # fila de _BASE que corresponde a cada oficina
+_COMUNA = None          # índice de comuna de cada oficina
+_N_COMUNAS = 0
+_BASE = None            # distancias intactas (n_origenes × n_oficinas)
+_ARISTAS_ARBOL = None   # por origen: aristas de sus caminos mínimos hacia oficinas
+_AMENAZADAS = None      # (índices de arista, probabilidad)
+_ARCOS_ARISTA = None    # índice de arista -> arcos del CSR
+_ARCO_ORIGEN = None     # arco_origen / arco_arista como listas (más rápidas en el bucle)
+_ARCO_ARISTA = None
+_PESOS = None           # pesos de trabajo del worker (se enmascaran por escenario)
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def ensure_tablas(cur):
+    """Tablas simulaciones_fallas / simulacion_fallas_comunas (ver 00_schema_completo.sql)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS simulaciones_fallas (
+          id SERIAL PRIMARY KEY,
+          escenarios INTEGER NOT NULL,
+          semilla INTEGER,
+          amenazas INTEGER,
+          aristas_expuestas INTEGER,
+          aristas_caidas_media DOUBLE PRECISION,
+          version_topologia INTEGER,
+          parametros JSONB,
+          segundos DOUBLE PRECISION,
+          ejecutado TIMESTAMP DEFAULT NOW()
+        );
+        CREATE TABLE IF NOT EXISTS simulacion_fallas_comunas (
+          simulacion_id INTEGER REFERENCES simulaciones_fallas(id) ON DELETE CASCADE,
+          comuna TEXT NOT NULL,
+          oficinas INTEGER,
+          pares INTEGER,
+          alcanzabilidad_media DOUBLE PRECISION,
+          alcanzabilidad_p05 DOUBLE PRECISION,
+          inflacion_media DOUBLE PRECISION,
+          inflacion_p95 DOUBLE PRECISION,
+          prob_desconexion DOUBLE PRECISION,
+          PRIMARY KEY (simulacion_id, comuna)
+        );
+        CREATE OR REPLACE VIEW v_resiliencia_comunas AS
+        SELECT c.*, s.escenarios, s.ejecutado
+        FROM simulacion_fallas_comunas c
+        JOIN simulaciones_fallas s ON s.id = c.simulacion_id
+        WHERE s.id = (SELECT MAX(id) FROM simulaciones_fallas);
+    """)
+
+
+def aristas_expuestas(cur, grafo):
+    """(índices de arista, probabilidad de caída) según la severidad máxima que alcanza cada arista."""
+    cur.execute("""
+        SELECT rv.id, MAX(a.severidad)
+        FROM v_amenazas_activas a
+        JOIN red_vial rv ON ST_DWithin(rv.geom_utm, ST_Transform(a.geom, 32719), COALESCE(a.radio_afectacion_m, %s))
+        WHERE a.geom IS NOT NULL AND a.severidad IS NOT NULL
+        GROUP BY rv.id;
+    """, (RADIO_DEFECTO_M,))
+    posicion = {int(e): i for i, e in enumerate(grafo.edge_id)}
+    filas = [(posicion[eid], PROB_SEVERIDAD[min(max(int(sev), 1), 5) - 1]) for eid, sev in cur.fetchall() if eid in posicion]
+    return np.array([e for e, _ in filas], dtype=np.int64), np.array([p for _, p in filas])
+
+
+def _distancias(s, pesos=None):
+    """Worker: distancias de s a cada oficina y (con la red intacta) aristas de esos caminos mínimos."""
+    dist, pred, _ = _GRAFO.buscar([(s, 0.0)], destinos=_DESTINOS_SET, pesos=pesos)
+    fila = np.array([dist[t] for t in _DESTINOS])
+    if pesos is not None:
+        return fila, None
+    aristas, vistos = set(), set()
+    for t in _DESTINOS_SET:
+        if dist[t] == INF:
+            continue
+        v = t
+        while pred[v] != -1 and v not in vistos:
+            vistos.add(v)
+            aristas.add(_ARCO_ARISTA[pred[v]])
+            v = _ARCO_ORIGEN[pred[v]]
+    return fila, aristas
+
+
+def _base(k):
+    fila, aristas = _distancias(_ORIGENES[k])
+    return k, fila, aristas
+
+
+def _escenario(k):
+    """
+    Worker: un escenario → (aristas caídas, y por comuna: pares alcanzables, pares conectados en la red intacta,
+    suma de inflación, histograma de inflación por par sobre BORDES_INFLACION).
+    """
+    global _PESOS
+    if _PESOS is None:
+        _PESOS = _GRAFO.arco_peso.tolist()
+    rng = np.random.default_rng(SEMILLA + k)
+    aristas, prob = _AMENAZADAS
+    caidas = aristas[rng.random(len(aristas)) < prob]
+    arcos = [a for e in caidas for a in _ARCOS_ARISTA.get(int(e), ())]
+    for a in arcos:
+        _PESOS[a] = INF
+    try:
+        caidas_set = set(caidas.tolist())
+        dist = _BASE.copy()
+        for r, s in enumerate(_ORIGENES):
+            if _ARISTAS_ARBOL[r] & caidas_set:
+                dist[r], _ = _distancias(s, pesos=_PESOS)
+    finally:
+        base = _GRAFO.arco_peso
+        for a in arcos:
+            _PESOS[a] = float(base[a])
+
+    d0 = _BASE[_FILA_OFICINA]
+    d = dist[_FILA_OFICINA]
+    # Pares válidos: distinto vértice y conectados en la red intacta
+    validos = np.isfinite(d0) & (d0 > 0)
+    alcanzables = validos & np.isfinite(d)
+    inflacion = np.where(alcanzables, d / np.where(validos, d0, 1.0), 0.0)
+    n_clases = len(BORDES_INFLACION) - 1
+    clase = np.clip(np.searchsorted(BORDES_INFLACION, inflacion, side="right") - 1, 0, n_clases - 1)
+    celda = (_COMUNA[:, None] * n_clases + clase)[alcanzables]
+    histograma = np.bincount(celda, minlength=_N_COMUNAS * n_clases).reshape(_N_COMUNAS, n_clases)
+    return (len(caidas),
+            np.bincount(_COMUNA, weights=alcanzables.sum(axis=1), minlength=_N_COMUNAS),
+            np.bincount(_COMUNA, weights=validos.sum(axis=1), minlength=_N_COMUNAS),
+            np.bincount(_COMUNA, weights=inflacion.sum(axis=1), minlength=_N_COMUNAS),
+            histograma.astype(np.int32))
+
+
+def simular(grafo, oficinas, expuestas, escenarios=ESCENARIOS, procesos=PROCESOS):
+    """
+    oficinas: [(id, comuna, vertex_id)]; expuestas: salida de aristas_expuestas.
+    Retorna (comunas, oficinas en la red, resultados) con una tupla de _escenario por escenario.
+    """
+    global _GRAFO, _ORIGENES, _DESTINOS, _DESTINOS_SET, _FILA_OFICINA, _COMUNA, _N_COMUNAS, _BASE, _ARISTAS_ARBOL
+    global _AMENAZADAS, _ARCOS_ARISTA, _ARCO_ORIGEN, _ARCO_ARISTA
+    oficinas = [(oid, c, grafo.indice(v)) for oid, c, v in oficinas if grafo.indice(v) is not None]
+    comunas = sorted({c for _, c, _ in oficinas})
+    _GRAFO = grafo
+    _DESTINOS = [i for _, _, i in oficinas]
+    _DESTINOS_SET = set(_DESTINOS)
+    _ARCO_ORIGEN, _ARCO_ARISTA = grafo.arco_origen.tolist(), grafo.arco_arista.tolist()
+    _ORIGENES = sorted(set(_DESTINOS))
+    fila = {s: r for r, s in enumerate(_ORIGENES)}
+    _FILA_OFICINA = np.array([fila[i] for i in _DESTINOS])
+    _COMUNA = np.array([comunas.index(c) for _, c, _ in oficinas])
+    _N_COMUNAS = len(comunas)
+    try:
+        # Red intacta: una búsqueda por vértice de origen
+        _BASE = np.full((len(_ORIGENES), len(_DESTINOS)), INF)
+        _ARISTAS_ARBOL = [set()] * len(_ORIGENES)
+        with mp.get_context("fork").Pool(max(1, procesos)) as pool:
+            for k, distancias, aristas in pool.imap_unordered(_base, range(len(_ORIGENES)), chunksize=4):
+                _BASE[k] = distancias
+                _ARISTAS_ARBOL[k] = aristas
+
+        _AMENAZADAS = expuestas
+        _ARCOS_ARISTA = {}
+        for a, e in enumerate(_ARCO_ARISTA):
+            _ARCOS_ARISTA.setdefault(e, []).append(a)
+        # Nuevo pool: los workers deben heredar la línea base ya calculada
+        with mp.get_context("fork").Pool(max(1, procesos)) as pool:
+            resultados = list(pool.imap_unordered(_escenario, range(escenarios), chunksize=4))
+    finally:
+        _GRAFO = _BASE = _ARISTAS_ARBOL = _AMENAZADAS = _ARCOS_ARISTA = _ARCO_ORIGEN = _ARCO_ARISTA = None
+    return comunas, oficinas, resultados
+
+
+def _percentil_histograma(conteos, q):
+    """Percentil q (0-100) de un histograma sobre BORDES_INFLACION: borde superior de la clase que lo contiene."""
+    acumulado = np.cumsum(conteos)
+    if acumulado[-1] == 0:
+        return None
+    return float(BORDES_INFLACION[int(np.searchsorted(acumulado, acumulado[-1] * q / 100.0)) + 1])
+
+
+def resumir(comunas, oficinas, resultados):
+    """
+    Estadísticas por comuna sobre los escenarios. La alcanzabilidad se resume por escenario; la inflación
+    (media y p95) se calcula sobre todos los viajes alcanzables de todos los escenarios.
+    """
+    caidas = np.array([r[0] for r in resultados])
+    alc = np.array([r[1] for r in resultados])
+    val = np.array([r[2] for r in resultados])
+    infl = np.array([r[3] for r in resultados])
+    histograma = np.sum([r[4] for r in resultados], axis=0, dtype=np.int64)
+    resumen = []
+    for c, comuna in enumerate(comunas):
+        if val[0, c] == 0:
+            continue
+        frac = alc[:, c] / val[:, c]
+        resumen.append({
+            "comuna": comuna,
+            "oficinas": sum(1 for _, co, _ in oficinas if co == comuna),
+            "pares": int(val[0, c]),
+            "alcanzabilidad_media": float(frac.mean()),
+            "alcanzabilidad_p05": float(np.percentile(frac, 5)),
+            "inflacion_media": float(infl[:, c].sum() / alc[:, c].sum()) if alc[:, c].sum() > 0 else None,
+            "inflacion_p95": _percentil_histograma(histograma[c], 95),
+            "prob_desconexion": float((alc[:, c] < val[:, c]).mean()),
+        })
+    return float(caidas.mean()) if len(caidas) else 0.0, resumen
+
+
+def guardar(cur, parametros, resumen):
+    cur.execute("""
+        INSERT INTO simulaciones_fallas (escenarios, semilla, amenazas, aristas_expuestas, aristas_caidas_media,
+                                         version_topologia, parametros, segundos)
+        VALUES (%(escenarios)s, %(semilla)s, %(amenazas)s, %(aristas_expuestas)s, %(aristas_caidas_media)s,
+                %(version_topologia)s, %(json)s::jsonb, %(segundos)s)
+        RETURNING id;
+    """, dict(parametros, json=json.dumps({"prob_severidad": PROB_SEVERIDAD})))
+    sim_id = cur.fetchone()[0]
+    execute_values(cur, """
+        INSERT INTO simulacion_fallas_comunas (simulacion_id, comuna, oficinas, pares, alcanzabilidad_media,
+                                               alcanzabilidad_p05, inflacion_media, inflacion_p95, prob_desconexion)
+        VALUES %s;
+    """, [(sim_id, r["comuna"], r["oficinas"], r["pares"], r["alcanzabilidad_media"], r["alcanzabilidad_p05"],
+           r["inflacion_media"], r["inflacion_p95"], r["prob_desconexion"]) for r in resumen])
+    return sim_id
+
+
+def main(out_dir="/app/out", escenarios=ESCENARIOS, procesos=PROCESOS):
+    print(f"🎲 SIMULACIÓN DE FALLAS: {escenarios} escenarios, {procesos} procesos")
+    conn = get_conn()
+    cur = conn.cursor()
+    ensure_tablas(cur)
+    asegurar_componentes(conn)
+    version_topologia, _ = versiones(cur)
+    cur.execute("""
+        SELECT o.id, COALESCE(NULLIF(o.comuna, ''), 'Sin comuna'), v.id FROM oficinas o
+        CROSS JOIN LATERAL (
+            SELECT id FROM red_vial_vertices_pgr WHERE en_componente_principal
+            ORDER BY the_geom <-> o.geom LIMIT 1
+        ) v
+        WHERE o.activo AND o.geom IS NOT NULL;
+    """)
+    oficinas = cur.fetchall()
+    cur.execute("SELECT COUNT(*) FROM v_amenazas_activas WHERE geom IS NOT NULL;")
+    n_amenazas = cur.fetchone()[0]
+    conn.commit()
+    if len(oficinas) < 2:
+        print("   Menos de 2 oficinas activas: nada que simular")
+        cur.close()
+        conn.close()
+        return None
+
+    grafo = cargar_grafo(conn, sql_aristas=SQL_ARISTAS, con_coordenadas=False)
+    expuestas = aristas_expuestas(cur, grafo)
+    print(f"   {len(oficinas)} oficinas, {n_amenazas} amenazas, {len(expuestas[0])} aristas expuestas")
+    t0 = time.perf_counter()
+    comunas, oficinas, resultados = simular(grafo, oficinas, expuestas, escenarios, procesos)
+    segundos = time.perf_counter() - t0
+    caidas_media, resumen = resumir(comunas, oficinas, resultados)
+    sim_id = guardar(cur, {"escenarios": escenarios, "semilla": SEMILLA, "amenazas": n_amenazas,
+                           "aristas_expuestas": len(expuestas[0]), "aristas_caidas_media": caidas_media,
+                           "version_topologia": version_topologia, "segundos": segundos}, resumen)
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    print(f"✓ Simulación {sim_id}: {segundos:.1f}s, {caidas_media:.1f} aristas caídas por escenario en promedio")
+    for r in sorted(resumen, key=lambda r: r["alcanzabilidad_media"]):
+        infl = f"{r['inflacion_media']:.2f}x" if r["inflacion_media"] is not None else "-"
+        print(f"   • {r['comuna']:<20} alcanzable {r['alcanzabilidad_media']:.1%} (p05 {r['alcanzabilidad_p05']:.1%}),"
+              f" inflación {infl}, P(desconexión) {r['prob_desconexion']:.0%}")
+    return sim_id
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Snapping por lotes de coordenadas a vértices de la red vial.
+Construye un KD-tree en memoria con los vértices de red_vial_vertices_pgr
+(sólo componente principal) y ajusta arreglos completos de lat/lon en una
+sola llamada vectorizada, sin un round trip SQL por punto.
+También precalcula vertex_id para oficinas y amenazas.
+"""
+import os
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+from scipy.spatial import cKDTree
+
+from grafo_ruteo import haversine_np
+from loader_infraestructura import asegurar_componentes
+
+# Tablas con lat/lon a las que se les guarda el vértice más cercano
+TABLAS_SNAP = ("oficinas", "amenazas")
+
+
+def get_conn():
+    return psycopg2.connect(
+        host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+        dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+        user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres")
+    )
+
+
+def _a_cartesianas(lat, lon):
+    """lat/lon -> vectores unitarios 3D; la distancia de cuerda es monótona con la geodésica."""
+    phi = np.radians(np.asarray(lat, dtype=np.float64))
+    lmb = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_phi = np.cos(phi)
+    return np.column_stack([cos_phi * np.cos(lmb), cos_phi * np.sin(lmb), np.sin(phi)])
+
+
+class SnapperVertices:
+    """KD-tree sobre los vértices de la red (ids de pgRouting + coordenadas)."""
+
+    def __init__(self, vertex_ids, lats, lons):
+        self.vertex_id = np.asarray(vertex_ids, dtype=np.int64)
+        self.lat = np.asarray(lats, dtype=np.float64)
+        self.lon = np.asarray(lons, dtype=np.float64)
+        self._arbol = cKDTree(_a_cartesianas(self.lat, self.lon))
+
+    @classmethod
+    def desde_bd(cls, conn, solo_principal=True):
+        """Carga los vértices (por defecto sólo los de la componente principal)."""
+        if solo_principal:
+            asegurar_componentes(conn)
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT id, ST_Y(the_geom), ST_X(the_geom)
+            FROM red_vial_vertices_pgr
+            {"WHERE en_componente_principal" if solo_principal else ""};
+        """)
+        filas = cur.fetchall()
+        cur.close()
+        if not filas:
+            raise Exception("No hay vértices para construir el índice de snapping")
+        ids, lats, lons = zip(*filas)
+        return cls(ids, lats, lons)
+
+    def __len__(self):
+        return len(self.vertex_id)
+
+    def snap(self, lats, lons):
+        """
+        Vértice más cercano para cada punto.
+        Retorna (vertex_ids, distancias_m) como arreglos NumPy del mismo largo.
+        """
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        if len(lats) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        _, idx = self._arbol.query(_a_cartesianas(lats, lons), k=1)
+        dist = haversine_np(lats, lons, self.lat[idx], self.lon[idx])
+        return self.vertex_id[idx], dist
+
+    def snap_uno(self, lat, lon):
+        """Atajo para un solo punto: {'id', 'dist'} como encontrar_vertice_cercano."""
+        ids, dist = self.snap([lat], [lon])
+        return {"id": int(ids[0]), "dist": float(dist[0])}
+
+
+def asignar_vertices(conn, snapper, tabla):
+    """Guarda vertex_id / vertex_dist_m en cada fila de la tabla (oficinas o amenazas)."""
+    if tabla not in TABLAS_SNAP:
+        raise ValueError(f"Tabla no soportada para snapping: {tabla}")
+    cur = conn.cursor()
+    cur.execute(f"""
+        ALTER TABLE {tabla}
+        ADD COLUMN IF NOT EXISTS vertex_id BIGINT,
+        ADD COLUMN IF NOT EXISTS vertex_dist_m DOUBLE PRECISION;
+    """)
+    cur.execute(f"SELECT id, lat, lon FROM {tabla} WHERE lat IS NOT NULL AND lon IS NOT NULL;")
+    filas = cur.fetchall()
+    if not filas:
+        conn.commit()
+        cur.close()
+        return 0
+
+    ids, lats, lons = zip(*filas)
+    vertices, dist = snapper.snap(lats, lons)
+    valores = [(int(i), int(v), float(d)) for i, v, d in zip(ids, vertices, dist)]
+    execute_values(cur, f"""
+        UPDATE {tabla} t
+        SET vertex_id = d.vertex_id, vertex_dist_m = d.dist
+        FROM (VALUES %s) AS d(id, vertex_id, dist)
+        WHERE t.id = d.id;
+    """, valores, page_size=1000)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS {tabla}_vertex_id_idx ON {tabla}(vertex_id);")
+    conn.commit()
+    cur.close()
+    return len(valores)
+
+
+def main(data_dir="/app/out"):
+    print("📌 SNAPPING Oficinas/Amenazas → vértices de la red")
+    conn = get_conn()
+    snapper = SnapperVertices.desde_bd(conn)
+    print(f"   Índice KD-tree con {len(snapper):,} vértices (componente principal)")
+    for tabla in TABLAS_SNAP:
+        try:
+            n = asignar_vertices(conn, snapper, tabla)
+            print(f"✓ {tabla}: {n} filas con vertex_id")
+        except Exception as e:
+            print(f"⚠️  Error asignando vértices en {tabla}: {e}")
+            conn.rollback()
+    conn.close()
+    return True
+
+
+if __name__ == "__main__":
+    main()
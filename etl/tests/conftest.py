@@ -0,0 +1,5 @@
+"""Los módulos del ETL se importan por nombre plano, igual que en /app dentro del contenedor."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
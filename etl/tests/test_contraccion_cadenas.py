@@ -0,0 +1,109 @@
+"""
+RedContraida da los mismos costos que el grafo completo y rutas válidas en
+aristas de red_vial: cuadrícula con calles subdivididas en cadenas de grado 2,
+un ramal sin salida, una cadena que vuelve a su cruce, una cadena paralela y
+un anillo aislado. Se prueban ruta, matriz_costos y ruta_desde_pred, con
+orígenes y destinos en vértices interiores de las cadenas.
+"""
+import random
+
+import numpy as np
+import pytest
+
+from contraccion_cadenas import RedContraida
+from grafo_ruteo import GrafoRuteo
+
+LADO = 5
+
+
+def red_con_cadenas(semilla=7):
+    """(GrafoRuteo, {edge_id: (source, target)})."""
+    rnd = random.Random(semilla)
+    aristas = []
+    siguiente = [LADO * LADO + 1]
+
+    def nuevo():
+        siguiente[0] += 1
+        return siguiente[0] - 1
+
+    def cadena(a, b, tramos):
+        nodos = [a] + [nuevo() for _ in range(tramos - 1)] + [b]
+        for u, v in zip(nodos, nodos[1:]):
+            aristas.append((u, v, round(rnd.uniform(5, 50), 2)))
+
+    cruce = lambda f, c: f * LADO + c + 1
+    for f in range(LADO):
+        for c in range(LADO):
+            if c + 1 < LADO:
+                cadena(cruce(f, c), cruce(f, c + 1), rnd.randint(1, 4))
+            if f + 1 < LADO:
+                cadena(cruce(f, c), cruce(f + 1, c), rnd.randint(1, 4))
+    cadena(cruce(0, 0), nuevo(), 3)                   # ramal sin salida
+    cadena(cruce(2, 2), cruce(2, 2), 4)               # vuelve a su cruce
+    cadena(cruce(1, 1), cruce(1, 2), 3)               # paralela a una calle
+    anillo = nuevo()
+    cadena(anillo, anillo, 5)                         # anillo aislado
+
+    src, tgt, costos = zip(*aristas)
+    ids = np.arange(1, len(aristas) + 1)
+    grafo = GrafoRuteo(ids, np.array(src), np.array(tgt), np.array(costos), np.array(costos))
+    return grafo, {int(e): (s, t) for e, s, t in zip(ids, src, tgt)}
+
+
+def recorrido_valido(filas, extremos, origen, destino):
+    """Cada arista parte donde terminó la anterior, desde origen hasta destino."""
+    v = origen
+    for f in filas:
+        a, b = extremos[f["edge"]]
+        assert f["node"] == v and v in (a, b)
+        v = b if v == a else a
+    assert v == destino
+
+
+@pytest.fixture(scope="module")
+def redes():
+    grafo, extremos = red_con_cadenas()
+    return grafo, RedContraida(grafo), extremos
+
+
+def test_reduce_la_red(redes):
+    grafo, red, _ = redes
+    assert red.n_vertices < grafo.n_vertices
+    assert red.n_aristas < grafo.n_aristas
+
+
+def test_rutas_iguales_al_grafo_completo(redes):
+    grafo, red, extremos = redes
+    rnd = random.Random(1)
+    vertices = [int(v) for v in grafo.vertex_id]
+    pares = [(rnd.choice(vertices), rnd.choice(vertices)) for _ in range(300)]
+    # Interiores de la misma cadena y del anillo aislado
+    k = max(range(len(red.nodos)), key=lambda k: len(red.nodos[k]))
+    interiores = [int(grafo.vertex_id[v]) for v in red.nodos[k][1:-1]]
+    pares += [(interiores[0], interiores[-1]), (interiores[-1], interiores[0])]
+    for o, d in pares:
+        filas_b, _ = grafo.ruta(o, d)
+        filas_r, _ = red.ruta(o, d)
+        assert bool(filas_b) == bool(filas_r)
+        assert sum(f["cost"] for f in filas_r) == pytest.approx(sum(f["cost"] for f in filas_b))
+        assert red.costo_ruta(o, d) == pytest.approx(grafo.costo_ruta(o, d))
+        if filas_r:
+            recorrido_valido(filas_r, extremos, o, d)
+
+
+def test_matriz_igual_al_grafo_completo(redes):
+    grafo, red, extremos = redes
+    rnd = random.Random(2)
+    anillo = int(grafo.vertex_id[red.nodos[-1][2]])  # el anillo aislado se recorre al final
+    paradas = rnd.sample([int(v) for v in grafo.vertex_id if v != anillo], 12) + [anillo]
+    m_base, _, _ = grafo.matriz_costos(paradas)
+    m_red, preds, _ = red.matriz_costos(paradas)
+    np.testing.assert_allclose(m_red, m_base)
+    for i, o in enumerate(paradas):
+        for j, d in enumerate(paradas):
+            filas = red.ruta_desde_pred(preds[i], d)
+            if o == d or not np.isfinite(m_red[i, j]):
+                assert filas == []
+                continue
+            assert sum(f["cost"] for f in filas) == pytest.approx(m_red[i, j])
+            recorrido_valido(filas, extremos, o, d)
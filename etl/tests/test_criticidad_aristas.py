@@ -0,0 +1,61 @@
+"""
+Betweenness exacta de calcular_criticidad contra fuerza bruta: para cada par
+ordenado de oficinas se rutea el camino mínimo y se cuenta una pasada por
+cada arista. Costos al azar (sin empates) y oficinas que comparten vértice.
+"""
+import random
+
+import numpy as np
+import pytest
+
+from criticidad_aristas import calcular_criticidad
+from grafo_ruteo import GrafoRuteo
+
+LADO = 7
+
+
+def red_azar(semilla):
+    """Cuadrícula LADO×LADO con costos al azar y algunas calles de menos."""
+    rnd = random.Random(semilla)
+    src, tgt = [], []
+    for f in range(LADO):
+        for c in range(LADO):
+            v = f * LADO + c + 1
+            if c + 1 < LADO and rnd.random() > 0.15:
+                src.append(v); tgt.append(v + 1)
+            if f + 1 < LADO and rnd.random() > 0.15:
+                src.append(v); tgt.append(v + LADO)
+    costos = np.array([rnd.uniform(10, 100) for _ in src])
+    return GrafoRuteo(np.arange(1, len(src) + 1), np.array(src), np.array(tgt), costos, costos)
+
+
+def fuerza_bruta(grafo, oficinas):
+    total = np.zeros(grafo.n_aristas)
+    for o in oficinas:
+        for d in oficinas:
+            if o == d:
+                continue
+            filas, _ = grafo.ruta(o, d)
+            for f in filas:
+                total[grafo.indice_arista(f["edge"])] += 1
+    return total
+
+
+@pytest.mark.parametrize("semilla", range(5))
+def test_exacta_igual_a_fuerza_bruta(semilla):
+    grafo = red_azar(semilla)
+    rnd = random.Random(100 + semilla)
+    vertices = [int(v) for v in grafo.vertex_id]
+    oficinas = rnd.sample(vertices, 10)
+    oficinas += oficinas[:2]  # dos vértices con dos oficinas cada uno
+    pares, exacta = calcular_criticidad(grafo, oficinas, muestra=0, procesos=1)
+    assert exacta
+    np.testing.assert_allclose(pares, fuerza_bruta(grafo, oficinas))
+
+
+def test_pool_no_cambia_el_resultado():
+    grafo = red_azar(11)
+    oficinas = random.Random(3).sample([int(v) for v in grafo.vertex_id], 12)
+    uno, _ = calcular_criticidad(grafo, oficinas, muestra=0, procesos=1)
+    varios, _ = calcular_criticidad(grafo, oficinas, muestra=0, procesos=3)
+    np.testing.assert_allclose(uno, varios)
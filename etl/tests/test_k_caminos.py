@@ -0,0 +1,69 @@
+"""
+GrafoRuteo.k_caminos (Yen) contra fuerza bruta: en grafos chicos al azar se
+enumeran todos los caminos sin ciclos y los k más baratos deben tener los
+mismos costos que los de Yen, también con el límite de costo.
+"""
+import itertools
+import random
+
+import numpy as np
+import pytest
+
+from grafo_ruteo import GrafoRuteo
+
+
+def grafo_azar(semilla, n=8, m=15):
+    rnd = random.Random(semilla)
+    pares = rnd.sample(list(itertools.combinations(range(1, n + 1), 2)), m)
+    costos = [round(rnd.uniform(1, 10), 3) for _ in pares]
+    src, tgt = zip(*pares)
+    grafo = GrafoRuteo(np.arange(1, m + 1), np.array(src), np.array(tgt), np.array(costos), np.array(costos))
+    return grafo, list(zip(range(1, m + 1), src, tgt, costos))
+
+
+def caminos_simples(aristas, origen, destino):
+    """Costos de todos los caminos sin vértices repetidos (no dirigido)."""
+    vecinos = {}
+    for e, a, b, c in aristas:
+        vecinos.setdefault(a, []).append((b, c))
+        vecinos.setdefault(b, []).append((a, c))
+    costos = []
+
+    def dfs(v, visitados, costo):
+        if v == destino:
+            costos.append(costo)
+            return
+        for w, c in vecinos.get(v, []):
+            if w not in visitados:
+                dfs(w, visitados | {w}, costo + c)
+
+    dfs(origen, {origen}, 0.0)
+    return sorted(costos)
+
+
+@pytest.mark.parametrize("semilla", range(20))
+def test_yen_igual_a_fuerza_bruta(semilla):
+    grafo, aristas = grafo_azar(semilla)
+    origen, destino = 1, 8
+    todos = caminos_simples(aristas, origen, destino)
+    k = 5
+    caminos = grafo.k_caminos(origen, destino, k=k)
+    assert [c for c, _ in caminos] == pytest.approx(todos[:k])
+    for costo, filas in caminos:
+        # Camino continuo, sin vértices repetidos y con el costo informado
+        assert sum(f["cost"] for f in filas) == pytest.approx(costo)
+        nodos = [f["node"] for f in filas]
+        assert nodos[0] == origen and len(set(nodos)) == len(nodos)
+        assert destino not in nodos
+
+
+@pytest.mark.parametrize("semilla", range(10))
+def test_yen_respeta_limite(semilla):
+    grafo, aristas = grafo_azar(semilla)
+    todos = caminos_simples(aristas, 1, 8)
+    if not todos:
+        pytest.skip("sin camino")
+    limite = todos[0] * 1.5
+    caminos = grafo.k_caminos(1, 8, k=10, limite=limite)
+    esperados = [c for c in todos if c <= limite][:10]
+    assert [c for c, _ in caminos] == pytest.approx(esperados)
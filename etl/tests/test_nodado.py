@@ -0,0 +1,78 @@
+"""
+nodar_features corta las vías en los nodos interiores compartidos: cruces
+entre vías distintas, vías que vuelven a pasar por un nodo propio y rotondas
+con accesos. Los tramos conservan propiedades y orden (segmento), cubren la
+vía completa y volver a nodar no cambia nada.
+"""
+from etl_infra_osm import nodar_features
+
+
+def via(osm_id, *puntos, **props):
+    return {"type": "Feature", "geometry": {"type": "LineString", "coordinates": [list(p) for p in puntos]},
+            "properties": dict(props, osm_id=osm_id)}
+
+
+def tramos(features, osm_id):
+    return [t for t in features if t["properties"]["osm_id"] == osm_id]
+
+
+def reconstruir(partes):
+    """Une los tramos de una vía en orden: el inicio de cada uno es el final del anterior."""
+    coords = list(partes[0]["geometry"]["coordinates"])
+    for t in partes[1:]:
+        assert t["geometry"]["coordinates"][0] == coords[-1]
+        coords += t["geometry"]["coordinates"][1:]
+    return coords
+
+
+def test_cruce_con_nodo_compartido():
+    a = via(1, (0, 0), (1, 0), (2, 0), nombre="Alameda")
+    b = via(2, (1, -1), (1, 0), (1, 1), nombre="Ahumada")
+    salida = list(nodar_features([a, b]))
+    for original in (a, b):
+        partes = tramos(salida, original["properties"]["osm_id"])
+        assert [p["properties"]["segmento"] for p in partes] == [0, 1]
+        assert all(p["properties"]["nombre"] == original["properties"]["nombre"] for p in partes)
+        assert partes[0]["geometry"]["coordinates"][-1] == [1, 0]
+        assert reconstruir(partes) == original["geometry"]["coordinates"]
+
+
+def test_cruce_sin_nodo_compartido_no_se_corta():
+    # Se cruzan en (1, 0) pero ninguna tiene ahí un nodo (puente, paso bajo nivel)
+    salida = list(nodar_features([via(1, (0, 0), (2, 0)), via(2, (1, -1), (1, 1))]))
+    assert len(salida) == 2
+
+
+def test_via_que_vuelve_a_pasar_por_su_nodo():
+    # A B C D B E: el lazo B-C-D-B queda como un tramo entre dos cortes en B
+    v = via(7, (0, 0), (1, 0), (2, 1), (1, 2), (1, 0), (3, 0))
+    partes = list(nodar_features([v]))
+    assert [p["geometry"]["coordinates"] for p in partes] == [
+        [[0, 0], [1, 0]],
+        [[1, 0], [2, 1], [1, 2], [1, 0]],
+        [[1, 0], [3, 0]],
+    ]
+    assert [p["properties"]["segmento"] for p in partes] == [0, 1, 2]
+
+
+def test_rotonda_cerrada_con_acceso():
+    rotonda = via(10, (0, 1), (1, 0), (0, -1), (-1, 0), (0, 1), junction="roundabout")
+    acceso = via(11, (3, 0), (1, 0))
+    salida = list(nodar_features([rotonda, acceso]))
+    partes = tramos(salida, 10)
+    # El acceso llega a un nodo interior de la rotonda: se corta ahí; el cierre (0, 1) no es interior
+    assert [p["geometry"]["coordinates"][0] for p in partes] == [[0, 1], [1, 0]]
+    assert reconstruir(partes) == rotonda["geometry"]["coordinates"]
+    assert len(tramos(salida, 11)) == 1
+
+
+def test_idempotente_e_ignora_no_lineas():
+    features = [
+        via(1, (0, 0), (1, 0), (2, 0), (3, 0)),
+        via(2, (1, -1), (1, 0), (1, 1)),
+        via(3, (2, -1), (2, 0), (2, 1), (2, 0.5), (2, 0)),
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [0, 0]}, "properties": {}},
+    ]
+    una = list(nodar_features(features))
+    assert all(f["geometry"]["type"] == "LineString" for f in una)
+    assert list(nodar_features(una)) == una
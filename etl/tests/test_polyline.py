@@ -0,0 +1,43 @@
+"""
+codificar_polyline / decodificar_polyline: el ejemplo de referencia del
+algoritmo de Google y la ida y vuelta sobre coordenadas de Santiago, con
+precisión 5 y 6, puntos repetidos y cambios de signo.
+"""
+import random
+
+import pytest
+
+from salida_ruta import codificar_polyline, decodificar_polyline
+
+# Ejemplo de la documentación del formato (lat, lon) = (38.5, -120.2), (40.7, -120.95), (43.252, -126.453)
+REFERENCIA = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+REFERENCIA_TEXTO = "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+def test_ejemplo_de_referencia():
+    assert codificar_polyline(REFERENCIA) == REFERENCIA_TEXTO
+    for punto, esperado in zip(decodificar_polyline(REFERENCIA_TEXTO), REFERENCIA):
+        assert punto == pytest.approx(esperado)
+
+
+def test_vacia():
+    assert codificar_polyline([]) == ""
+    assert decodificar_polyline("") == []
+
+
+@pytest.mark.parametrize("precision", [5, 6])
+def test_ida_y_vuelta(precision):
+    rnd = random.Random(precision)
+    coords = [[rnd.uniform(-70.75, -70.55), rnd.uniform(-33.55, -33.38)] for _ in range(500)]
+    coords += [coords[-1], coords[-1]]              # puntos repetidos (delta 0)
+    coords += [[0.000004, -0.000004], [-0.3, 0.2]]  # cruces de signo y valores que redondean a 0
+    vuelta = decodificar_polyline(codificar_polyline(coords, precision), precision)
+    assert len(vuelta) == len(coords)
+    tolerancia = 0.5 / 10 ** precision + 1e-12
+    for (lon, lat), (lon2, lat2) in zip(coords, vuelta):
+        assert abs(lon - lon2) <= tolerancia and abs(lat - lat2) <= tolerancia
+
+
+def test_recodificar_es_estable():
+    texto = codificar_polyline([[-70.6504, -33.4378], [-70.6489, -33.4372], [-70.6475, -33.4401]])
+    assert codificar_polyline(decodificar_polyline(texto)) == texto
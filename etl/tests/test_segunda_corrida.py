@@ -0,0 +1,88 @@
+"""
+Una segunda corrida del ETL sobre la misma extracción no recalcula nada:
+los ids de oficinas se conservan (loader_metadata hace upsert), la versión de
+topología no sube (refresco incremental sin cambios) y ni distancias_oficinas
+ni isocronas tienen oficinas pendientes.
+
+Necesita la BD del docker-compose con el pipeline ya corrido una vez y las
+extracciones en OUT_DIR (notarios.geojson, sii.geojson, infraestructura.geojson);
+sin eso se omite.
+"""
+import os
+
+import psycopg2
+import pytest
+
+OUT_DIR = os.getenv("OUT_DIR", "/app/out")
+
+
+@pytest.fixture(scope="module")
+def conn():
+    try:
+        conn = psycopg2.connect(
+            host=os.getenv("PGHOST","db"), port=int(os.getenv("PGPORT","5432")),
+            dbname=os.getenv("PGDATABASE","ruteo_resiliente"),
+            user=os.getenv("PGUSER","postgres"), password=os.getenv("PGPASSWORD","postgres"),
+            connect_timeout=3
+        )
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"sin PostgreSQL: {e}")
+    cur = conn.cursor()
+    cur.execute("SELECT to_regclass('red_vial_vertices_pgr') IS NOT NULL AND to_regclass('oficinas') IS NOT NULL;")
+    cargada = cur.fetchone()[0]
+    cur.close()
+    if not cargada:
+        conn.close()
+        pytest.skip("BD sin cargar: correr run_etl.py primero")
+    if not all(os.path.exists(os.path.join(OUT_DIR, f)) for f in ("notarios.geojson", "sii.geojson", "infraestructura.geojson")):
+        conn.close()
+        pytest.skip(f"sin extracciones en {OUT_DIR}")
+    yield conn
+    conn.close()
+
+
+def _pasada(conn, out_dir):
+    """
+    Pasos 2.1-2.5 de run_etl con la red en modo incremental + isócronas.
+    Retorna (resultado de actualizar_distancias, oficinas con isócrona pendiente antes de calcularlas).
+    """
+    import distancias_oficinas
+    import isocronas
+    import loader_infraestructura
+    import loader_metadata
+    import snapping
+    from cache_rutas import versiones
+    from etl_ruta_dijkstra import CONSIDERA_AMENAZAS
+    loader_infraestructura.main(OUT_DIR, carga="incremental")
+    loader_metadata.main(OUT_DIR)
+    snapping.main(OUT_DIR)
+    r = distancias_oficinas.actualizar_distancias(conn)
+    cur = conn.cursor()
+    isocronas.ensure_tabla(cur)
+    pendientes = isocronas.oficinas_pendientes(cur, versiones(cur)[0], CONSIDERA_AMENAZAS)
+    conn.commit()
+    cur.close()
+    isocronas.main(out_dir)
+    return r, pendientes
+
+
+def _estado(conn):
+    from cache_rutas import versiones
+    cur = conn.cursor()
+    cur.execute("SELECT id, tipo, nombre, lat, lon, vertex_id FROM oficinas ORDER BY id;")
+    oficinas = cur.fetchall()
+    version_topologia, _ = versiones(cur)
+    conn.commit()
+    cur.close()
+    return oficinas, version_topologia
+
+
+def test_segunda_corrida_no_recalcula(conn, tmp_path):
+    # Primera pasada: deja todo al día (la BD puede venir de una carga anterior)
+    _pasada(conn, str(tmp_path))
+    oficinas, version = _estado(conn)
+
+    r, pendientes = _pasada(conn, str(tmp_path))
+    assert _estado(conn) == (oficinas, version)
+    assert r["recalculadas"] == 0
+    assert pendientes == []
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Topología directa: escribe red_vial.source/target y red_vial_vertices_pgr
+desde el diccionario de nodos de etl_infra_osm (nodos deduplicados por
+coordenada, infraestructura.json) con COPY, sin pgr_createTopology.
+
+Dos tramos se conectan si comparten exactamente la coordenada de un extremo
+(6 decimales, como la deduplicación de nodos); como las vías llegan nodadas
+(etl_infra_osm.nodar_features), eso cubre todo nodo compartido en OSM. No hay
+tolerancia que una extremos cercanos pero distintos.
+La tabla de vértices tiene las mismas columnas que crea pgr_createTopology
+(id, cnt, chk, ein, eout, the_geom), así que el resto del ETL no cambia.
+
+Se usa con TOPOLOGIA_MODO=directa en loader_infraestructura y fix_topology.
+"""
+import csv
+import io
+import json
+import os
+
+from etl_infra_osm import clave_nodo
+
+TOPOLOGIA_MODO = os.getenv("TOPOLOGIA_MODO", "pgr")  # "pgr" | "directa"
+
+
+def ids_nodos(data_dir, features=None):
+    """
+    {clave de coordenada: id de vértice} a partir de los nodos de infraestructura.json
+    ("N0" → 1: pgRouting usa ids positivos). Si el archivo no está, se rearma el
+    diccionario recorriendo las features en el mismo orden que transform_to_nodes_edges.
+    """
+    ruta = os.path.join(data_dir, "infraestructura.json")
+    if os.path.exists(ruta):
+        with open(ruta, encoding="utf-8") as f:
+            nodos = json.load(f).get("nodos", [])
+        return {clave_nodo(n["lon"], n["lat"]): int(n["id"][1:]) + 1 for n in nodos}
+    ids = {}
+    for feat in features or []:
+        for lon, lat in feat["geometry"]["coordinates"]:
+            ids.setdefault(clave_nodo(lon, lat), len(ids) + 1)
+    return ids
+
+
+def copiar_csv(cur, tabla, columnas, filas):
+    """COPY ... FROM STDIN en formato CSV (campo vacío sin comillas = NULL)."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(filas)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {tabla} ({', '.join(columnas)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def cargar_red_directa(cur, features, nodos):
+    """
+    Inserta las vías con source/target ya resueltos y crea red_vial_vertices_pgr
+    con los vértices usados como extremo. Retorna (segmentos, vértices).
+    """
+    filas, vertices = [], {}
+    for feat in features:
+        geom = feat.get("geometry")
+        props = feat.get("properties", {})
+        if not geom or geom.get("type") != "LineString" or len(geom["coordinates"]) < 2:
+            continue
+        coords = geom["coordinates"]
+        extremos = []
+        for lon, lat in (coords[0], coords[-1]):
+            clave = clave_nodo(lon, lat)
+            vid = nodos.get(clave)
+            if vid is None:  # nodo ausente del diccionario (archivos de corridas distintas)
+                vid = nodos[clave] = max(nodos.values(), default=0) + 1
+            vertices.setdefault(vid, (lon, lat))
+            extremos.append(vid)
+        wkt = "SRID=4326;LINESTRING(" + ", ".join(f"{lon} {lat}" for lon, lat in coords) + ")"
+        largo = props.get("length_m")
+        filas.append((props.get("osm_id"), props.get("segmento"), props.get("nombre", "Sin nombre"),
+                      props.get("tipo_via", "unknown"), extremos[0], extremos[1], wkt, largo, largo, largo))
+
+    cur.execute("ALTER TABLE red_vial ADD COLUMN IF NOT EXISTS source INTEGER, ADD COLUMN IF NOT EXISTS target INTEGER;")
+    copiar_csv(cur, "red_vial", ("osm_id", "segmento", "nombre", "tipo_via", "source", "target", "geom",
+                                 "length_m", "costo", "reverse_costo"), filas)
+    crear_tabla_vertices(cur)
+    copiar_csv(cur, "red_vial_vertices_pgr", ("id", "the_geom"),
+               [(vid, f"SRID=4326;POINT({lon} {lat})") for vid, (lon, lat) in vertices.items()])
+    finalizar_tabla_vertices(cur)
+    return len(filas), len(vertices)
+
+
+def crear_tabla_vertices(cur):
+    """red_vial_vertices_pgr vacía con el esquema de pgr_createTopology."""
+    cur.execute("""
+        DROP TABLE IF EXISTS red_vial_vertices_pgr CASCADE;
+        CREATE TABLE red_vial_vertices_pgr (
+          id BIGSERIAL PRIMARY KEY,
+          cnt INTEGER,
+          chk INTEGER,
+          ein INTEGER,
+          eout INTEGER,
+          the_geom geometry(Point, 4326)
+        );
+    """)
+
+
+def finalizar_tabla_vertices(cur):
+    """Índices y secuencia tras la carga (como deja la tabla pgr_createTopology)."""
+    cur.execute("""
+        SELECT setval(pg_get_serial_sequence('red_vial_vertices_pgr', 'id'), COALESCE(MAX(id), 0) + 1, false)
+        FROM red_vial_vertices_pgr;
+        CREATE INDEX IF NOT EXISTS red_vial_vertices_pgr_the_geom_idx ON red_vial_vertices_pgr USING GIST(the_geom);
+        ANALYZE red_vial_vertices_pgr;
+        ANALYZE red_vial;
+    """)
+
+
+def topologia_por_extremos(cur, rows_where="true"):
+    """
+    Variante en SQL para redes ya cargadas (fix_topology): vértices = extremos
+    con la misma coordenada a 6 decimales, en una sola pasada sobre red_vial.
+    Retorna la cantidad de vértices.
+    """
+    crear_tabla_vertices(cur)
+    cur.execute("UPDATE red_vial SET source = NULL, target = NULL;")
+    cur.execute(f"""
+        CREATE TEMP TABLE _extremos ON COMMIT DROP AS
+        SELECT id, ST_SnapToGrid(ST_StartPoint(geom), 0.000001) AS inicio,
+                   ST_SnapToGrid(ST_EndPoint(geom), 0.000001) AS fin
+        FROM red_vial WHERE {rows_where};
+        INSERT INTO red_vial_vertices_pgr (the_geom)
+        SELECT inicio FROM _extremos UNION SELECT fin FROM _extremos;
+        CREATE INDEX ON red_vial_vertices_pgr (ST_X(the_geom), ST_Y(the_geom));
+        UPDATE red_vial rv SET source = vs.id, target = vt.id
+        FROM _extremos e
+        JOIN red_vial_vertices_pgr vs ON ST_X(vs.the_geom) = ST_X(e.inicio) AND ST_Y(vs.the_geom) = ST_Y(e.inicio)
+        JOIN red_vial_vertices_pgr vt ON ST_X(vt.the_geom) = ST_X(e.fin) AND ST_Y(vt.the_geom) = ST_Y(e.fin)
+        WHERE rv.id = e.id;
+    """)
+    finalizar_tabla_vertices(cur)
+    cur.execute("SELECT COUNT(*) FROM red_vial_vertices_pgr;")
+    return cur.fetchone()[0]